@@ -0,0 +1,304 @@
+import argparse
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import parfive
+from parfive.utils import FailedDownload
+
+from hermes.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+HOST_STATS = ["files", "bytes", "errors", "throttled", "seconds"]
+
+
+def error_response(error):
+    """The response or exception behind a parfive error.
+
+    parfive wraps an HTTP error in a ``FailedDownload`` and wraps that
+    again before returning it, and multi-part downloads raise
+    ``MultiPartDownloadError`` with the response as ``.response``.
+    """
+    exception = error.exception
+    while isinstance(exception, FailedDownload):
+        exception = exception.exception
+    return getattr(exception, "response", exception)
+
+
+def error_status(error):
+    """HTTP status behind a parfive error, or ``None`` for connection errors."""
+    return getattr(error_response(error), "status", None)
+
+
+def is_retryable(error):
+    """Connection errors, throttling and 5xx are retried; other 4xx are not."""
+    status = error_status(error)
+    return status is None or status >= 500 or status in THROTTLE_STATUSES
+
+
+def retry_after(error):
+    """Seconds asked for by a ``Retry-After`` header, or ``None``."""
+    headers = getattr(error_response(error), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveDownloader:
+    """Download URLs with parfive while tuning the number of connections.
+
+    URLs are fetched in rounds of ``files_per_conn`` files per connection.
+    After each round the connection count follows AIMD: it is halved when
+    the round saw throttling (429/5xx) or more than ``error_threshold``
+    transient failures, and otherwise grows by ``step``, unless the last
+    increase did not raise throughput by ``tolerance``, in which case it
+    steps back. Failed files are retried with exponential backoff, honouring
+    ``Retry-After``, up to ``max_retries`` times; other 4xx responses are not
+    retried.
+
+    The tuned count carries over between ``download`` calls, so one
+    instance should be shared by a whole run. Concurrent calls take turns
+    round by round, so the count bounds the connections of all callers
+    together and every adjustment measures a round of its own.
+    """
+
+    def __init__(
+        self,
+        max_conn=64,
+        min_conn=1,
+        start_conn=8,
+        step=2,
+        decrease=0.5,
+        error_threshold=0.05,
+        tolerance=0.1,
+        files_per_conn=4,
+        max_splits=5,
+        max_retries=5,
+        backoff_factor=1.0,
+        max_backoff=120.0,
+        progress=False,
+    ):
+        self.max_conn = max_conn
+        self.min_conn = min_conn
+        self.conn = max(min_conn, min(start_conn, max_conn))
+        self.step = step
+        self.decrease = decrease
+        self.error_threshold = error_threshold
+        self.tolerance = tolerance
+        self.files_per_conn = files_per_conn
+        self.max_splits = max_splits
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.progress = progress
+        self.throughput = None
+        self._grew = False
+        self.hosts = defaultdict(lambda: dict.fromkeys(HOST_STATS, 0.0))
+        self._lock = threading.Lock()
+        self._round_lock = threading.Lock()
+
+    def download(self, urls, path):
+        """Download ``urls`` into ``path`` and return a ``parfive.Results``."""
+        queue = [(0.0, k, 0, url) for k, url in enumerate(urls)]
+        heapq.heapify(queue)
+        order = len(queue)
+        paths, errors = [], []
+        while queue:
+            wait = queue[0][0] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            # Backoff waits above do not hold up other callers
+            with self._round_lock:
+                batch = []
+                while queue and queue[0][0] <= time.monotonic():
+                    if len(batch) >= self.conn * self.files_per_conn:
+                        break
+                    batch.append(heapq.heappop(queue))
+                attempts = {url: attempt for _, _, attempt, url in batch}
+                results = self._round(list(attempts), path)
+            paths.extend(str(p) for p in results)
+            for error in results.errors:
+                attempt = attempts[error.url] + 1
+                if attempt > self.max_retries or not is_retryable(error):
+                    errors.append(error)
+                    continue
+                count("download_retries")
+                delay = self.backoff_factor * 2 ** (attempt - 1)
+                delay = min(self.max_backoff, max(delay, retry_after(error) or 0))
+                order += 1
+                heapq.heappush(
+                    queue, (time.monotonic() + delay, order, attempt, error.url)
+                )
+        return parfive.Results(paths, errors=errors, urls=list(urls))
+
+    def _round(self, urls, path):
+        conn = self.conn
+        dl = parfive.Downloader(
+            max_conn=conn, max_splits=self.max_splits, progress=self.progress
+        )
+        for url in urls:
+            dl.enqueue_file(url, path=path)
+        start = time.monotonic()
+        results = dl.download()
+        elapsed = max(time.monotonic() - start, 1e-6)
+
+        sizes = {os.path.basename(p): os.path.getsize(p) for p in results}
+        throttled = sum(error_status(e) in THROTTLE_STATUSES for e in results.errors)
+        failed = {error.url for error in results.errors}
+        transient = sum(is_retryable(error) for error in results.errors)
+        with self._lock:
+            for netloc in {urlparse(url).netloc for url in urls}:
+                self.hosts[netloc]["seconds"] += elapsed
+            for url in urls:
+                host = self.hosts[urlparse(url).netloc]
+                if url in failed:
+                    host["errors"] += 1
+                else:
+                    host["files"] += 1
+                    host["bytes"] += sizes.get(os.path.basename(url), 0)
+            for error in results.errors:
+                if error_status(error) in THROTTLE_STATUSES:
+                    self.hosts[urlparse(error.url).netloc]["throttled"] += 1
+            # A round of only permanent errors says nothing about capacity
+            if results or transient:
+                self._adjust(
+                    conn,
+                    sum(sizes.values()) / elapsed,
+                    transient / len(urls),
+                    throttled,
+                )
+        count("download_files", len(results))
+        count("download_bytes", sum(sizes.values()))
+        count("download_errors", len(failed))
+        count("download_throttled", throttled)
+        return results
+
+    def _adjust(self, conn, throughput, error_rate, throttled):
+        if throttled or error_rate > self.error_threshold:
+            self.conn = max(self.min_conn, int(conn * self.decrease))
+        elif self._grew and throughput < self.throughput * (1 + self.tolerance):
+            self.conn = max(self.min_conn, conn - self.step)
+        else:
+            self.conn = min(self.max_conn, conn + self.step)
+        self._grew = self.conn > conn
+        if self.conn != conn:
+            logger.debug(
+                f"{conn} -> {self.conn} connections at {throughput / 1e6:.2f} MB/s, "
+                f"{error_rate:.0%} errors, {throttled} throttled"
+            )
+        self.throughput = throughput
+
+    def host_stats(self):
+        """Files, bytes, errors, throttled responses and MB/s per host."""
+        with self._lock:
+            return {
+                host: {
+                    **stats,
+                    "mb_per_s": stats["bytes"] / max(stats["seconds"], 1e-6) / 1e6,
+                }
+                for host, stats in self.hosts.items()
+            }
+
+    def summary(self):
+        lines = [f"connections: {self.conn}"]
+        for host, stats in self.host_stats().items():
+            lines.append(
+                f"{host}: {int(stats['files'])} files, "
+                f"{stats['bytes'] / 1e6:.1f} MB at {stats['mb_per_s']:.2f} MB/s, "
+                f"{int(stats['errors'])} errors ({int(stats['throttled'])} throttled)"
+            )
+        return "\n".join(lines)
+
+
+class ThrottlingHandler(SimpleHTTPRequestHandler):
+    """Static file handler that answers ``status`` above ``max_inflight`` requests.
+
+    Every request is held for ``latency`` seconds first, so throughput only
+    grows with concurrency up to the throttling limit.
+    """
+
+    max_inflight = 4
+    retry_after = 1
+    latency = 0.05
+    status = 429
+    _inflight = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls._lock:
+            throttled = cls._inflight >= cls.max_inflight
+            if not throttled:
+                cls._inflight += 1
+        time.sleep(cls.latency)
+        if throttled:
+            self.send_response(cls.status)
+            self.send_header("Retry-After", str(self.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            super().do_GET()
+        finally:
+            with cls._lock:
+                cls._inflight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def throttling_server(
+    directory, max_inflight=4, retry_after=1, latency=0.05, port=0, status=429
+):
+    """Serve ``directory`` locally, throttling like a busy SAS mirror.
+
+    Requests above ``max_inflight`` get ``status`` with a ``Retry-After``.
+    """
+    handler = type(
+        "Handler",
+        (ThrottlingHandler,),
+        {
+            "max_inflight": max_inflight,
+            "retry_after": retry_after,
+            "latency": latency,
+            "status": status,
+            "_inflight": 0,
+        },
+    )
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), partial(handler, directory=directory)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download files from a local throttling server to tune concurrency"
+    )
+    parser.add_argument("--serve_dir", type=str, required=True)
+    parser.add_argument("--outdir", type=str, default="adaptive_download")
+    parser.add_argument("--max_inflight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max_conn", type=int, default=64)
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    logger.setLevel(logging.DEBUG)
+    server = throttling_server(args.serve_dir, args.max_inflight, latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base_url}/{name}" for name in sorted(os.listdir(args.serve_dir))]
+    downloader = AdaptiveDownloader(max_conn=args.max_conn, backoff_factor=0.1)
+    results = downloader.download(urls, args.outdir)
+    server.shutdown()
+    print(f"{len(results)} downloaded, {len(results.errors)} failed")
+    print(downloader.summary())
@@ -0,0 +1,354 @@
+import argparse
+import bz2
+import io
+import json
+import os
+import shutil
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from astropy.io.fits.verify import VerifyWarning
+from astropy.wcs import WCS, FITSFixedWarning
+
+warnings.simplefilter("ignore", (VerifyWarning, FITSFixedWarning))
+
+from hermes.cutouts import extract_cutouts, world_to_pixel_centers
+from hermes.frame_reader import frame_scale, read_frame
+
+BANDS = ["u", "g", "r", "i", "z"]
+FRAME_SHAPE = (1489, 2048)
+PIXEL_SCALE = 0.396 / 3600  # degrees per pixel
+MODES = ["sequential", "parallel", "parallel_frame", "fits_processor", "decode"]
+
+
+def frame_header(ra, dec, run, camcol, field, band):
+    """Build an SDSS-like frame header with a TAN WCS centred on (ra, dec)."""
+    header = fits.Header()
+    header["CTYPE1"] = "RA---TAN"
+    header["CTYPE2"] = "DEC--TAN"
+    header["CRPIX1"] = FRAME_SHAPE[1] / 2 + 0.5
+    header["CRPIX2"] = FRAME_SHAPE[0] / 2 + 0.5
+    header["CRVAL1"] = ra
+    header["CRVAL2"] = dec
+    # SDSS frames are rotated so that columns run along the scan direction
+    header["CD1_1"] = 0.0
+    header["CD1_2"] = -PIXEL_SCALE
+    header["CD2_1"] = PIXEL_SCALE
+    header["CD2_2"] = 0.0
+    header["RADESYS"] = "ICRS"
+    header["EQUINOX"] = 2000.0
+    header["RUN"] = run
+    header["CAMCOL"] = camcol
+    header["FIELD"] = field
+    header["FILTER"] = band
+    header["BUNIT"] = "nanomaggy"
+    header["NMGY"] = 0.005
+    return header
+
+
+def write_frame(path, header, rng, scaled=False, compress=False):
+    """Write a synthetic float32 frame, optionally int16 with BSCALE/BZERO."""
+    data = rng.normal(0.0, 0.05, FRAME_SHAPE).astype(np.float32)
+    hdu = fits.PrimaryHDU(data, header=header)
+    if scaled:
+        hdu.scale("int16", bscale=1e-4, bzero=0.0)
+    buffer = io.BytesIO()
+    hdu.writeto(buffer)
+    if compress:
+        with open(f"{path}.bz2", "wb") as f:
+            f.write(bz2.compress(buffer.getvalue()))
+    else:
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+
+
+def make_catalog(
+    frame_dir,
+    n_objects=1000,
+    objects_per_frame=50,
+    scaled=False,
+    compress=False,
+    seed=0,
+):
+    """Write synthetic frames and return a catalog of objects placed on them."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(frame_dir, exist_ok=True)
+    n_frames = -(-n_objects // objects_per_frame)
+
+    catalogs = []
+    for field in range(n_frames):
+        run, camcol, rerun = 94, 6, 301
+        ra, dec = 10.0 + field * FRAME_SHAPE[1] * PIXEL_SCALE, 0.0
+        file_name = f"frame-x-{run:06d}-{camcol}-{field:04d}.fits"
+        for band in BANDS:
+            header = frame_header(ra, dec, run, camcol, field, band)
+            path = f"{frame_dir}/{file_name.replace('frame-x-', f'frame-{band}-')}"
+            if not os.path.exists(path) and not os.path.exists(f"{path}.bz2"):
+                write_frame(path, header, rng, scaled, compress)
+
+        # Scatter objects over the frame, including a margin past the edges
+        n = min(objects_per_frame, n_objects - field * objects_per_frame)
+        wcs = WCS(frame_header(ra, dec, run, camcol, field, "r"))
+        x = rng.uniform(-10, FRAME_SHAPE[1] + 10, n)
+        y = rng.uniform(-10, FRAME_SHAPE[0] + 10, n)
+        obj_ra, obj_dec = wcs.pixel_to_world_values(x, y)
+        first_id = 1237645876861272064 + field * objects_per_frame
+        catalogs.append(
+            pd.DataFrame(
+                {
+                    "objID": first_id + np.arange(n),
+                    "run": run,
+                    "rerun": rerun,
+                    "camcol": camcol,
+                    "field": field,
+                    "ra": obj_ra,
+                    "dec": obj_dec,
+                    "z": rng.uniform(0.1, 1, n),
+                    "zErr": rng.uniform(0, 0.01, n),
+                    "template_photo_z": rng.uniform(0.1, 1, n),
+                    "template_photo_zErr": rng.uniform(0, 0.1, n),
+                    "file_name": file_name,
+                }
+            )
+        )
+    return pd.concat(catalogs, ignore_index=True)
+
+
+def profile_stages(frame_path, ra, dec, shape=(40, 40), repeat=5):
+    """Time each step of the cutout hot path on one frame, in seconds per call."""
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        timings[name] = (time.perf_counter() - start) / repeat
+        return result
+
+    header, data = timed("fits_open", lambda: read_frame(frame_path))
+    wcs = timed("wcs", lambda: WCS(header))
+    x, y, _ = timed("transform", lambda: world_to_pixel_centers(wcs, ra, dec))
+    bscale, bzero, blank = frame_scale(header)
+    stamps = timed(
+        "extract",
+        lambda: extract_cutouts(
+            data, x, y, shape, bscale=bscale, bzero=bzero, blank=blank
+        ),
+    )
+    timed("serialise", lambda: np.save(io.BytesIO(), stamps))
+    return timings
+
+
+def tree_rss(process):
+    """Summed resident memory of ``process`` and all of its descendants."""
+    import psutil
+
+    total = 0
+    try:
+        processes = [process, *process.children(recursive=True)]
+    except psutil.Error:
+        return 0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def _send_result(conn, func, args):
+    try:
+        conn.send((True, func(*args)))
+    except BaseException as e:
+        conn.send((False, e))
+
+
+def measure_peak_rss(func, *args, interval=0.02):
+    """Run ``func(*args)`` in a fresh spawned process and track its memory.
+
+    Returns the result and the peak summed RSS, in MB, of that process and
+    every process it starts, sampled every ``interval`` seconds. Peaks are
+    read from the live process tree because ``ru_maxrss`` carries the
+    parent's high-water mark into spawned children.
+    """
+    try:
+        import psutil
+    except ImportError as e:
+        raise ImportError("Peak memory needs psutil: pip install psutil") from e
+    context = get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_send_result, args=(sender, func, args))
+    process.start()
+    sender.close()
+    root = psutil.Process(process.pid)
+    peak = 0
+    while not receiver.poll(interval):
+        peak = max(peak, tree_rss(root))
+    try:
+        ok, result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"Benchmark process exited with {process.exitcode}")
+    process.join()
+    if not ok:
+        raise result
+    return result, peak / 1024**2
+
+
+def run_mode(mode, workdir, catalog_path, frame_dir, max_workers=None):
+    """Run one mode in the current process and return its wall time.
+
+    Also returns the number of frame files the mode reads: every band for
+    the dataset creators, only r for ``fits_processor``.
+    """
+    os.chdir(workdir)
+    df = pd.read_csv(catalog_path)
+    save_path = f"{workdir}/output_{mode}"
+    shutil.rmtree(save_path, ignore_errors=True)
+    n_frames = df["file_name"].nunique() * len(BANDS)
+
+    start = time.perf_counter()
+    if mode == "sequential":
+        from hermes import dataset_creator
+
+        dataset_creator.save_data(df, save_path, frame_dir)
+    elif mode in ("parallel", "parallel_frame"):
+        from hermes import dataset_creator_parallel
+
+        dataset_creator_parallel.save_data(
+            df,
+            save_path,
+            frame_dir,
+            group_by_frame=mode == "parallel_frame",
+            max_workers=max_workers,
+        )
+    elif mode == "fits_processor":
+        from hermes.fits_to_np import FITSProcessor
+
+        files = (
+            frame_dir + "/" + df["file_name"].str.replace("frame-x-", "frame-r-")
+        ).tolist()
+        n_frames = len(set(files))
+        processor = FITSProcessor(
+            files, ra_list=df["ra"].tolist(), dec_list=df["dec"].tolist()
+        )
+        processor.process_files(output_dir=save_path, max_workers=max_workers)
+    elif mode == "decode":
+        from hermes.decompress import DecodedFrameCache, decode_frames
+
+        paths = [
+            f"{frame_dir}/{name}"
+            for name in os.listdir(frame_dir)
+            if name.endswith(".fits.bz2")
+        ]
+        n_frames = len(paths)
+        cache = DecodedFrameCache(f"{save_path}/cache", max_bytes=float("inf"))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            decode_frames(paths, cache, executor, f"{save_path}/quarantine")
+    else:
+        raise ValueError(f"Invalid mode {mode}. Supported modes are {MODES}")
+    return {"seconds": time.perf_counter() - start, "frames": n_frames}
+
+
+def run_benchmark(
+    workdir="bench",
+    n_objects=1000,
+    objects_per_frame=50,
+    modes=("sequential", "parallel", "parallel_frame", "fits_processor"),
+    scaled=False,
+    compress=False,
+    max_workers=None,
+):
+    """Benchmark every mode on the same synthetic catalog, each in a fresh process."""
+    if compress and set(modes) - {"decode"}:
+        raise ValueError("Compressed frames can only be benchmarked in decode mode")
+    workdir = os.path.abspath(workdir)
+    frame_dir = f"{workdir}/frames_{objects_per_frame}{'_bz2' if compress else ''}"
+    catalog = make_catalog(frame_dir, n_objects, objects_per_frame, scaled, compress)
+    catalog_path = f"{workdir}/catalog.csv"
+    catalog.to_csv(catalog_path, index=False)
+    n_frames = catalog["file_name"].nunique()
+
+    report = {
+        "n_objects": len(catalog),
+        "n_frames": n_frames,
+        "objects_per_frame": objects_per_frame,
+        "modes": {},
+    }
+    if not compress:
+        sample = catalog[catalog["file_name"] == catalog["file_name"].iloc[0]]
+        report["stages"] = profile_stages(
+            f"{frame_dir}/{sample['file_name'].iloc[0].replace('frame-x-', 'frame-r-')}",
+            sample["ra"].to_numpy(),
+            sample["dec"].to_numpy(),
+        )
+
+    # Each mode runs in its own spawned process tree, whose memory is
+    # sampled on its own, so earlier modes do not inflate later peaks
+    for mode in modes:
+        result, peak = measure_peak_rss(
+            run_mode, mode, workdir, catalog_path, frame_dir, max_workers
+        )
+        result["peak_rss_mb"] = peak
+        result["objects_per_sec"] = len(catalog) / result["seconds"]
+        result["frames_per_sec"] = result["frames"] / result["seconds"]
+        report["modes"][mode] = result
+    return report
+
+
+def print_report(report):
+    print(
+        f"{report['n_objects']} objects on {report['n_frames']} frames "
+        f"({report['objects_per_frame']} objects per frame)"
+    )
+    for stage, seconds in report.get("stages", {}).items():
+        print(f"  {stage:<12} {seconds * 1e3:10.3f} ms")
+    print(
+        f"{'mode':<16}{'seconds':>10}{'objects/s':>12}{'frames/s':>10}{'peak MB':>10}"
+    )
+    for mode, result in report["modes"].items():
+        print(
+            f"{mode:<16}{result['seconds']:>10.2f}{result['objects_per_sec']:>12.1f}"
+            f"{result['frames_per_sec']:>10.1f}{result['peak_rss_mb']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cutout hot path")
+    parser.add_argument("--workdir", type=str, default="bench")
+    parser.add_argument("--n_objects", type=int, default=1000)
+    parser.add_argument("--objects_per_frame", type=int, default=50)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=MODES,
+        default=["sequential", "parallel", "parallel_frame", "fits_processor"],
+    )
+    parser.add_argument(
+        "--scaled", action="store_true", help="Store frames as int16 with BSCALE/BZERO"
+    )
+    parser.add_argument(
+        "--compress", action="store_true", help="Write .fits.bz2 frames (decode mode)"
+    )
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        workdir=args.workdir,
+        n_objects=args.n_objects,
+        objects_per_frame=args.objects_per_frame,
+        modes=args.modes,
+        scaled=args.scaled,
+        compress=args.compress,
+        max_workers=args.max_workers,
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,18 +1,7 @@
-# Save the current directory
-ORIGINAL_DIR=$(pwd)
-FITS_DIR="/Users/raahulsingh/work/hermes/hermes/fits"
+# Decompress every .bz2 in FITS_DIR in parallel, moving corrupt archives to
+# FITS_DIR/quarantine instead of leaving them behind.
+# Usage: bz2_unzipper.sh [FITS_DIR] [MAX_WORKERS]
+FITS_DIR="${1:-fits}"
+MAX_WORKERS="${2:-$(nproc)}"
 
-# Change to the FITS_DIR
-cd "$FITS_DIR" || exit
-
-# Process the .bz2 files in parallel
-find . -name "*.bz2" -print0 | xargs -0 -n 1 -P 4 bash -c '
-    for file; do
-        bzip2 -d "$file"
-    done
-' _
-
-# Return to the original directory
-cd "$ORIGINAL_DIR" || exit
-
-#  needs work to remove corrupted files that cannot be unzipped
+python -m hermes.decompress --fits_dir "$FITS_DIR" --max_workers "$MAX_WORKERS"
@@ -0,0 +1,112 @@
+import numpy as np
+
+from hermes.instrumentation import timer
+
+CUTOUT_MODES = ["pad", "shift"]
+
+
+def world_to_pixel_centers(wcs, ra, dec):
+    """Convert arrays of RA/Dec to integer pixel centres in one WCS call."""
+    ra = np.atleast_1d(np.asarray(ra, dtype=np.float64))
+    dec = np.atleast_1d(np.asarray(dec, dtype=np.float64))
+    x, y = wcs.world_to_pixel_values(ra, dec)
+    x = np.atleast_1d(x)
+    y = np.atleast_1d(y)
+
+    # Objects whose coordinates do not project onto the frame are flagged invalid
+    valid = np.isfinite(x) & np.isfinite(y)
+    x_center = np.zeros(x.shape, dtype=np.int64)
+    y_center = np.zeros(y.shape, dtype=np.int64)
+    x_center[valid] = np.round(x[valid])
+    y_center[valid] = np.round(y[valid])
+    return x_center, y_center, valid
+
+
+def extract_cutouts(
+    data,
+    x_center,
+    y_center,
+    shape=(40, 40),
+    mode="pad",
+    out=None,
+    bscale=1.0,
+    bzero=0.0,
+    blank=None,
+):
+    """Extract all stamps centred on (x_center, y_center) from a 2D frame.
+
+    ``mode="pad"`` clips the window to the frame and zero-pads it at the end,
+    as ``get_grid`` always did. ``mode="shift"`` moves the window back inside
+    the frame instead, as ``FITSProcessor`` does. ``bscale`` and ``bzero`` are
+    applied to the stamps only, so ``data`` can be the raw, unscaled frame;
+    raw pixels equal to ``blank`` become NaN.
+    """
+    if mode not in CUTOUT_MODES:
+        raise ValueError(f"Invalid mode {mode}. Supported modes are {CUTOUT_MODES}")
+
+    height, width = shape
+    n_rows, n_cols = data.shape
+    x_center = np.atleast_1d(x_center)
+    y_center = np.atleast_1d(y_center)
+
+    # Define the grid boundaries for every object at once
+    if mode == "pad":
+        xmin = np.maximum(0, x_center - width // 2)
+        xmax = np.minimum(n_cols, x_center + width // 2)
+        ymin = np.maximum(0, y_center - height // 2)
+        ymax = np.minimum(n_rows, y_center + height // 2)
+    else:
+        xmin = np.minimum(np.maximum(0, x_center - width // 2), n_cols - width)
+        xmax = xmin + width
+        ymin = np.minimum(np.maximum(0, y_center - height // 2), n_rows - height)
+        ymax = ymin + height
+
+    rows = ymin[:, None] + np.arange(height)
+    cols = xmin[:, None] + np.arange(width)
+    row_ok = (rows >= 0) & (rows < ymax[:, None]) & (rows < n_rows)
+    col_ok = (cols >= 0) & (cols < xmax[:, None]) & (cols < n_cols)
+
+    if out is None:
+        out = np.empty((len(x_center), height, width), dtype=np.float32)
+
+    # Gather every stamp with one fancy-indexing call, then zero the padding
+    out[...] = data[
+        np.clip(rows, 0, n_rows - 1)[:, :, None],
+        np.clip(cols, 0, n_cols - 1)[:, None, :],
+    ]
+    blanked = out == blank if blank is not None else None
+    if bscale != 1:
+        out *= bscale
+    if bzero != 0:
+        out += bzero
+    if blanked is not None:
+        out[blanked] = np.nan
+    out[~(row_ok[:, :, None] & col_ok[:, None, :])] = 0
+    return out
+
+
+def get_cutouts(
+    data,
+    wcs,
+    ra,
+    dec,
+    shape=(40, 40),
+    mode="pad",
+    out=None,
+    bscale=1.0,
+    bzero=0.0,
+    blank=None,
+):
+    """Cut out stamps for arrays of RA/Dec from one frame.
+
+    Returns the ``(N, height, width)`` float32 stamps and a boolean mask of
+    objects whose coordinates were valid; invalid stamps are all zeros.
+    """
+    with timer("transform"):
+        x_center, y_center, valid = world_to_pixel_centers(wcs, ra, dec)
+    with timer("extract"):
+        out = extract_cutouts(
+            data, x_center, y_center, shape, mode, out, bscale, bzero, blank
+        )
+    out[~valid] = 0
+    return out, valid
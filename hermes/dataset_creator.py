@@ -3,17 +3,24 @@ import warnings
 
 import numpy as np
 import pandas as pd
-from astropy.io import fits
 from astropy.io.fits.verify import VerifyWarning
-from astropy.wcs import WCS, FITSFixedWarning
+from astropy.wcs import FITSFixedWarning
 
 warnings.simplefilter("ignore", (VerifyWarning, FITSFixedWarning))
 import argparse
 import logging
 
-from sdss_access import Path
 from tqdm import tqdm
 
+from hermes.cutouts import get_cutouts
+from hermes.frame_index import FrameIndex
+from hermes.frame_reader import frame_scale, read_frame
+from hermes.instrumentation import METRICS, count, timer
+from hermes.ledger import CUT, Ledger, filter_pending
+from hermes.shards import ShardWriter
+from hermes.url_generator import frame_file_names
+from hermes.wcs_cache import configure_wcs_cache, get_wcs
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 # create file handler which logs even debug messages
@@ -23,65 +30,64 @@ fh.setLevel(logging.INFO)
 er.setLevel(logging.ERROR)
 logger.addHandler(fh)
 logger.addHandler(er)
-import glob
 
 
 def get_grid(file_path, filename, ra, dec, shape=(40, 40)):
-    grids = []
-    for j in ["u", "g", "r", "i", "z"]:
+    grids = np.zeros((*shape, 5), dtype=np.float32)
+    for b, j in enumerate(["u", "g", "r", "i", "z"]):
         current_band = filename.replace("frame-x-", f"frame-{j}-")
-        with fits.open(f"{file_path}/{current_band}") as hdul:
-            header = hdul[0].header
-            data = hdul[0].data
-            if "BSCALE" in header and "BZERO" in header:
-                BSCALE = header["BSCALE"]
-                BZERO = header["BZERO"]
-                data = data * BSCALE + BZERO
-
-        # Get the pixel coordinates for the given RA and Dec
-        wcs = WCS(header)
-        x, y = wcs.world_to_pixel_values(ra, dec)
-        x = x.item() if hasattr(x, "item") else x
-        y = y.item() if hasattr(y, "item") else y
-        x, y = int(round(x)), int(round(y))
-
-        # Define the grid boundaries
-        height, width = shape
-        xmin = max(0, x - width // 2)
-        xmax = min(data.shape[1], x + width // 2)
-        ymin = max(0, y - height // 2)
-        ymax = min(data.shape[0], y + height // 2)
-
-        # Extract the grid
-        grid = data[ymin:ymax, xmin:xmax]
-
-        # Determine the size of the grid to pad
-        pad_y = max(0, height - (ymax - ymin))
-        pad_x = max(0, width - (xmax - xmin))
-
-        # Pad the grid to ensure it's 40x40
-        padded_grid = np.pad(
-            grid, ((0, pad_y), (0, pad_x)), mode="constant", constant_values=0
+        header, data = read_frame(f"{file_path}/{current_band}")
+
+        # Cut out the zero-padded grid around the pixel position of RA and Dec,
+        # scaling only the stamp rather than the whole frame
+        wcs = get_wcs(current_band, header)
+        bscale, bzero, blank = frame_scale(header)
+        _, valid = get_cutouts(
+            data,
+            wcs,
+            ra,
+            dec,
+            shape,
+            grids[None, :, :, b],
+            bscale=bscale,
+            bzero=bzero,
+            blank=blank,
         )
-        # Crop the padded grid to 40x40 if it exceeds the required size
-        grid = padded_grid[:width, :height]
-
-        grids.append(grid)
-    return np.stack(grids, axis=-1).astype(np.float32)
-
-
-def save_data(df, save_path, file_path):
-    os.makedirs(f"{save_path}/X", exist_ok=True)
-    os.makedirs(f"{save_path}/y", exist_ok=True)
-
-    all_files = [f.split("/")[-1] for f in glob.glob(f"{file_path}/frame-*.fits")]
-    for i, row in tqdm(df.iterrows(), total=df.shape[0]):
-        files = []
-        for j in ["u", "g", "r", "i", "z"]:
-            files.append(row["file_name"].replace("frame-x-", f"frame-{j}-"))
-
-        if not all([f in all_files for f in files]):
-            logger.error(f"Files not found for {files}, skipping sample {i}")
+        if not valid[0]:
+            raise ValueError(f"RA/Dec ({ra}, {dec}) has no valid pixel position")
+    return grids
+
+
+def save_data(
+    df,
+    save_path,
+    file_path,
+    output_format="npy",
+    shard_size=10000,
+    ledger_path=None,
+    wcs_cache_size=256,
+    wcs_cache_path=None,
+):
+    configure_wcs_cache(wcs_cache_size, wcs_cache_path)
+    ledger = Ledger(ledger_path) if ledger_path is not None else None
+    n_rows = len(df)
+    df = filter_pending(df, ledger, CUT)
+    count("skipped_done", n_rows - len(df))
+
+    writer = None
+    if output_format == "shards":
+        writer = ShardWriter(save_path, shard_size=shard_size)
+    else:
+        os.makedirs(f"{save_path}/X", exist_ok=True)
+        os.makedirs(f"{save_path}/y", exist_ok=True)
+
+    available = FrameIndex.from_dir(file_path).has_all_bands(df["file_name"])
+    for (i, row), is_available in tqdm(
+        zip(df.iterrows(), available), total=df.shape[0]
+    ):
+        if not is_available:
+            count("skipped_missing_bands")
+            logger.error(f"Files not found for {row['file_name']}, skipping sample {i}")
             continue
 
         obj_id = row["objID"]
@@ -91,12 +97,25 @@ def save_data(df, save_path, file_path):
 
         try:
             grid = get_grid(file_path, row["file_name"], row["ra"], row["dec"])
-            np.save(f"{save_path}/X/{obj_id}.npy", grid)
-            np.save(f"{save_path}/y/{obj_id}.npy", y.values)
-            logger.info(f"Sample {i} with {obj_id} Saved!")
+            with timer("serialise"):
+                if writer is not None:
+                    writer.append([obj_id], grid[None], y.values[None])
+                else:
+                    np.save(f"{save_path}/X/{obj_id}.npy", grid)
+                    np.save(f"{save_path}/y/{obj_id}.npy", y.values)
+            if ledger is not None:
+                ledger.mark([obj_id], CUT)
+            count("cut")
         except Exception as e:
+            count("errors")
             logger.error(f"Error in Sample {i} with {obj_id}: {e}")
 
+    if writer is not None:
+        writer.close()
+    if ledger is not None:
+        ledger.close()
+    logger.info(METRICS.summary())
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -107,19 +126,31 @@ if __name__ == "__main__":
     parser.add_argument(
         "--file_path", type=str, default="ordered_100k/eboss/photoObj/frames/301/94/6"
     )
+    parser.add_argument(
+        "--output_format", type=str, choices=["npy", "shards"], default="npy"
+    )
+    parser.add_argument("--shard_size", type=int, default=10000)
+    parser.add_argument("--ledger_path", type=str, default=None)
+    parser.add_argument(
+        "--wcs_cache_size", type=int, default=256, help="WCS objects kept per process"
+    )
+    parser.add_argument(
+        "--wcs_cache_path",
+        type=str,
+        default=None,
+        help="sqlite store of compact WCS headers shared across runs and workers",
+    )
     args = parser.parse_args()
 
     data = pd.read_csv(args.data_path, index_col=0)
-    sdss_path = Path(release="dr17")
-    data["file_name"] = data.apply(
-        lambda row: sdss_path.url(
-            "frame",
-            run=int(row["run"]),
-            rerun=int(row["rerun"]),
-            camcol=int(row["camcol"]),
-            field=int(row["field"]),
-            filter="x",
-        ).split("/")[-1],
-        axis=1,
+    data["file_name"] = frame_file_names(data)
+    save_data(
+        data.head(),
+        args.save_path,
+        args.file_path,
+        output_format=args.output_format,
+        shard_size=args.shard_size,
+        ledger_path=args.ledger_path,
+        wcs_cache_size=args.wcs_cache_size,
+        wcs_cache_path=args.wcs_cache_path,
     )
-    save_data(data.head(), args.save_path, args.file_path)
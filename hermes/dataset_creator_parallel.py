@@ -4,19 +4,27 @@ import warnings
 
 import numpy as np
 import pandas as pd
-from astropy.io import fits
 from astropy.io.fits.verify import VerifyWarning
-from astropy.wcs import WCS, FITSFixedWarning
+from astropy.wcs import FITSFixedWarning
 
 warnings.simplefilter("ignore", (VerifyWarning, FITSFixedWarning))
 import argparse
-import glob
 import logging
-from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from sdss_access import Path
 from tqdm import tqdm
 
+from hermes.cutouts import get_cutouts
+from hermes.encodings import ENCODINGS
+from hermes.frame_index import load_frame_index
+from hermes.frame_reader import frame_scale, read_frame
+from hermes.instrumentation import MetricsReporter, count, timer
+from hermes.ledger import CUT, Ledger, filter_pending
+from hermes.parallel import bounded_map, frame_chunks
+from hermes.scheduler import SCHEDULES, key_chunks, schedule, tile_keys
+from hermes.shards import ShardWriter
+from hermes.url_generator import frame_file_names
+from hermes.wcs_cache import configure_wcs_cache, get_wcs
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 # create file handler which logs even debug messages
@@ -28,85 +36,240 @@ logger.addHandler(fh)
 logger.addHandler(er)
 
 
+BANDS = ["u", "g", "r", "i", "z"]
+LABELS = ["z", "zErr", "template_photo_z", "template_photo_zErr"]
+OUTPUT_FORMATS = ["npy", "shards"]
+
+
+def read_band(file_path, filename, band):
+    """Return the header and raw memory-mapped pixels of one band of a frame."""
+    current_band = filename.replace("frame-x-", f"frame-{band}-")
+    return read_frame(f"{file_path}/{current_band}")
+
+
 def get_grid(file_path, filename, ra, dec, shape=(40, 40)):
-    grids = []
-    for j in ["u", "g", "r", "i", "z"]:
-        current_band = filename.replace("frame-x-", f"frame-{j}-")
-        with fits.open(f"{file_path}/{current_band}") as hdul:
-            header = hdul[0].header
-            data = hdul[0].data
-            if "BSCALE" in header and "BZERO" in header:
-                BSCALE = header["BSCALE"]
-                BZERO = header["BZERO"]
-                data = data * BSCALE + BZERO
-
-        # Get the pixel coordinates for the given RA and Dec
-        wcs = WCS(header)
-        x, y = wcs.world_to_pixel_values(ra, dec)
-        x = x.item() if hasattr(x, "item") else x
-        y = y.item() if hasattr(y, "item") else y
-        x, y = int(round(x)), int(round(y))
-
-        # Define the grid boundaries
-        height, width = shape
-        xmin = max(0, x - width // 2)
-        xmax = min(data.shape[1], x + width // 2)
-        ymin = max(0, y - height // 2)
-        ymax = min(data.shape[0], y + height // 2)
-
-        # Extract the grid
-        grid = data[ymin:ymax, xmin:xmax]
-
-        # Determine the size of the grid to pad
-        pad_y = max(0, height - (ymax - ymin))
-        pad_x = max(0, width - (xmax - xmin))
-
-        # Pad the grid to ensure it's 40x40
-        padded_grid = np.pad(
-            grid, ((0, pad_y), (0, pad_x)), mode="constant", constant_values=0
+    grids, valid = get_frame_grids(file_path, filename, [ra], [dec], shape)
+    if not valid[0]:
+        raise ValueError(f"RA/Dec ({ra}, {dec}) has no valid pixel position")
+    return grids[0]
+
+
+def get_frame_grids(file_path, filename, ras, decs, shape=(40, 40)):
+    """Cut out every object in a frame, reading each band and its WCS once."""
+    grids = np.zeros((len(ras), *shape, len(BANDS)), dtype=np.float32)
+    valid = np.ones(len(ras), dtype=bool)
+    for b, j in enumerate(BANDS):
+        # Opening the band parses its header anyway, so the cache only saves
+        # building the WCS here
+        header, data = read_band(file_path, filename, j)
+        wcs = get_wcs(filename.replace("frame-x-", f"frame-{j}-"), header)
+        bscale, bzero, blank = frame_scale(header)
+        _, band_valid = get_cutouts(
+            data,
+            wcs,
+            ras,
+            decs,
+            shape,
+            out=grids[..., b],
+            bscale=bscale,
+            bzero=bzero,
+            blank=blank,
         )
-        # Crop the padded grid to 40x40 if it exceeds the required size
-        grid = padded_grid[:width, :height]
+        valid &= band_valid
+    return grids, valid
 
-        grids.append(grid)
-    return np.stack(grids, axis=-1).astype(np.float32)
 
+def save_or_return(obj_ids, grids, labels, valid, save_path):
+    """Save valid cutouts as .npy files, or return them when ``save_path=None``.
 
-def process_row(row, file_path, save_path, all_files):
-    files = []
-    for j in ["u", "g", "r", "i", "z"]:
-        files.append(row["file_name"].replace("frame-x-", f"frame-{j}-"))
+    Always returns a tuple whose first item is the objIDs that were cut.
+    """
+    count("cut", valid.sum())
+    if save_path is None:
+        return obj_ids[valid], grids[valid], labels[valid]
 
-    if not all([f in all_files for f in files]):
-        logger.error(f"Files not found for {files}, skipping sample {row.name}")
-        return
+    with timer("serialise"):
+        for obj_id, grid, y in zip(obj_ids[valid], grids[valid], labels[valid]):
+            np.save(f"{save_path}/X/{obj_id}.npy", grid)
+            np.save(f"{save_path}/y/{obj_id}.npy", y)
+    return (obj_ids[valid],)
+
+
+def process_rows(indices, obj_ids, file_names, ras, decs, labels, file_path, save_path):
+    """Cut out a chunk of objects one at a time."""
+    grids = np.zeros((len(obj_ids), 40, 40, len(BANDS)), dtype=np.float32)
+    valid = np.zeros(len(obj_ids), dtype=bool)
+    for k, (i, obj_id) in enumerate(zip(indices, obj_ids)):
+        try:
+            grids[k] = get_grid(file_path, file_names[k], ras[k], decs[k])
+            valid[k] = True
+        except Exception as e:
+            count("errors")
+            logger.error(f"Error in Sample {i} with {obj_id}: {e}")
+    return save_or_return(obj_ids, grids, labels, valid, save_path)
 
-    obj_id = row["objID"]
-    y = row[["z", "zErr", "template_photo_z", "template_photo_zErr"]].astype(np.float32)
 
+def process_frame(indices, obj_ids, file_name, ras, decs, labels, file_path, save_path):
+    """Cut out all objects of a frame, reading each band once."""
     try:
-        grid = get_grid(file_path, row["file_name"], row["ra"], row["dec"])
-        np.save(f"{save_path}/X/{obj_id}.npy", grid)
-        np.save(f"{save_path}/y/{obj_id}.npy", y.values)
-        logger.info(f"Sample {row.name} with {obj_id} Saved!")
+        grids, valid = get_frame_grids(file_path, file_name, ras, decs)
     except Exception as e:
-        logger.error(f"Error in Sample {row.name} with {obj_id}: {e}")
+        count("errors", len(obj_ids))
+        logger.error(f"Error in frame {file_name}: {e}")
+        return
+
+    count("errors", (~valid).sum())
+    for i, obj_id in zip(indices[~valid], obj_ids[~valid]):
+        logger.error(f"Error in Sample {i} with {obj_id}: invalid coordinates")
+    return save_or_return(obj_ids, grids, labels, valid, save_path)
+
 
+def save_data(
+    df,
+    save_path,
+    file_path,
+    group_by_frame=False,
+    output_format="npy",
+    shard_size=10000,
+    manifest_path=None,
+    chunk_size=64,
+    max_workers=None,
+    max_in_flight=None,
+    ledger_path=None,
+    metrics_path=None,
+    report_interval=60.0,
+    wcs_cache_size=256,
+    wcs_cache_path=None,
+    schedule_by="frame",
+    nside=64,
+    n_parts=1,
+    part=0,
+    encoding="float32",
+):
+    """Cut out every row of ``df`` in parallel.
 
-def save_data(df, save_path, file_path):
-    os.makedirs(f"{save_path}/X", exist_ok=True)
-    os.makedirs(f"{save_path}/y", exist_ok=True)
+    Work is submitted either one frame per task (``group_by_frame``) or
+    ``chunk_size`` rows per task, with at most ``max_in_flight`` tasks pending
+    so parent memory stays flat on large catalogs. Tasks receive plain NumPy
+    arrays rather than pandas rows. With ``ledger_path`` every cut objID is
+    recorded, and rows already cut by an earlier run are skipped. Stage
+    timings and counters are summarised every ``report_interval`` seconds
+    and written to ``metrics_path`` (Prometheus text if it ends in ``.prom``).
+    Every worker configures its WCS cache from ``wcs_cache_size`` and
+    ``wcs_cache_path`` when it starts.
 
-    all_files = [f.split("/")[-1] for f in glob.glob(f"{file_path}/frame-*.fits")]
+    Rows are dispatched in ``schedule_by`` order (see ``hermes.scheduler``)
+    and row chunks never split a frame or tile, so each worker's WCS cache
+    sees whole frames and their neighbours. With ``n_parts`` only partition
+    ``part`` of the catalog is processed. Shards store stamps with
+    ``encoding`` (float32, float16 or per-stamp scaled int16).
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Invalid output format {output_format}. Supported formats are {OUTPUT_FORMATS}"
+        )
+    if encoding != "float32" and output_format != "shards":
+        raise ValueError(f"Encoding {encoding} needs output_format='shards'")
+
+    writer = None
+    if output_format == "shards":
+        # Workers return their cutouts and the parent appends them to the shards
+        writer = ShardWriter(
+            save_path, shard_size=shard_size, n_labels=len(LABELS), encoding=encoding
+        )
+        task_save_path = None
+    else:
+        os.makedirs(f"{save_path}/X", exist_ok=True)
+        os.makedirs(f"{save_path}/y", exist_ok=True)
+        task_save_path = save_path
 
-    with ProcessPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_row, row, file_path, save_path, all_files)
-            for _, row in df.iterrows()
-        ]
+    # Partition before filtering so every run and machine agrees on the split
+    df = schedule(df, schedule_by, nside, n_parts, part)[0]
 
-        for future in tqdm(as_completed(futures), total=len(futures)):
-            future.result()  # this will raise any exceptions encountered during processing
+    # Drop rows with missing bands up front so workers never check the listing
+    index = load_frame_index(file_path, manifest_path)
+    available = index.has_all_bands(df["file_name"])
+    if not available.all():
+        logger.error(
+            f"Files not found for {(~available).sum()} samples, skipping "
+            f"{df.index[~available].tolist()}"
+        )
+    count("skipped_missing_bands", (~available).sum())
+    df = df.loc[available]
+
+    ledger = Ledger(ledger_path) if ledger_path is not None else None
+    n_rows = len(df)
+    df = filter_pending(df, ledger, CUT)
+    count("skipped_done", n_rows - len(df))
+
+    indices = df.index.to_numpy()
+    obj_ids = df["objID"].to_numpy()
+    file_names = df["file_name"].to_numpy()
+    ras = df["ra"].to_numpy(dtype=np.float64)
+    decs = df["dec"].to_numpy(dtype=np.float64)
+    labels = df[LABELS].to_numpy(dtype=np.float32)
+
+    if group_by_frame:
+        # One task per frame so each band is opened and parsed only once
+        chunks = frame_chunks(file_names)
+        tasks = (
+            (
+                indices[rows],
+                obj_ids[rows],
+                file_name,
+                ras[rows],
+                decs[rows],
+                labels[rows],
+                file_path,
+                task_save_path,
+            )
+            for file_name, rows in chunks
+        )
+        func = process_frame
+    else:
+        chunks = key_chunks(tile_keys(df, schedule_by, nside), chunk_size)
+        tasks = (
+            (
+                indices[rows],
+                obj_ids[rows],
+                file_names[rows],
+                ras[rows],
+                decs[rows],
+                labels[rows],
+                file_path,
+                task_save_path,
+            )
+            for rows in chunks
+        )
+        func = process_rows
+
+    reporter = MetricsReporter(metrics_path, report_interval, log=logger)
+    # this will raise any exceptions encountered during processing
+    for result in tqdm(
+        bounded_map(
+            func,
+            tasks,
+            max_workers,
+            max_in_flight,
+            initializer=configure_wcs_cache,
+            initargs=(wcs_cache_size, wcs_cache_path),
+        ),
+        total=len(chunks),
+    ):
+        reporter.maybe_report()
+        if result is None:
+            continue
+        if writer is not None:
+            with timer("serialise"):
+                writer.append(*result)
+        if ledger is not None:
+            ledger.mark(result[0], CUT)
+
+    if writer is not None:
+        writer.close()
+    if ledger is not None:
+        ledger.close()
+    reporter.report()
 
 
 if __name__ == "__main__":
@@ -118,21 +281,100 @@ if __name__ == "__main__":
     parser.add_argument(
         "--file_path", type=str, default="ordered_100k/eboss/photoObj/frames/301/94/6"
     )
+    parser.add_argument(
+        "--group_by_frame",
+        action="store_true",
+        help="Process all objects of a frame in one task",
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=OUTPUT_FORMATS,
+        default="npy",
+        help="Write one .npy per object or append to memory-mapped shards",
+    )
+    parser.add_argument("--shard_size", type=int, default=10000)
+    parser.add_argument(
+        "--encoding",
+        type=str,
+        choices=list(ENCODINGS),
+        default="float32",
+        help="Stamp storage encoding in shards",
+    )
+    parser.add_argument(
+        "--chunk_size", type=int, default=64, help="Rows per task without grouping"
+    )
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument(
+        "--ledger_path",
+        type=str,
+        default=None,
+        help="sqlite progress ledger used to resume interrupted builds",
+    )
+    parser.add_argument(
+        "--max_in_flight", type=int, default=None, help="Maximum pending tasks"
+    )
+    parser.add_argument(
+        "--manifest_path",
+        type=str,
+        default=None,
+        help="sqlite manifest of available frames, built on first use",
+    )
+    parser.add_argument(
+        "--metrics_path",
+        type=str,
+        default=None,
+        help="Write stage timings and counters as JSON, or Prometheus text (.prom)",
+    )
+    parser.add_argument(
+        "--report_interval", type=float, default=60.0, help="Seconds between summaries"
+    )
+    parser.add_argument(
+        "--wcs_cache_size", type=int, default=256, help="WCS objects kept per process"
+    )
+    parser.add_argument(
+        "--wcs_cache_path",
+        type=str,
+        default=None,
+        help="sqlite store of compact WCS headers shared across runs and workers",
+    )
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        choices=SCHEDULES,
+        default="frame",
+        help="Dispatch order: catalog rows, frames, or HEALPix tiles",
+    )
+    parser.add_argument("--nside", type=int, default=64, help="HEALPix nside")
+    parser.add_argument(
+        "--n_parts", type=int, default=1, help="Split the catalog across machines"
+    )
+    parser.add_argument("--part", type=int, default=0, help="Partition to process")
     args = parser.parse_args()
 
     data = pd.read_csv(args.data_path, index_col=0)
-    sdss_path = Path(release="dr17")
-    data["file_name"] = data.apply(
-        lambda row: sdss_path.url(
-            "frame",
-            run=int(row["run"]),
-            rerun=int(row["rerun"]),
-            camcol=int(row["camcol"]),
-            field=int(row["field"]),
-            filter="x",
-        ).split("/")[-1],
-        axis=1,
-    )
+    data["file_name"] = frame_file_names(data)
     # data = data.head(1)
     # data = data.loc[data.index.repeat(100000)].reset_index(drop=True)
-    save_data(data, args.save_path, args.file_path)
+    save_data(
+        data,
+        args.save_path,
+        args.file_path,
+        group_by_frame=args.group_by_frame,
+        output_format=args.output_format,
+        shard_size=args.shard_size,
+        manifest_path=args.manifest_path,
+        chunk_size=args.chunk_size,
+        max_workers=args.max_workers,
+        max_in_flight=args.max_in_flight,
+        ledger_path=args.ledger_path,
+        metrics_path=args.metrics_path,
+        report_interval=args.report_interval,
+        wcs_cache_size=args.wcs_cache_size,
+        wcs_cache_path=args.wcs_cache_path,
+        schedule_by=args.schedule,
+        nside=args.nside,
+        n_parts=args.n_parts,
+        part=args.part,
+        encoding=args.encoding,
+    )
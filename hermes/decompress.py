@@ -0,0 +1,266 @@
+import argparse
+import bz2
+import io
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from astropy.io import fits
+from tqdm import tqdm
+
+from hermes.instrumentation import METRICS, call_with_metrics, count, timer
+
+logger = logging.getLogger(__name__)
+
+BZ2_SUFFIX = ".bz2"
+
+
+def decompress_frame(path):
+    """Decompress a .fits.bz2 frame into a bytes buffer."""
+    with open(path, "rb") as f:
+        return bz2.decompress(f.read())
+
+
+def open_frame(path, **kwargs):
+    """Open a frame, decoding .bz2 archives in memory instead of via a temp file."""
+    if path.endswith(BZ2_SUFFIX):
+        return fits.open(io.BytesIO(decompress_frame(path)), **kwargs)
+    return fits.open(path, **kwargs)
+
+
+def decompress_to_file(path, output_path):
+    """Stream-decompress ``path`` into ``output_path``, returning its size."""
+    tmp_path = f"{output_path}.tmp"
+    try:
+        with timer("bz2_decode"), bz2.open(path, "rb") as src, open(
+            tmp_path, "wb"
+        ) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    return os.path.getsize(output_path)
+
+
+def quarantine(path, quarantine_dir):
+    """Move a corrupt archive out of the way so it is never decoded again."""
+    os.makedirs(quarantine_dir, exist_ok=True)
+    target = os.path.join(quarantine_dir, os.path.basename(path))
+    shutil.move(path, target)
+    return target
+
+
+class DecodedFrameCache:
+    """On-disk cache of decoded frames with a size cap in bytes.
+
+    Entries are plain .fits files so readers can memory-map them. Recency
+    is tracked with file mtimes, so the cache survives restarts.
+
+    Callers can ``retain`` frames with the number of catalog rows still
+    waiting for them and ``release`` rows once they are cut. A frame is
+    deleted as soon as its count reaches zero. Eviction to fit the cap only
+    drops unreferenced frames, least recently used first; frames that are
+    still needed are kept even if that exceeds the cap, with a warning.
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._refs = {}
+        self._inflight = {}
+        self._over_budget = False
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = {
+            entry.name: entry.stat().st_size
+            for entry in os.scandir(cache_dir)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        }
+
+    @property
+    def size(self):
+        return sum(self._sizes.values())
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._sizes and os.path.exists(self.path(name))
+
+    def get(self, name):
+        """Return the cached path of a decoded frame, or ``None`` on a miss."""
+        with self._lock:
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                self._sizes.pop(name, None)
+            if name not in self._sizes:
+                self.misses += 1
+                count("cache_miss")
+                return None
+            self.hits += 1
+            count("cache_hit")
+        return self.path(name)
+
+    def add(self, name, size):
+        """Register a file written to ``path(name)`` and evict to fit the cap."""
+        with self._lock:
+            self._sizes[name] = size
+            self._evict()
+
+    def claim(self, name):
+        """Claim ``name`` for fetching, or get an event to wait on for it.
+
+        Returns ``None`` if the caller should fetch the frame and ``settle``
+        it afterwards. Otherwise the frame is cached or being fetched by an
+        earlier claimant, and the returned event is set once it is ready.
+        """
+        with self._lock:
+            if name in self._inflight:
+                return self._inflight[name]
+            if name in self._sizes and os.path.exists(self.path(name)):
+                event = threading.Event()
+                event.set()
+                return event
+            self._inflight[name] = threading.Event()
+            return None
+
+    def settle(self, name):
+        """Wake callers waiting on a claimed frame, whether or not it arrived."""
+        with self._lock:
+            event = self._inflight.pop(name, None)
+        if event is not None:
+            event.set()
+
+    def retain(self, counts):
+        """Add ``{name: rows}`` references, pinning those frames in the cache."""
+        with self._lock:
+            for name, n in counts.items():
+                self._refs[name] = self._refs.get(name, 0) + int(n)
+
+    def release(self, name, n=1):
+        """Drop ``n`` references to a frame and delete it once none are left."""
+        with self._lock:
+            left = self._refs.get(name, 0) - n
+            if left > 0:
+                self._refs[name] = left
+                return
+            self._refs.pop(name, None)
+            if name in self._sizes:
+                del self._sizes[name]
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+                count("cache_released")
+
+    def _mtime(self, name):
+        try:
+            return os.stat(self.path(name)).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            self._over_budget = False
+            return
+        unneeded = [name for name in self._sizes if name not in self._refs]
+        for name in sorted(unneeded, key=self._mtime):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(name)
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+        if total > self.max_bytes and not self._over_budget:
+            count("cache_over_budget")
+            logger.warning(
+                f"Decoded frame cache holds {total / 1e9:.1f} GB of frames still "
+                f"needed, over its {self.max_bytes / 1e9:.1f} GB cap"
+            )
+        self._over_budget = total > self.max_bytes
+
+
+def decode_frames(paths, cache, executor, quarantine_dir="quarantine"):
+    """Decode .fits.bz2 frames into ``cache`` using a process pool ``executor``.
+
+    Returns a mapping of archive path to decoded path. Cached frames are not
+    decoded again, and archives that fail to decode are moved to
+    ``quarantine_dir`` and left out of the result.
+    """
+    decoded = {}
+    pending = {}
+    for path in paths:
+        name = os.path.basename(path)[: -len(BZ2_SUFFIX)]
+        cached = cache.get(name)
+        if cached is not None:
+            decoded[path] = cached
+        else:
+            pending[path] = name
+
+    futures = {
+        executor.submit(
+            call_with_metrics, decompress_to_file, path, cache.path(name)
+        ): path
+        for path, name in pending.items()
+    }
+    for future in as_completed(futures):
+        path = futures[future]
+        try:
+            size, metrics = future.result()
+        except Exception as e:
+            count("corrupt")
+            logger.error(f"Corrupt archive {path}: {e}")
+            quarantine(path, quarantine_dir)
+            continue
+        METRICS.merge(metrics)
+        cache.add(pending[path], size)
+        decoded[path] = cache.path(pending[path])
+    return decoded
+
+
+def decompress_dir(fits_dir, max_workers=None, quarantine_dir=None):
+    """Decompress every .bz2 in ``fits_dir`` in place, like ``bzip2 -d``."""
+    quarantine_dir = quarantine_dir or os.path.join(fits_dir, "quarantine")
+    paths = [
+        os.path.join(fits_dir, name)
+        for name in os.listdir(fits_dir)
+        if name.endswith(BZ2_SUFFIX)
+    ]
+    corrupt = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(decompress_to_file, path, path[: -len(BZ2_SUFFIX)]): path
+            for path in paths
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            path = futures[future]
+            try:
+                future.result()
+                os.remove(path)
+            except Exception as e:
+                logger.error(f"Corrupt archive {path}: {e}")
+                corrupt.append(quarantine(path, quarantine_dir))
+    return corrupt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decompress .fits.bz2 frames")
+    parser.add_argument("--fits_dir", type=str, default="fits")
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument("--quarantine_dir", type=str, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    corrupt = decompress_dir(args.fits_dir, args.max_workers, args.quarantine_dir)
+    if corrupt:
+        logger.info(f"Quarantined {len(corrupt)} corrupt archives")
@@ -0,0 +1,305 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from hermes.adaptive_download import AdaptiveDownloader
+from hermes.dataset_creator_parallel import save_data
+from hermes.decompress import decompress_dir
+from hermes.download_planner import plan_downloads
+from hermes.encodings import ENCODINGS
+from hermes.integrity import download_verified
+from hermes.ledger import Ledger
+from hermes.scheduler import healpix_index
+from hermes.shards import INDEX_FILE, META_FILE, shard_files
+from hermes.url_generator import (
+    BANDS,
+    FITS_BASE_URL,
+    FRAME_COLUMNS,
+    frame_codes,
+    frame_file_names,
+)
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = ["frame", "healpix"]
+MODES = ["node", "merge", "local"]
+
+
+def node_of(df, n_nodes, by="frame", nside=16):
+    """Node that owns each row, from a crc32 of its frame or HEALPix tile.
+
+    The hash depends only on the key, so the split is the same on every
+    machine and stays put when rows are added to the catalog. With
+    ``frame`` no frame is downloaded by two nodes; ``healpix`` keeps
+    neighbouring sky together, but a frame straddling two tiles is fetched
+    by both of their nodes.
+    """
+    if by == "frame":
+        frames, inverse = frame_codes(df)
+        keys = frames[FRAME_COLUMNS].astype(str).agg("-".join, axis=1)
+    elif by == "healpix":
+        pixels = healpix_index(df["ra"].to_numpy(), df["dec"].to_numpy(), nside)
+        tiles, inverse = np.unique(pixels, return_inverse=True)
+        keys = pd.Series(tiles).astype(str)
+    else:
+        raise ValueError(f"Invalid partition {by}. Supported are {PARTITIONS}")
+    hashes = np.array([zlib.crc32(key.encode()) for key in keys], dtype=np.int64)
+    return (hashes % n_nodes)[inverse.reshape(-1)]
+
+
+def node_paths(work_dir, node):
+    """Working directory layout of one node."""
+    root = os.path.join(work_dir, f"node_{node:03d}")
+    return {
+        "root": root,
+        "catalog": os.path.join(root, "catalog.csv"),
+        "fits": os.path.join(root, "fits"),
+        "dataset": os.path.join(root, "dataset"),
+        "ledger": os.path.join(root, "progress.sqlite"),
+        "quarantine": os.path.join(root, "quarantine"),
+    }
+
+
+def run_node(
+    df,
+    node,
+    n_nodes,
+    work_dir,
+    by="frame",
+    nside=16,
+    bands=BANDS,
+    base_url=FITS_BASE_URL,
+    max_conn=64,
+    download=True,
+    fits_dir=None,
+    **save_kwargs,
+):
+    """Download and cut out the rows of ``df`` owned by ``node``.
+
+    The node's catalog, frames, shards and ledger all live under its own
+    ``node_paths`` directory, so a rerun resumes from its ledger and nodes
+    never share state. Without ``download`` frames are read from
+    ``fits_dir`` instead. Extra keyword arguments go to ``save_data``.
+    """
+    paths = node_paths(work_dir, node)
+    fits_dir = fits_dir or paths["fits"]
+    os.makedirs(paths["root"], exist_ok=True)
+    os.makedirs(fits_dir, exist_ok=True)
+    df = df.loc[node_of(df, n_nodes, by, nside) == node]
+    if "file_name" not in df:
+        df = df.assign(file_name=frame_file_names(df))
+    df.to_csv(paths["catalog"], index=False)
+    logger.info(f"Node {node}/{n_nodes}: {len(df)} objects")
+
+    if download:
+        with Ledger(paths["ledger"]) as ledger:
+            plan = plan_downloads(df, fits_dir, bands, base_url, ledger=ledger)
+            files, bad = download_verified(
+                AdaptiveDownloader(max_conn=max_conn),
+                plan["url"].tolist(),
+                fits_dir,
+                ledger=ledger,
+                quarantine_dir=paths["quarantine"],
+            )
+        logger.info(
+            f"Node {node}: {len(files)} frames verified, "
+            f"{len(files.errors)} failed, {len(bad)} corrupt"
+        )
+        decompress_dir(fits_dir, quarantine_dir=paths["quarantine"])
+
+    save_data(
+        df,
+        paths["dataset"],
+        fits_dir,
+        output_format="shards",
+        ledger_path=paths["ledger"],
+        **save_kwargs,
+    )
+
+
+def node_dirs(work_dir):
+    return sorted(
+        os.path.join(work_dir, name)
+        for name in os.listdir(work_dir)
+        if name.startswith("node_")
+    )
+
+
+def read_node(root):
+    """Load a node's metadata, deduplicated shard index and catalog objIDs."""
+    dataset = os.path.join(root, "dataset")
+    with open(os.path.join(dataset, META_FILE)) as f:
+        meta = json.load(f)
+    index = pd.read_csv(os.path.join(dataset, INDEX_FILE))
+    index = index.drop_duplicates("objID", keep="last")
+    catalog = pd.read_csv(os.path.join(root, "catalog.csv"), usecols=["objID"])
+    return meta, index, catalog["objID"]
+
+
+def check_nodes(nodes):
+    """Load every node and raise ``ValueError`` if they cannot be merged.
+
+    Nodes must share the shard layout, their catalogs must not overlap,
+    every indexed object must belong to its node's catalog, and every
+    index entry must point inside an existing shard.
+    """
+    loaded = {root: read_node(root) for root in nodes}
+    first = loaded[nodes[0]][0]
+    seen = pd.concat([catalog for _, _, catalog in loaded.values()])
+    if seen.duplicated().any():
+        raise ValueError(
+            f"Node catalogs overlap on {seen.duplicated().sum()} objects; "
+            "were they partitioned with the same settings?"
+        )
+    for root, (meta, index, catalog) in loaded.items():
+        if meta != first:
+            raise ValueError(f"{root} has shard layout {meta}, {nodes[0]} has {first}")
+        stray = ~index["objID"].isin(catalog)
+        if stray.any():
+            raise ValueError(f"{root} has {stray.sum()} objects outside its catalog")
+        if not index["offset"].between(0, meta["shard_size"] - 1).all():
+            raise ValueError(f"{root} has offsets outside its shards")
+        dataset, encoding = os.path.join(root, "dataset"), meta.get("encoding")
+        for shard in index["shard"].unique():
+            for path in shard_files(dataset, shard, encoding):
+                if not os.path.exists(path):
+                    raise ValueError(f"{root} indexes missing shard file {path}")
+    return loaded
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def merge(work_dir, out_path):
+    """Merge every node's shards and index into one ``ShardReader`` dataset.
+
+    Shards are hard-linked (or copied) into ``out_path`` and renumbered
+    node by node, and the indices are concatenated accordingly, so no
+    cutout is rewritten. Returns a report of objects, shards and catalog
+    objects that no node produced (usually frames missing a band).
+    """
+    nodes = node_dirs(work_dir)
+    if not nodes:
+        raise ValueError(f"No node directories in {work_dir}")
+    if os.path.exists(os.path.join(out_path, INDEX_FILE)):
+        raise ValueError(f"{out_path} already holds a dataset")
+    loaded = check_nodes(nodes)
+    os.makedirs(out_path, exist_ok=True)
+
+    merged, missing, n_shards = [], 0, 0
+    for root, (meta, index, catalog) in loaded.items():
+        local = np.sort(index["shard"].unique())
+        dataset, encoding = os.path.join(root, "dataset"), meta.get("encoding")
+        for shard, local_shard in enumerate(local, start=n_shards):
+            sources = shard_files(dataset, local_shard, encoding)
+            for src, dst in zip(sources, shard_files(out_path, shard, encoding)):
+                link_or_copy(src, dst)
+        index["shard"] = n_shards + np.searchsorted(local, index["shard"])
+        merged.append(index)
+        missing += (~catalog.isin(index["objID"])).sum()
+        n_shards += len(local)
+
+    index = pd.concat(merged, ignore_index=True)
+    index.to_csv(os.path.join(out_path, INDEX_FILE), index=False)
+    with open(os.path.join(out_path, META_FILE), "w") as f:
+        json.dump(meta, f)
+    return {
+        "nodes": len(nodes),
+        "objects": len(index),
+        "shards": n_shards,
+        "missing": int(missing),
+    }
+
+
+def _node_process(df, node, n_nodes, work_dir, kwargs):
+    # Run from the node's directory, as it would on its own machine
+    root = node_paths(work_dir, node)["root"]
+    os.makedirs(root, exist_ok=True)
+    os.chdir(root)
+    logging.basicConfig(level=logging.INFO)
+    run_node(df, node, n_nodes, work_dir, **kwargs)
+
+
+def simulate(df, n_nodes, work_dir, out_path, **kwargs):
+    """Run every node as a local process with its own directory, then merge."""
+    work_dir = os.path.abspath(work_dir)
+    if kwargs.get("fits_dir") is not None:
+        kwargs["fits_dir"] = os.path.abspath(kwargs["fits_dir"])
+    processes = [
+        multiprocessing.Process(
+            target=_node_process, args=(df, node, n_nodes, work_dir, kwargs)
+        )
+        for node in range(n_nodes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [node for node, p in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Nodes {failed} failed")
+    return merge(work_dir, out_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a dataset on several nodes and merge their shards"
+    )
+    parser.add_argument("--mode", type=str, choices=MODES, default="node")
+    parser.add_argument("--data_path", type=str, default=None)
+    parser.add_argument("--work_dir", type=str, default="nodes")
+    parser.add_argument("--out_path", type=str, default="processed_data")
+    parser.add_argument("--n_nodes", type=int, default=1)
+    parser.add_argument("--node", type=int, default=0, help="Node to run")
+    parser.add_argument("--partition", type=str, choices=PARTITIONS, default="frame")
+    parser.add_argument("--nside", type=int, default=16, help="HEALPix nside")
+    parser.add_argument("--bands", nargs="+", default=BANDS)
+    parser.add_argument("--base_url", type=str, default=FITS_BASE_URL)
+    parser.add_argument("--max_conn", type=int, default=64)
+    parser.add_argument(
+        "--skip_download",
+        action="store_true",
+        help="Read frames already in --fits_dir instead of downloading",
+    )
+    parser.add_argument("--fits_dir", type=str, default=None)
+    parser.add_argument("--shard_size", type=int, default=10000)
+    parser.add_argument(
+        "--encoding", type=str, choices=list(ENCODINGS), default="float32"
+    )
+    parser.add_argument("--chunk_size", type=int, default=64)
+    parser.add_argument("--max_workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.mode == "merge":
+        print(merge(args.work_dir, args.out_path))
+    else:
+        df = pd.read_csv(args.data_path)
+        kwargs = dict(
+            by=args.partition,
+            nside=args.nside,
+            bands=args.bands,
+            base_url=args.base_url,
+            max_conn=args.max_conn,
+            download=not args.skip_download,
+            fits_dir=args.fits_dir,
+            shard_size=args.shard_size,
+            encoding=args.encoding,
+            chunk_size=args.chunk_size,
+            max_workers=args.max_workers,
+        )
+        if args.mode == "node":
+            run_node(df, args.node, args.n_nodes, args.work_dir, **kwargs)
+        else:
+            print(simulate(df, args.n_nodes, args.work_dir, args.out_path, **kwargs))
@@ -0,0 +1,109 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from hermes.decompress import BZ2_SUFFIX
+from hermes.integrity import verify_frame
+from hermes.ledger import CORRUPT, VERIFIED
+from hermes.url_generator import (
+    BANDS,
+    FITS_BASE_URL,
+    FRAME_COLUMNS,
+    frame_file_names,
+    unique_frames,
+)
+
+
+def frames_on_disk(file_names, outdir, ledger=None):
+    """Mask of frames present and whole in ``outdir``, decompressed or not.
+
+    Files are checked with ``verify_frame``, so a truncated download counts
+    as missing. With ``ledger``, frames it records as ``VERIFIED`` are
+    trusted without reading them and new passes are recorded there.
+    """
+    if not os.path.isdir(outdir):
+        return np.zeros(len(file_names), dtype=bool)
+    listing = {entry.name for entry in os.scandir(outdir)}
+    candidates = [
+        [candidate for candidate in (name, name + BZ2_SUFFIX) if candidate in listing]
+        for name in file_names
+    ]
+    verified = set()
+    if ledger is not None:
+        verified = ledger.reached([c for names in candidates for c in names], VERIFIED)
+    present = np.zeros(len(file_names), dtype=bool)
+    passed = []
+    for k, names in enumerate(candidates):
+        for candidate in names:
+            if candidate in verified:
+                present[k] = True
+                break
+            if verify_frame(os.path.join(outdir, candidate)) is None:
+                present[k] = True
+                passed.append(candidate)
+                break
+    if ledger is not None:
+        ledger.mark(passed, VERIFIED)
+    return present
+
+
+def plan_downloads(df, outdir, bands=BANDS, base_url=FITS_BASE_URL, ledger=None):
+    """Collapse a catalog into the unique frames that still need downloading.
+
+    Returns one row per missing (rerun, run, camcol, field, band) frame with
+    its URL. Fields that are closest to a full set of ``bands`` come first,
+    then fields with more catalog objects, so complete fields become
+    available for cutting as early as possible. Frames that ``ledger``
+    records as corrupt are left out.
+    """
+    frames = unique_frames(df, bands, base_url)
+    frames["present"] = frames_on_disk(frames["file_name"].to_numpy(), outdir, ledger)
+    if ledger is not None:
+        corrupt = ledger.done(CORRUPT)
+        frames = frames.loc[~(frames["file_name"] + BZ2_SUFFIX).isin(corrupt)]
+
+    frames["missing"] = ~frames["present"]
+    frames["n_missing"] = frames.groupby(FRAME_COLUMNS)["missing"].transform("sum")
+    n_objects = df.groupby(FRAME_COLUMNS).size().rename("n_objects")
+    frames = frames.join(n_objects, on=FRAME_COLUMNS)
+    frames["band_order"] = frames["band"].map({b: k for k, b in enumerate(bands)})
+
+    plan = frames.loc[frames["missing"]].sort_values(
+        ["n_missing", "n_objects", *FRAME_COLUMNS, "band_order"],
+        ascending=[True, False] + [True] * (len(FRAME_COLUMNS) + 1),
+        kind="stable",
+    )
+    plan = plan.drop(columns=["present", "missing", "band_order"])
+    return plan.reset_index(drop=True)
+
+
+def object_manifest(df):
+    """Map every objID to its frame, as written by ``write_manifest``."""
+    manifest = df[["objID", *FRAME_COLUMNS]].copy()
+    manifest["file_name"] = frame_file_names(df)
+    return manifest
+
+
+def write_manifest(df, path):
+    object_manifest(df).to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan frame downloads for a catalog")
+    parser.add_argument("--data_path", type=str, required=True)
+    parser.add_argument("--outdir", type=str, default="fits")
+    parser.add_argument("--bands", nargs="+", default=BANDS)
+    parser.add_argument("--plan_path", type=str, default="download_plan.csv")
+    parser.add_argument("--manifest_path", type=str, default="object_frames.csv")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data_path)
+    plan = plan_downloads(df, args.outdir, args.bands)
+    plan.to_csv(args.plan_path, index=False)
+    write_manifest(df, args.manifest_path)
+    print(
+        f"{len(df)} objects on {df.groupby(FRAME_COLUMNS).ngroups} fields, "
+        f"{len(plan)} frames to download"
+    )
@@ -0,0 +1,260 @@
+import argparse
+import json
+import time
+import warnings
+import zlib
+
+import numpy as np
+
+# Storage dtype of each stamp encoding
+ENCODINGS = {"float32": np.float32, "float16": np.float16, "int16": np.int16}
+CODECS = ["none", "zlib", "zstd", "blosc"]
+INT16_MAX = np.iinfo(np.int16).max
+INT16_NAN = np.iinfo(np.int16).min
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def encode_stamps(stamps, encoding="float32"):
+    """Encode a ``(n, height, width, ...)`` stack of stamps for storage.
+
+    Returns ``(data, scale)``. ``int16`` maps every stamp and band linearly
+    onto [-32767, 32767] and ``scale`` holds its ``(n, 2, ...)`` step and
+    offset; NaNs are stored as -32768. The other encodings return
+    ``scale=None``. ``float16`` clips to its finite range.
+    """
+    stamps = np.asarray(stamps, dtype=np.float32)
+    if encoding == "float32":
+        return stamps, None
+    if encoding == "float16":
+        return np.clip(stamps, -FLOAT16_MAX, FLOAT16_MAX).astype(np.float16), None
+    if encoding != "int16":
+        raise ValueError(
+            f"Invalid encoding {encoding}. Supported are {list(ENCODINGS)}"
+        )
+    with warnings.catch_warnings():
+        # All-NaN stamps are expected and get a zero range
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low = np.nanmin(stamps, axis=(1, 2), keepdims=True)
+        high = np.nanmax(stamps, axis=(1, 2), keepdims=True)
+    low, high = np.nan_to_num(low), np.nan_to_num(high)
+    offset = (high + low) / 2
+    step = np.where(high > low, (high - low) / (2 * INT16_MAX), 1.0)
+    data = np.rint((stamps - offset) / step)
+    data = np.where(np.isnan(stamps), INT16_NAN, data).astype(np.int16)
+    scale = np.stack([step[:, 0, 0], offset[:, 0, 0]], axis=1).astype(np.float32)
+    return data, scale
+
+
+def decode_stamps(data, scale=None):
+    """Decode stamps written by ``encode_stamps`` back to float32."""
+    if data.dtype != np.int16:
+        return np.asarray(data, dtype=np.float32)
+    step = scale[:, 0, None, None]
+    offset = scale[:, 1, None, None]
+    stamps = data.astype(np.float32) * step + offset
+    stamps[data == INT16_NAN] = np.nan
+    return stamps
+
+
+def _codec(codec):
+    """Return ``(compress(bytes, level, itemsize), decompress(bytes))``."""
+    if codec == "zlib":
+        return (
+            lambda data, level, itemsize: zlib.compress(data, level)
+        ), zlib.decompress
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd needs zstandard: pip install zstandard") from e
+        return (
+            lambda data, level, itemsize: zstandard.ZstdCompressor(level).compress(
+                data
+            ),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    if codec == "blosc":
+        try:
+            import blosc2 as blosc
+        except ImportError:
+            try:
+                import blosc
+            except ImportError as e:
+                raise ImportError("blosc needs blosc2: pip install blosc2") from e
+        return (
+            lambda data, level, itemsize: blosc.compress(
+                data, typesize=itemsize, clevel=level
+            ),
+            blosc.decompress,
+        )
+    raise ValueError(f"Invalid codec {codec}. Supported are {CODECS}")
+
+
+def compress_array(array, codec="zlib", level=5):
+    """Compress an array into a uint8 buffer that ``np.savez`` can store."""
+    if codec == "none":
+        return array
+    compress, _ = _codec(codec)
+    array = np.ascontiguousarray(array)
+    return np.frombuffer(compress(array.tobytes(), level, array.itemsize), np.uint8)
+
+
+def decompress_array(buffer, codec, dtype, shape):
+    if codec == "none":
+        return buffer
+    _, decompress = _codec(codec)
+    return np.frombuffer(decompress(buffer.tobytes()), dtype).reshape(shape)
+
+
+def save_stamps(
+    path, stamps, name="grids", encoding="float32", codec="none", level=5, **arrays
+):
+    """Write stamps to a .npz with ``encoding`` and an optional ``codec``.
+
+    Other ``arrays`` are stored alongside. ``codec="zlib"`` uses
+    ``np.savez_compressed`` and zstd/blosc compress the stamps themselves;
+    ``load_stamps`` reads any of them back.
+    """
+    data, scale = encode_stamps(stamps, encoding)
+    arrays[f"{name}_encoding"] = encoding
+    if scale is not None:
+        arrays[f"{name}_scale"] = scale
+    if codec in ("zstd", "blosc"):
+        arrays[f"{name}_codec"] = codec
+        arrays[f"{name}_dtype"] = data.dtype.str
+        arrays[f"{name}_shape"] = np.asarray(data.shape)
+        data = compress_array(data, codec, level)
+    arrays[name] = data
+    if codec == "zlib":
+        np.savez_compressed(path, **arrays)
+    elif codec in CODECS:
+        np.savez(path, **arrays)
+    else:
+        raise ValueError(f"Invalid codec {codec}. Supported are {CODECS}")
+
+
+def load_stamps(path, name="grids"):
+    """Return the decoded float32 stamps of a .npz and the open archive."""
+    archive = np.load(path, allow_pickle=True)
+    data = archive[name]
+    if f"{name}_codec" in archive:
+        data = decompress_array(
+            data,
+            str(archive[f"{name}_codec"]),
+            np.dtype(str(archive[f"{name}_dtype"])),
+            tuple(archive[f"{name}_shape"]),
+        )
+    scale = archive[f"{name}_scale"] if f"{name}_scale" in archive else None
+    return decode_stamps(data, scale), archive
+
+
+def roundtrip_error(stamps, decoded):
+    """Absolute and range-relative errors of decoded stamps, ignoring NaNs."""
+    stamps = np.asarray(stamps, dtype=np.float32)
+    error = np.abs(decoded - stamps)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        span = np.nanmax(stamps, axis=(1, 2)) - np.nanmin(stamps, axis=(1, 2))
+        relative = np.nanmax(error, axis=(1, 2)) / np.where(span > 0, span, 1.0)
+    return {
+        "max_abs_error": float(np.nanmax(error)),
+        "rms_error": float(np.sqrt(np.nanmean(error**2))),
+        "max_rel_error": float(np.nanmax(relative)),
+    }
+
+
+def benchmark_encodings(stamps, encodings=ENCODINGS, codecs=CODECS, level=5, repeat=3):
+    """Bytes, round-trip error and encode/decode throughput per combination.
+
+    Codecs whose package is not installed are reported as skipped.
+    """
+    stamps = np.asarray(stamps, dtype=np.float32)
+    raw_bytes = stamps.nbytes
+    report = {"n_stamps": len(stamps), "raw_bytes": raw_bytes, "results": []}
+    for encoding in encodings:
+        for codec in codecs:
+            try:
+                if codec != "none":
+                    _codec(codec)
+            except ImportError as e:
+                report["results"].append(
+                    {"encoding": encoding, "codec": codec, "skipped": str(e)}
+                )
+                continue
+            start = time.perf_counter()
+            for _ in range(repeat):
+                data, scale = encode_stamps(stamps, encoding)
+                buffer = compress_array(data, codec, level)
+            encode_seconds = (time.perf_counter() - start) / repeat
+            start = time.perf_counter()
+            for _ in range(repeat):
+                decoded = decode_stamps(
+                    decompress_array(buffer, codec, data.dtype, data.shape), scale
+                )
+            decode_seconds = (time.perf_counter() - start) / repeat
+            n_bytes = buffer.nbytes + (scale.nbytes if scale is not None else 0)
+            report["results"].append(
+                {
+                    "encoding": encoding,
+                    "codec": codec,
+                    "bytes_per_stamp": n_bytes / len(stamps),
+                    "ratio": raw_bytes / n_bytes,
+                    "encode_mb_per_s": raw_bytes / encode_seconds / 1e6,
+                    "decode_stamps_per_s": len(stamps) / decode_seconds,
+                    **roundtrip_error(stamps, decoded),
+                }
+            )
+    return report
+
+
+def print_report(report):
+    print(f"{report['n_stamps']} stamps, {report['raw_bytes'] / 1e6:.1f} MB as float32")
+    print(
+        f"{'encoding':<10}{'codec':<7}{'B/stamp':>10}{'ratio':>7}{'enc MB/s':>10}"
+        f"{'dec stamps/s':>14}{'max abs':>11}{'rms':>11}{'max rel':>10}"
+    )
+    for result in report["results"]:
+        if "skipped" in result:
+            print(f"{result['encoding']:<10}{result['codec']:<7}skipped")
+            continue
+        print(
+            f"{result['encoding']:<10}{result['codec']:<7}"
+            f"{result['bytes_per_stamp']:>10.0f}{result['ratio']:>7.2f}"
+            f"{result['encode_mb_per_s']:>10.0f}{result['decode_stamps_per_s']:>14.0f}"
+            f"{result['max_abs_error']:>11.2e}{result['rms_error']:>11.2e}"
+            f"{result['max_rel_error']:>10.2e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare stamp encodings by size, round-trip error and decode speed"
+    )
+    parser.add_argument(
+        "--data_path",
+        type=str,
+        required=True,
+        help="Shard dataset directory, or a .npz of stamps",
+    )
+    parser.add_argument("--name", type=str, default="grids", help="Array in the .npz")
+    parser.add_argument("--n_stamps", type=int, default=10000)
+    parser.add_argument("--encodings", nargs="+", default=list(ENCODINGS))
+    parser.add_argument("--codecs", nargs="+", choices=CODECS, default=CODECS)
+    parser.add_argument("--level", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    if args.data_path.endswith(".npz"):
+        stamps = load_stamps(args.data_path, args.name)[0][: args.n_stamps]
+    else:
+        from hermes.shards import ShardReader
+
+        reader = ShardReader(args.data_path)
+        stamps = np.concatenate(
+            [reader.stamps(shard) for shard in sorted(reader.counts)]
+        )[: args.n_stamps]
+    report = benchmark_encodings(stamps, args.encodings, args.codecs, args.level)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
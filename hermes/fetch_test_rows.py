@@ -122,10 +122,15 @@ Order By
 """
 
 
+# SkyServer truncates results at this many rows, so larger pages are split
+SKYSERVER_ROW_LIMIT = 500000
+
+
 if __name__ == "__main__":
     sql_cl = SQLCL()
-    df = sql_cl.query_database(JOEL_QUERY)
-    breakpoint()
+    df = sql_cl.query_paged(
+        JOEL_QUERY, column="p.objID", n_pages=16, row_limit=SKYSERVER_ROW_LIMIT
+    )
     sql_cl.logger.info(f"Query returned {df.shape[0]} rows")
     df.to_csv(PATH / "../../pls_work_data.csv")
     sql_cl.logger.info(f"Data saved to {PATH / '../../pls_work_data.csv'}")
@@ -2,16 +2,14 @@ import argparse
 from pathlib import Path
 
 import pandas as pd
-import parfive
-
-PATH = Path(__file__).parent
 
+from hermes.adaptive_download import AdaptiveDownloader
+from hermes.download_planner import plan_downloads, write_manifest
+from hermes.integrity import download_verified
+from hermes.ledger import Ledger
+from hermes.url_generator import BANDS
 
-def get_fits_downloader(urls, outdir, max_conn=8):
-    dl = parfive.Downloader(max_conn=max_conn)
-    for url in urls:
-        dl.enqueue_file(url, path=outdir)
-    return dl
+PATH = Path(__file__).parent
 
 
 if __name__ == "__main__":
@@ -21,22 +19,38 @@ if __name__ == "__main__":
     parser.add_argument(
         "--data_path", type=str, default="test_run/data/initial_download_updated.csv"
     )
-    parser.add_argument("--max_conn", type=int, default=8)
+    parser.add_argument(
+        "--max_conn", type=int, default=64, help="Upper bound on adaptive connections"
+    )
+    parser.add_argument("--max_retries", type=int, default=5)
+    parser.add_argument("--manifest_path", type=str, default=None)
+    parser.add_argument(
+        "--ledger_path", type=str, default=None, help="Records verified/corrupt frames"
+    )
+    parser.add_argument("--quarantine_dir", type=str, default="quarantine")
     args = parser.parse_args()
 
-    df = pd.read_csv(args.data_path).iloc[:2]
-    urls = []
-
-    if args.download_single_bands:
-        urls = df["fits_url_r"].tolist()
-    else:
-        urls.extend(df["fits_url_u"].tolist())
-        urls.extend(df["fits_url_g"].tolist())
-        urls.extend(df["fits_url_r"].tolist())
-        urls.extend(df["fits_url_i"].tolist())
-        urls.extend(df["fits_url_z"].tolist())
-
+    df = pd.read_csv(args.data_path)
+    bands = ["r"] if args.download_single_bands else BANDS
     outdir = args.outdir
 
-    dl = get_fits_downloader(urls, outdir, max_conn=args.max_conn)
-    dl.download()
+    ledger = Ledger(args.ledger_path) if args.ledger_path else None
+    plan = plan_downloads(df, outdir, bands, ledger=ledger)
+    print(f"{len(df)} objects, {len(plan)} unique frames to download")
+    if args.manifest_path is not None:
+        write_manifest(df, args.manifest_path)
+
+    downloader = AdaptiveDownloader(
+        max_conn=args.max_conn, max_retries=args.max_retries, progress=True
+    )
+    files, bad = download_verified(
+        downloader,
+        plan["url"].tolist(),
+        outdir,
+        ledger=ledger,
+        quarantine_dir=args.quarantine_dir,
+    )
+    print(f"{len(files)} verified, {len(files.errors)} failed, {len(bad)} corrupt")
+    print(downloader.summary())
+    if ledger is not None:
+        ledger.close()
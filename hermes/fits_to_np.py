@@ -1,21 +1,50 @@
 import os
 import warnings
-from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from astropy.io import fits
 from astropy.io.fits.verify import VerifyWarning
-from astropy.wcs import WCS
 from tqdm import tqdm
 
+from hermes.cutouts import get_cutouts
+from hermes.encodings import save_stamps
+from hermes.frame_reader import frame_scale, read_frame, read_header
+from hermes.instrumentation import count, timer
+from hermes.parallel import bounded_map, frame_chunks
+from hermes.wcs_cache import get_wcs
+
 warnings.simplefilter("ignore", category=VerifyWarning)
 
 PATH = Path(__file__).parent
 FITS_PATH = PATH / "fits/"
 
 
+def cut_fits_frame(filename, ras, decs, width=40, height=40):
+    """Cut out every object of a frame, returning the cutouts and a valid mask."""
+    # Memory-map the raw pixels and scale only the stamps; the header comes
+    # with the pixels, so the cache only saves building the WCS
+    header, data = read_frame(filename)
+    wcs = get_wcs(filename, header)
+    bscale, bzero, blank = frame_scale(header)
+
+    # Cut out every object of the frame with a single WCS transform,
+    # shifting windows near the edges back inside the frame
+    cutouts, valid = get_cutouts(
+        data,
+        wcs,
+        ras,
+        decs,
+        (height, width),
+        "shift",
+        bscale=bscale,
+        bzero=bzero,
+        blank=blank,
+    )
+    count("invalid", (~valid).sum())
+    return filename, cutouts, valid
+
+
 class FITSProcessor:
     def __init__(self, file_list, width=40, height=40, ra_list=None, dec_list=None):
         self.file_list = file_list
@@ -25,17 +54,12 @@ class FITSProcessor:
         self.dec_list = dec_list
 
     def get_coords(self, filename, ra, dec):
-        # Open the FITS file
+        # The header is only read when the WCS of the frame is not cached
         try:
-            with fits.open(filename) as hdul:
-                # Access the primary header and data
-                header = hdul[0].header
-                hdul[0].data
+            wcs = get_wcs(filename, lambda: read_header(filename))
         except FileNotFoundError as e:
             print(f"File Not found: {filename}: {e}")
             return -1, -1
-        # Initialize WCS with the FITS header
-        wcs = WCS(header)
 
         # Convert RA and Dec to pixel coordinates
         floating_pixel_coords = wcs.world_to_pixel_values(ra, dec)
@@ -51,54 +75,27 @@ class FITSProcessor:
 
     def _process_fits_file(self, args):
         filename, ra, dec = args
+        filename, cutouts = self._process_fits_frame((filename, [ra], [dec]))
+        return filename, cutouts[0]
 
-        # Open the FITS file
-        with fits.open(filename) as hdul:
-            # Access the primary header and data
-            header = hdul[0].header
-            data = hdul[0].data
-
-        # Initialize WCS with the FITS header
-        wcs = WCS(header)
-
-        # Convert RA and Dec to pixel coordinates
-        floating_pixel_coords = wcs.world_to_pixel_values(ra, dec)
-
-        # # Check for NaN values in the pixel coordinates
-        # if np.any(np.isnan(floating_pixel_coords)):
-        #     breakpoint()
-
-        pixel_indices = (
-            int(np.round(floating_pixel_coords[0])),
-            int(np.round(floating_pixel_coords[1])),
+    def _process_fits_frame(self, args):
+        filename, ras, decs = args
+        filename, cutouts, valid = cut_fits_frame(
+            filename, ras, decs, self.width, self.height
         )
+        return filename, [
+            cutout if is_valid else None for cutout, is_valid in zip(cutouts, valid)
+        ]
 
-        # Unpack pixel indices
-        x_center, y_center = pixel_indices
-
-        # Calculate half dimensions
-        half_width = self.width // 2
-        half_height = self.height // 2
-
-        # Calculate boundaries with clipping to ensure they stay within array bounds
-        xmin = max(0, x_center - half_width)
-        xmax = xmin + self.width
-        if xmax > data.shape[1]:
-            xmax = data.shape[1]
-            xmin = xmax - self.width
-
-        ymin = max(0, y_center - half_height)
-        ymax = ymin + self.height
-        if ymax > data.shape[0]:
-            ymax = data.shape[0]
-            ymin = ymax - self.height
-
-        # Create the cutout
-        cutout = data[ymin:ymax, xmin:xmax]
-
-        return filename, cutout
-
-    def process_files(self, output_dir="cutout_100k", output_file="cutouts.npz"):
+    def process_files(
+        self,
+        output_dir="cutout_100k",
+        output_file="cutouts.npz",
+        max_workers=None,
+        max_in_flight=None,
+        encoding="float32",
+        codec="none",
+    ):
         # Ensure the output directory exists
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -107,38 +104,45 @@ class FITSProcessor:
         file_map = {}
         skipped_files = []
 
-        # Prepare arguments for parallel processing
-        args_list = [
-            (filename, ra, dec)
-            for filename, ra, dec in zip(self.file_list, self.ra_list, self.dec_list)
-        ]
+        # Group objects by frame so each file is opened once, and pass plain
+        # arrays to a module-level function so ``self`` is never pickled
+        ras = np.asarray(self.ra_list, dtype=np.float64)
+        decs = np.asarray(self.dec_list, dtype=np.float64)
+        chunks = frame_chunks(self.file_list)
+        frames = dict(chunks)
+        tasks = (
+            (filename, ras[indices], decs[indices], self.width, self.height)
+            for filename, indices in chunks
+        )
 
-        # Use ProcessPoolExecutor for parallel processing
-        with ProcessPoolExecutor() as executor:
-            # Wrap the executor.map call with tqdm for a progress bar
-            results = list(
-                tqdm(
-                    executor.map(self._process_fits_file, args_list),
-                    total=len(self.file_list),
-                    desc="Processing FITS files",
-                )
-            )
+        # Keep a bounded number of frames in flight in the process pool
+        results = [None] * len(self.file_list)
+        for filename, frame_cutouts, valid in tqdm(
+            bounded_map(cut_fits_frame, tasks, max_workers, max_in_flight),
+            total=len(chunks),
+            desc="Processing FITS files",
+        ):
+            for idx, cutout, is_valid in zip(frames[filename], frame_cutouts, valid):
+                results[idx] = (filename, cutout if is_valid else None)
 
         # Collect results and build the mapping
         for idx, (filename, cutout) in enumerate(results):
             if cutout is None:
-                breakpoint()
                 skipped_files.append(filename)
             else:
                 cutouts.append(cutout)
                 file_map[os.path.basename(filename)] = idx
 
         # Save the cutouts and file map to a .npz file in the specified directory
-        np.savez(
-            os.path.join(output_dir, output_file),
-            cutouts=np.array(cutouts),
-            file_map=file_map,
-        )
+        with timer("serialise"):
+            save_stamps(
+                os.path.join(output_dir, output_file),
+                np.array(cutouts),
+                name="cutouts",
+                encoding=encoding,
+                codec=codec,
+                file_map=file_map,
+            )
 
         # Log skipped files
         if skipped_files:
@@ -197,7 +201,7 @@ if __name__ == "__main__":
 
     ra_list = df["ra"].tolist()
     dec_list = df["dec"].tolist()
-    file_list = df.apply(lambda row: f"{FITS_PATH}/{row['filename']}", axis=1).tolist()
+    file_list = (f"{FITS_PATH}/" + df["filename"]).tolist()
 
     # Create the processor instance
     processor = FITSProcessor(
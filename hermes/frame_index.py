@@ -0,0 +1,90 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+BANDS = ["u", "g", "r", "i", "z"]
+ALL_BANDS = (1 << len(BANDS)) - 1
+FRAME_PATTERN = re.compile(r"^frame-([ugriz])-(\d+-\d+-\d+\.fits)$")
+
+
+class FrameIndex:
+    """Band coverage of the frames available on disk, keyed by field.
+
+    Fields are keyed by their ``frame-x-...`` file name and map to a bitmask
+    with one bit per band, so availability checks are a dict lookup instead
+    of a scan over every file.
+    """
+
+    def __init__(self, coverage=None):
+        self.coverage = coverage or {}
+
+    @classmethod
+    def from_files(cls, files):
+        coverage = {}
+        for name in files:
+            match = FRAME_PATTERN.match(name)
+            if match is None:
+                continue
+            band, rest = match.groups()
+            field = f"frame-x-{rest}"
+            coverage[field] = coverage.get(field, 0) | 1 << BANDS.index(band)
+        return cls(coverage)
+
+    @classmethod
+    def from_dir(cls, file_path):
+        """Index the uncompressed frames in ``file_path`` with a single listing."""
+        return cls.from_files(entry.name for entry in os.scandir(file_path))
+
+    @classmethod
+    def from_manifest(cls, path):
+        with closing(sqlite3.connect(path)) as conn:
+            rows = conn.execute("SELECT field, bands FROM frames").fetchall()
+        return cls(dict(rows))
+
+    def to_manifest(self, path):
+        """Persist the coverage to a sqlite manifest so it is not rebuilt."""
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS frames "
+                "(field TEXT PRIMARY KEY, bands INTEGER NOT NULL)"
+            )
+            conn.execute("DELETE FROM frames")
+            conn.executemany(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?)", self.coverage.items()
+            )
+
+    def __len__(self):
+        return len(self.coverage)
+
+    def bands(self, file_names):
+        """Return the band bitmask of each ``frame-x-...`` file name."""
+        return (
+            pd.Series(file_names).map(self.coverage).fillna(0).to_numpy(dtype=np.int64)
+        )
+
+    def has_all_bands(self, file_names):
+        """Vectorized check that all five bands of each field are available."""
+        return self.bands(file_names) == ALL_BANDS
+
+
+def load_frame_index(file_path, manifest_path=None, refresh=False):
+    """Load the index from ``manifest_path`` if it exists, else build and save it.
+
+    The manifest is rebuilt when ``refresh`` is set or ``file_path`` was
+    modified after it, e.g. because frames were added or removed.
+    """
+    if (
+        manifest_path is not None
+        and os.path.exists(manifest_path)
+        and not refresh
+        and os.path.getmtime(file_path) <= os.path.getmtime(manifest_path)
+    ):
+        return FrameIndex.from_manifest(manifest_path)
+    index = FrameIndex.from_dir(file_path)
+    if manifest_path is not None:
+        index.to_manifest(manifest_path)
+    return index
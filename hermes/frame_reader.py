@@ -0,0 +1,36 @@
+from astropy.io import fits
+
+from hermes.decompress import BZ2_SUFFIX, open_frame
+from hermes.instrumentation import timer
+
+
+def read_header(path):
+    """Parse only the primary header of a frame, without touching its pixels."""
+    with timer("fits_open"):
+        return fits.getheader(path)
+
+
+def read_frame(path):
+    """Return the header and raw, unscaled pixels of a frame.
+
+    Uncompressed frames are memory-mapped, so cutting stamps only pages in
+    the rows they cover. BSCALE/BZERO are not applied to the whole frame;
+    pass ``frame_scale(header)`` to ``get_cutouts`` to scale just the stamps.
+    """
+    kwargs = {"do_not_scale_image_data": True}
+    if not path.endswith(BZ2_SUFFIX):
+        kwargs["memmap"] = True
+    with timer("fits_open"), open_frame(path, **kwargs) as hdul:
+        header = hdul[0].header
+        data = hdul[0].data
+    return header, data
+
+
+def frame_scale(header):
+    """Return the ``(bscale, bzero, blank)`` that turn raw pixels into values.
+
+    ``blank`` is the raw value of undefined pixels in integer frames, or
+    ``None`` when the frame has none.
+    """
+    blank = header.get("BLANK") if header.get("BITPIX", -32) > 0 else None
+    return header.get("BSCALE", 1.0), header.get("BZERO", 0.0), blank
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Process-local stage timings and event counters.
+
+    Worker processes ship their metrics back with ``call_with_metrics`` and
+    the parent folds them in with ``merge``, so one ``Metrics`` instance ends
+    up describing the whole run.
+    """
+
+    def __init__(self):
+        # Reentrant so drain can take a snapshot and reset under one lock
+        self._lock = threading.RLock()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.calls[stage] += 1
+
+    def count(self, event, n=1):
+        with self._lock:
+            self.counters[event] += int(n)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"seconds": self.seconds[stage], "calls": self.calls[stage]}
+                    for stage in self.seconds
+                },
+                "counters": dict(self.counters),
+            }
+
+    def drain(self):
+        """Return a snapshot and reset, so each delta is only merged once."""
+        with self._lock:
+            snapshot = self.snapshot()
+            self.seconds.clear()
+            self.calls.clear()
+            self.counters.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self._lock:
+            for stage, values in snapshot["stages"].items():
+                self.seconds[stage] += values["seconds"]
+                self.calls[stage] += values["calls"]
+            for event, n in snapshot["counters"].items():
+                self.counters[event] += n
+
+    def summary(self):
+        snapshot = self.snapshot()
+        stages = ", ".join(
+            f"{stage} {values['seconds']:.1f}s/{values['calls']}"
+            for stage, values in sorted(snapshot["stages"].items())
+        )
+        counters = ", ".join(
+            f"{event}={n}" for event, n in sorted(snapshot["counters"].items())
+        )
+        return f"stages: {stages or '-'}; counters: {counters or '-'}"
+
+    def to_prometheus(self, prefix="hermes"):
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds_total counter",
+            *(
+                f'{prefix}_stage_seconds_total{{stage="{stage}"}} {values["seconds"]}'
+                for stage, values in sorted(snapshot["stages"].items())
+            ),
+            f"# TYPE {prefix}_stage_calls_total counter",
+            *(
+                f'{prefix}_stage_calls_total{{stage="{stage}"}} {values["calls"]}'
+                for stage, values in sorted(snapshot["stages"].items())
+            ),
+            f"# TYPE {prefix}_events_total counter",
+            *(
+                f'{prefix}_events_total{{event="{event}"}} {n}'
+                for event, n in sorted(snapshot["counters"].items())
+            ),
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics as Prometheus text for ``.prom`` paths, else JSON."""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+def timer(stage):
+    return METRICS.timer(stage)
+
+
+def count(event, n=1):
+    METRICS.count(event, n)
+
+
+def call_with_metrics(func, *args):
+    """Run ``func`` in a worker and return its result with the metrics it made."""
+    # Forked workers inherit the parent's totals, which must not be sent back
+    METRICS.drain()
+    result = func(*args)
+    return result, METRICS.drain()
+
+
+class MetricsReporter:
+    """Log a summary and rewrite ``path`` at most once every ``interval`` seconds."""
+
+    def __init__(self, path=None, interval=60.0, metrics=METRICS, log=logger):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self.log = log
+        self._last = time.monotonic()
+
+    def maybe_report(self):
+        if time.monotonic() - self._last >= self.interval:
+            self.report()
+
+    def report(self):
+        self._last = time.monotonic()
+        self.log.info(self.metrics.summary())
+        if self.path is not None:
+            self.metrics.write(self.path)
@@ -0,0 +1,183 @@
+import argparse
+import bz2
+import logging
+import os
+
+import parfive
+from astropy.io import fits
+
+from hermes.decompress import BZ2_SUFFIX, quarantine
+from hermes.instrumentation import count, timer
+from hermes.ledger import CORRUPT, VERIFIED, Ledger
+
+logger = logging.getLogger(__name__)
+
+FITS_BLOCK = 2880
+BZ2_MAGIC = b"BZh"
+BZ2_EOS_MAGIC = 0x177245385090
+READ_SIZE = 1 << 16
+WCS_KEYS = ["CTYPE1", "CTYPE2", "CRVAL1", "CRVAL2", "CRPIX1", "CRPIX2"]
+
+
+def bz2_complete(path):
+    """Check that a .bz2 file ends with a stream end-of-stream marker.
+
+    The 48-bit marker is followed by a 32-bit CRC and up to 7 padding bits,
+    so a truncated download is caught from the last 11 bytes alone.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(BZ2_MAGIC)) != BZ2_MAGIC:
+            return False
+        f.seek(-11, os.SEEK_END)
+        tail = int.from_bytes(f.read(11), "big")
+    return any((tail >> (pad + 32)) & (2**48 - 1) == BZ2_EOS_MAGIC for pad in range(8))
+
+
+def read_header_bytes(path, max_blocks=36):
+    """Return the raw primary header of a frame, decoding only what it needs."""
+    decompressor = bz2.BZ2Decompressor() if path.endswith(BZ2_SUFFIX) else None
+    header = b""
+    card = 0
+    with open(path, "rb") as f:
+        while len(header) < max_blocks * FITS_BLOCK:
+            if decompressor is None:
+                chunk = f.read(FITS_BLOCK)
+                if not chunk:
+                    break
+            else:
+                # bz2 only emits output once a whole compressed block is in
+                data = f.read(READ_SIZE) if decompressor.needs_input else b""
+                if decompressor.needs_input and not data:
+                    break
+                chunk = decompressor.decompress(data, FITS_BLOCK)
+            header += chunk
+            for card in range(card, len(header) - 79, 80):
+                if header[card : card + 8] == b"END     ":
+                    return header[: card + 80]
+            card = len(header) // 80 * 80
+    raise ValueError("no END card in primary header")
+
+
+def check_header(header):
+    """Return a reason the header is unusable for cutouts, or ``None``."""
+    if header.get("NAXIS") != 2:
+        return f"NAXIS={header.get('NAXIS')}"
+    if not header.get("NAXIS1", 0) > 0 or not header.get("NAXIS2", 0) > 0:
+        return "empty image"
+    missing = [key for key in WCS_KEYS if key not in header]
+    if "CD1_1" not in header and "CDELT1" not in header:
+        missing.append("CD1_1")
+    if missing:
+        return f"missing WCS keys {','.join(missing)}"
+    return None
+
+
+def data_size(header, header_size):
+    """Size an uncompressed frame must have to hold its header and pixels."""
+    n_bytes = abs(header["BITPIX"]) // 8 * header["NAXIS1"] * header["NAXIS2"]
+    return header_size + -(-n_bytes // FITS_BLOCK) * FITS_BLOCK
+
+
+def verify_frame(path, expected_size=None):
+    """Return why a downloaded frame is bad, or ``None`` if it looks whole.
+
+    Checks the file size, the bz2 end-of-stream marker, and the primary
+    header (NAXIS and WCS keys) without decoding the pixels.
+    """
+    with timer("verify"):
+        try:
+            size = os.path.getsize(path)
+            if size == 0 or (expected_size is not None and size != expected_size):
+                return f"size {size}"
+            if path.endswith(BZ2_SUFFIX) and not bz2_complete(path):
+                return "truncated bz2 stream"
+            raw = read_header_bytes(path)
+            header = fits.Header.fromstring(raw.decode("ascii"))
+            reason = check_header(header)
+            if reason is None and not path.endswith(BZ2_SUFFIX):
+                padded = -(-len(raw) // FITS_BLOCK) * FITS_BLOCK
+                if size < data_size(header, padded):
+                    reason = f"size {size}"
+            return reason
+        except (OSError, EOFError, ValueError, KeyError, UnicodeDecodeError) as e:
+            return str(e) or type(e).__name__
+
+
+def verify_frames(paths, expected_sizes=None, executor=None):
+    """Map each bad path in ``paths`` to its reason; good paths are left out."""
+    expected_sizes = expected_sizes or {}
+    paths = list(paths)
+    sizes = [expected_sizes.get(path) for path in paths]
+    mapper = executor.map if executor is not None else map
+    bad = {}
+    for path, reason in zip(paths, mapper(verify_frame, paths, sizes)):
+        if reason is not None:
+            bad[path] = reason
+    count("verified", len(paths) - len(bad))
+    count("verify_failed", len(bad))
+    return bad
+
+
+def download_verified(
+    downloader, urls, outdir, ledger=None, attempts=3, quarantine_dir="quarantine"
+):
+    """Download ``urls``, re-fetching frames that fail ``verify_frame``.
+
+    Returns a ``parfive.Results`` of the verified paths and download errors,
+    and a mapping of URL to reason for frames still bad after ``attempts``
+    downloads. Those are quarantined and recorded as ``CORRUPT`` in
+    ``ledger`` so later runs skip them.
+    """
+    verified, errors, bad = [], [], {}
+    pending = list(urls)
+    for attempt in range(attempts):
+        if not pending:
+            break
+        by_name = {os.path.basename(url): url for url in pending}
+        files = downloader.download(pending, outdir)
+        errors.extend(files.errors)
+        reasons = verify_frames(str(file) for file in files)
+        pending = []
+        for file in files:
+            file = str(file)
+            url = by_name[os.path.basename(file)]
+            if file not in reasons:
+                verified.append(file)
+                continue
+            logger.warning(f"Bad frame {file} ({reasons[file]}), attempt {attempt + 1}")
+            if attempt + 1 < attempts:
+                os.remove(file)
+                pending.append(url)
+                count("refetched")
+            else:
+                quarantine(file, quarantine_dir)
+                bad[url] = reasons[file]
+    if ledger is not None:
+        ledger.mark(map(os.path.basename, verified), VERIFIED)
+        ledger.mark((os.path.basename(url) for url in bad), CORRUPT)
+    return parfive.Results(verified, errors=errors, urls=list(urls)), bad
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify downloaded frames")
+    parser.add_argument("--fits_dir", type=str, default="fits")
+    parser.add_argument("--ledger_path", type=str, default=None)
+    parser.add_argument("--quarantine_dir", type=str, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    paths = [
+        os.path.join(args.fits_dir, name)
+        for name in sorted(os.listdir(args.fits_dir))
+        if name.endswith((".fits", ".fits" + BZ2_SUFFIX))
+    ]
+    bad = verify_frames(paths)
+    for path, reason in bad.items():
+        logger.info(f"{path}: {reason}")
+        if args.quarantine_dir is not None:
+            quarantine(path, args.quarantine_dir)
+    if args.ledger_path is not None:
+        with Ledger(args.ledger_path) as ledger:
+            ledger.mark((os.path.basename(p) for p in paths if p not in bad), VERIFIED)
+            ledger.mark(map(os.path.basename, bad), CORRUPT)
+    print(f"{len(paths) - len(bad)} good, {len(bad)} bad frames")
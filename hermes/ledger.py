@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+import pandas as pd
+
+# Progress states are bit flags so a key can record every stage it passed.
+# Bit 2 is unused; it keeps the other values stable for existing ledgers.
+DOWNLOADED = 1
+CUT = 4
+UPLOADED = 8
+VERIFIED = 16
+CORRUPT = 32
+
+
+class Ledger:
+    """Durable progress ledger keyed by objID or frame name.
+
+    Marking is idempotent: states are OR-ed into the stored bitmask, so
+    replaying a batch after a crash is harmless. Entry points filter their
+    work with ``pending`` and only touch what is left.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS progress "
+            "(key TEXT PRIMARY KEY, state INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def mark(self, keys, state):
+        """Record that every key in ``keys`` has reached ``state``."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO progress VALUES (?, ?) ON CONFLICT(key) "
+                "DO UPDATE SET state = state | excluded.state",
+                ((str(key), state) for key in keys),
+            )
+            self._conn.commit()
+
+    def done(self, state):
+        """Return the set of keys that have reached ``state``."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM progress WHERE state & ? = ?", (state, state)
+            )
+            return {key for (key,) in rows}
+
+    def reached(self, keys, state):
+        """Return the keys among ``keys`` that have reached ``state``.
+
+        Keys are looked up by primary key, so this costs the number of
+        ``keys`` rather than a scan of the whole ledger.
+        """
+        keys = [str(key) for key in keys]
+        found = set()
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key FROM progress WHERE key IN ({marks}) "
+                    "AND state & ? = ?",
+                    (*batch, state, state),
+                )
+                found.update(key for (key,) in rows)
+        return found
+
+    def pending(self, keys, state):
+        """Boolean mask of the keys that have not reached ``state`` yet."""
+        done = self.done(state)
+        return ~pd.Series(keys).astype(str).isin(done).to_numpy(dtype=bool)
+
+    def state(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM progress WHERE key = ?", (str(key),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def filter_pending(df, ledger, state, key="objID"):
+    """Return the rows of ``df`` whose ``key`` has not reached ``state``."""
+    if ledger is None:
+        return df
+    return df.loc[ledger.pending(df[key].to_numpy(), state)]
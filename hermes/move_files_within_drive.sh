@@ -12,5 +12,7 @@ FILELIST="drive_paths/temp.txt"
 # Number of parallel transfers
 PARALLEL_TRANSFERS=1000
 
-# Move files in parallel
-cat "$FILELIST" | xargs -I{} -P $PARALLEL_TRANSFERS rclone move "$REMOTE/{}" "$DESTINATION_FOLDER" --transfers 1000 --checkers 1000 --progress
+# Move every listed file with one rclone process; --no-traverse skips listing
+# the destination, which is what dominated one process per file
+rclone move "$REMOTE" "$DESTINATION_FOLDER" --files-from "$FILELIST" --no-traverse \
+    --transfers $PARALLEL_TRANSFERS --checkers $PARALLEL_TRANSFERS --progress
@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from hermes.instrumentation import METRICS, call_with_metrics
+
+
+def bounded_map(
+    func, tasks, max_workers=None, max_in_flight=None, initializer=None, initargs=()
+):
+    """Run ``func(*task)`` in a process pool, yielding results as they complete.
+
+    ``tasks`` is consumed lazily and at most ``max_in_flight`` futures exist
+    at any time, so the parent never materialises one future per task.
+    Results are yielded in completion order, and the metrics each task
+    recorded in its worker are merged into this process's ``METRICS``.
+    ``initializer(*initargs)`` runs once in every worker, whatever the start
+    method.
+    """
+    max_workers = max_workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * max_workers
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=initializer, initargs=initargs
+    ) as executor:
+        pending = set()
+        for task in tasks:
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _collect(done)
+            pending.add(executor.submit(call_with_metrics, func, *task))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _collect(done)
+
+
+def _collect(futures):
+    for future in futures:
+        result, metrics = future.result()
+        METRICS.merge(metrics)
+        yield result
+
+
+def frame_chunks(file_names):
+    """Group row positions by frame, returning ``(file_name, indices)`` pairs."""
+    file_names = np.asarray(file_names)
+    frames, inverse = np.unique(file_names, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(frames)))[:-1]
+    return list(zip(frames, np.split(order, bounds)))
@@ -1,4 +1,5 @@
 import argparse
+import logging
 from pathlib import Path
 
 import pandas as pd
@@ -6,27 +7,48 @@ import parfive
 
 PATH = Path(__file__).parent
 
-import bz2
 import os
 import shutil
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
 import pandas as pd
-from astropy.io import fits
 from astropy.io.fits.verify import VerifyWarning
-from astropy.wcs import WCS, FITSFixedWarning
-from parfive import Downloader
-from rclone_python import rclone
+from astropy.wcs import FITSFixedWarning
 
 warnings.simplefilter("ignore", category=(VerifyWarning, FITSFixedWarning))
 import time
 
-from tqdm import tqdm
+from hermes.adaptive_download import AdaptiveDownloader
+from hermes.cutouts import get_cutouts
+from hermes.decompress import BZ2_SUFFIX, DecodedFrameCache, decode_frames
+from hermes.download_planner import write_manifest
+from hermes.encodings import CODECS, ENCODINGS, save_stamps
+from hermes.frame_reader import frame_scale, read_frame
+from hermes.instrumentation import MetricsReporter, count, timer
+from hermes.integrity import download_verified
+from hermes.ledger import (
+    CORRUPT,
+    CUT,
+    UPLOADED,
+    Ledger,
+    filter_pending,
+)
+from hermes.pipeline import Pipeline, Stage
+from hermes.scheduler import SCHEDULES, key_chunks, schedule, tile_keys
+from hermes.uploader import BatchUploader
+from hermes.wcs_cache import configure_wcs_cache, get_wcs
 
 # Constants
 LOCAL_DOWNLOAD_DIR = "frames"
 LOCAL_PROCESSED_DIR = "processed_grids"
+DECODED_CACHE_DIR = "decoded_frames"
+QUARANTINE_DIR = "quarantine"
+UPLOAD_STAGING_DIR = "upload_staging"
+LEDGER_PATH = "progress.sqlite"
 GDRIVE_REMOTE_NAME = "gdrive"  # This should match the name you configured in rclone
 GDRIVE_DESTINATION_DIR = (
     "hermes/frames2"  # Replace with your desired destination folder on Google Drive
@@ -40,72 +62,45 @@ for x in BANDS:
     os.makedirs(f"{LOCAL_DOWNLOAD_DIR}/{x}", exist_ok=True)
 
 
-def get_fits_downloader(urls, outdir, max_conn=500):
-    """Create a parfive downloader for FITS files."""
-    dl = Downloader(max_conn=max_conn)
-    for url in urls:
-        dl.enqueue_file(url, path=outdir)
-    return dl
-
-
 def get_grid(filename, ra, dec):
     # Load the FITS file
     try:
-        with bz2.open(filename, "rb") as f:
-            hdulist = fits.open(f)
-            header = hdulist[0].header
-            data = hdulist[0].data
-
-            # Check if data is 2D
-            if data.ndim != 2:
-                raise ValueError("Expected 2D FITS data.")
-
-            # Get the pixel coordinates for the given RA and Dec
-            wcs = WCS(header)
-            x, y = wcs.world_to_pixel_values(ra, dec)
-
-            # Extract scalar values if they are arrays
-            x = x.item() if hasattr(x, "item") else x
-            y = y.item() if hasattr(y, "item") else y
-
-        # Convert to integers
-        x, y = int(round(x)), int(round(y))
-
-        # Define the grid boundaries
-        xmin = max(0, x - 20)
-        xmax = min(data.shape[1], x + 20)
-        ymin = max(0, y - 20)
-        ymax = min(data.shape[0], y + 20)
+        header, data = read_frame(filename)
 
-        # Extract the grid
-        grid = data[ymin:ymax, xmin:xmax]
+        # Check if data is 2D
+        if data.ndim != 2:
+            raise ValueError("Expected 2D FITS data.")
 
-        # Determine the size of the grid to pad
-        pad_y = max(0, 40 - (ymax - ymin))
-        pad_x = max(0, 40 - (xmax - xmin))
-
-        # Pad the grid to ensure it's 40x40
-        padded_grid = np.pad(
-            grid, ((0, pad_y), (0, pad_x)), mode="constant", constant_values=0
+        # Cut out the zero-padded 40x40 grid around the RA and Dec
+        wcs = get_wcs(filename, header)
+        bscale, bzero, blank = frame_scale(header)
+        grids, valid = get_cutouts(
+            data, wcs, ra, dec, (40, 40), bscale=bscale, bzero=bzero, blank=blank
         )
-        # Crop the padded grid to 40x40 if it exceeds the required size
-        grid = padded_grid[:40, :40]
 
-        return grid.astype(np.float32)
+        if not valid[0]:
+            return None
+        return grids[0]
 
     except Exception:
         return None
 
 
-def download_files(urls, band):
-    """Download files using the provided downloader."""
-    downloader = get_fits_downloader(urls, f"{LOCAL_DOWNLOAD_DIR}/{band}")
-    files = downloader.download()
+def download_files(urls, band, outdir=None, downloader=None, ledger=None):
+    """Download files using the provided downloader and verify them."""
+    outdir = outdir or f"{LOCAL_DOWNLOAD_DIR}/{band}"
+    downloader = downloader or AdaptiveDownloader()
+    files, bad = download_verified(
+        downloader, urls, outdir, ledger=ledger, quarantine_dir=QUARANTINE_DIR
+    )
 
-    # Check for any failed downloads
-    if files.errors:
+    # Check for any failed or corrupt downloads
+    if files.errors or bad:
         with open(f"errors_{band}.txt", "a") as f:
-            f.write("\n".join([f"{file.error} - {file.url}" for file in files.errors]))
+            for error in files.errors:
+                f.write(f"{error.exception} - {error.url}\n")
+            for url, reason in bad.items():
+                f.write(f"{reason} - {url}\n")
     return files
 
 
@@ -116,77 +111,459 @@ def download_files(urls, band):
 #     return grid
 
 
-def run_hail_mary(df, data_path):
-    """Process the DataFrame in batches, download files, and upload them to Google Drive."""
-
-    # Split the DataFrame into chunks
-    for start in range(0, len(df), BATCH_SIZE):  # Start at 900 to avoid re-downloading
-        # breakpoint()
-        temp_df = df.iloc[start : start + BATCH_SIZE].copy().reset_index(drop=True)
-        filenames = temp_df["filenames"]
-        fits_url = temp_df["fits_url"]
-        ra, dec = temp_df["ra"], temp_df["dec"]
-        processed_name = f"{int(time.time())}.npz"  # Use a timestamp as the filename
-        for x in BANDS:
-            urls = fits_url.str.replace("frame-x-", f"frame-{x}-").tolist()
-            # Download files
-            files = download_files(urls, x)
-            # Process the downloaded files
-            print(f"Processing {len(files)} files")
-            grids = []
-
-            for index, file in tqdm(enumerate(files)):
-                ra_index, dec_index = ra[index], dec[index]
-                grid = get_grid(file, ra_index, dec_index)
-                if grid is not None:
-                    grids.append(grid)
-                else:
-                    with open(f"errors_{x}.txt", "a") as f:
-                        f.write(f"Error processing {file}\n")
-
-            # Convert grids to a numpy array
-            grids_array = np.array(grids)
-
-            # Convert DataFrame to dictionary
-            metadata_dict = temp_df.to_dict()
-            # breakpoint()
-
-            # Save grids and metadata to a .npz file
-            output_filename = f"{LOCAL_PROCESSED_DIR}/{x}/{processed_name}"  # Use a timestamp as the filename
-            np.savez(output_filename, grids=grids_array, metadata=metadata_dict)
-
-            # Upload the frames to Google Drive
-            rclone.copy(
-                f"./{LOCAL_DOWNLOAD_DIR}/{x}",
-                f"gdrive:hermes/frames2/{x}/",
-                ignore_existing=True,
-                args=["-P", "--transfers=100", "--checkers=100"],
-            )
-
-            # Upload the frames to Google Drive
-            rclone.copy(
-                output_filename,
-                f"gdrive:hermes/processed_grids/{x}/",
-                ignore_existing=True,
-                args=["-P", "--transfers=100", "--checkers=100"],
+def download_stage(job, ledger, cache, downloader):
+    """Download and verify the frames of one batch and band into their own dir.
+
+    A frame is only fetched by the first batch that claims it in the
+    decoded cache; later batches wait for it in ``cut_stage`` instead and
+    fetch it themselves if it never arrives. The stage hands jobs on in
+    ticket order, but with several workers a later batch can win a claim,
+    so waiting batches rely on ``cut_stage``'s timeout and refetch.
+    Frames the ledger records as corrupt are skipped.
+    """
+    job["frames_dir"] = f"{LOCAL_DOWNLOAD_DIR}/{job['band']}/{job['start']}"
+    os.makedirs(job["frames_dir"], exist_ok=True)
+    job["claimed"], job["deferred"] = [], {}
+    urls = []
+    names = [url.rsplit("/", 1)[-1] for url in job["urls"].unique()]
+    corrupt = ledger.reached(names, CORRUPT)
+    for url in job["urls"].unique():
+        name = url.rsplit("/", 1)[-1]
+        if name in corrupt:
+            count("skipped_corrupt")
+            continue
+        ready = cache.claim(name[: -len(BZ2_SUFFIX)])
+        if ready is None:
+            job["claimed"].append(name)
+            urls.append(url)
+        else:
+            job["deferred"][name] = ready
+    count("frames_reused", len(job["deferred"]))
+    files = []
+    try:
+        if urls:
+            files = download_files(
+                urls, job["band"], job["frames_dir"], downloader, ledger
             )
+    finally:
+        job["files"] = {os.path.basename(file): file for file in files}
+        for name in set(job["claimed"]) - job["files"].keys():
+            cache.settle(name[: -len(BZ2_SUFFIX)])
+    return job
 
-            shutil.rmtree(f"{LOCAL_DOWNLOAD_DIR}/{x}", ignore_errors=True)
-            os.makedirs(f"{LOCAL_DOWNLOAD_DIR}/{x}", exist_ok=True)
 
-        df.loc[df["filenames"].isin(filenames), "file_downloaded"] = 1
-        df.to_csv(data_path, index=False)
-        print(f"Batch {start} complete")
+def decode_stage(job, cache, executor, ledger):
+    """Decompress the downloaded .fits.bz2 frames into the decoded-frame cache."""
+    try:
+        decoded = decode_frames(
+            job["files"].values(), cache, executor, quarantine_dir=QUARANTINE_DIR
+        )
+    finally:
+        for name in job["files"]:
+            cache.settle(name[: -len(BZ2_SUFFIX)])
+    job["decoded"] = {
+        name: decoded[file] for name, file in job["files"].items() if file in decoded
+    }
+    failed = job["files"].keys() - job["decoded"].keys()
+    for name in failed:
+        with open(f"errors_{job['band']}.txt", "a") as f:
+            f.write(f"Error processing {job['files'][name]}\n")
+    ledger.mark(failed, CORRUPT)
+    return job
+
+
+def refetch_frames(job, names, cache, downloader, executor, ledger):
+    """Download and decode deferred frames that another batch never delivered.
+
+    The frames join the batch's own files, so they are uploaded and cleaned
+    up with it. Returns the decoded path of each frame that arrived.
+    """
+    urls = [url for url in job["urls"].unique() if url.rsplit("/", 1)[-1] in names]
+    files = download_files(urls, job["band"], job["frames_dir"], downloader, ledger)
+    paths = {os.path.basename(file): file for file in files}
+    decoded = decode_frames(
+        paths.values(), cache, executor, quarantine_dir=QUARANTINE_DIR
+    )
+    job["files"].update(paths)
+    count("frames_refetched", len(paths))
+    return {name: decoded[file] for name, file in paths.items() if file in decoded}
+
+
+def cut_stage(
+    job, cache, wait_timeout=600.0, encoding="float32", codec="none", refetch=None
+):
+    """Cut out every object of the batch and save the grids to a .npz file.
+
+    Frames fetched by another batch are waited for, up to ``wait_timeout``
+    seconds; those that time out or are gone from the cache are fetched
+    again with ``refetch(job, names)``. Each frame's rows are released from
+    ``cache`` once cut, so a frame is deleted right after the last pending
+    object that needs it. Grids are stored with ``encoding`` and ``codec``
+    (see ``hermes.encodings``).
+    """
+    temp_df, band = job["df"], job["band"]
+    missing = []
+    for name, ready in job["deferred"].items():
+        if not ready.wait(wait_timeout):
+            count("frame_wait_timeout")
+            missing.append(name)
+            continue
+        file = cache.get(name[: -len(BZ2_SUFFIX)])
+        if file is None:
+            missing.append(name)
+        else:
+            job["decoded"][name] = file
+    if missing and refetch is not None:
+        job["decoded"].update(refetch(job, missing))
+    ra, dec = temp_df["ra"].to_numpy(), temp_df["dec"].to_numpy()
+    grids = np.zeros((len(temp_df), 40, 40), dtype=np.float32)
+    valid = np.zeros(len(temp_df), dtype=bool)
+
+    # Objects sharing a frame are cut out together with one WCS transform
+    names = job["urls"].str.split("/").str[-1]
+    for name, rows in names.groupby(names).indices.items():
+        file = job["decoded"].get(name)
+        if file is None:
+            cache.release(name[: -len(BZ2_SUFFIX)], len(rows))
+            continue
+        reason = "objects off the frame"
+        try:
+            header, data = read_frame(file)
+            if data.ndim != 2:
+                raise ValueError("Expected 2D FITS data.")
+            wcs = get_wcs(name, header)
+            bscale, bzero, blank = frame_scale(header)
+            grids[rows], valid[rows] = get_cutouts(
+                data,
+                wcs,
+                ra[rows],
+                dec[rows],
+                (40, 40),
+                bscale=bscale,
+                bzero=bzero,
+                blank=blank,
+            )
+        except (OSError, ValueError) as e:
+            # Unreadable frames and bad WCS headers; anything else is a bug
+            reason = f"{type(e).__name__}: {e}"
+        finally:
+            cache.release(name[: -len(BZ2_SUFFIX)], len(rows))
+        if not valid[rows].all():
+            count("errors", (~valid[rows]).sum())
+            with open(f"errors_{band}.txt", "a") as f:
+                f.write(
+                    f"Error processing {file}: {(~valid[rows]).sum()} of "
+                    f"{len(rows)} objects not cut ({reason})\n"
+                )
+
+    # Save grids and metadata to a .npz file, with a mask of the saved rows
+    os.makedirs(f"{LOCAL_PROCESSED_DIR}/{band}", exist_ok=True)
+    job["output_filename"] = f"{LOCAL_PROCESSED_DIR}/{band}/{job['processed_name']}"
+    with timer("serialise"):
+        save_stamps(
+            job["output_filename"],
+            grids[valid],
+            encoding=encoding,
+            codec=codec,
+            metadata=temp_df.to_dict(),
+            valid=valid,
+        )
+    count("cut", valid.sum())
+    job["valid"] = valid
+    return job
+
+
+def upload_stage(job, ledger, uploader, on_uploaded):
+    """Queue the frames and grids of one batch and band for a batched upload.
+
+    Once all of them are on Google Drive the frames are deleted and
+    ``on_uploaded(job)`` is called from the uploader thread. If the upload
+    gives up, the frames are kept and the batch stays pending for a rerun.
+    """
+    band = job["band"]
+    frames_dest = f"{GDRIVE_REMOTE_NAME}:{GDRIVE_DESTINATION_DIR}/{band}"
+    grids_dest = f"{GDRIVE_REMOTE_NAME}:hermes/processed_grids/{band}"
+
+    def uploaded():
+        shutil.rmtree(job["frames_dir"], ignore_errors=True)
+        ledger.mark(job["files"], UPLOADED)
+        on_uploaded(job)
+
+    def failed():
+        print(f"Upload of batch {job['start']} band {band} failed, left for retry")
+
+    uploader.put(
+        [
+            *((file, frames_dest) for file in job["files"].values()),
+            (job["output_filename"], grids_dest),
+        ],
+        on_done=uploaded,
+        on_failed=failed,
+    )
+    return job
+
+
+def run_hail_mary(
+    df,
+    ledger_path=LEDGER_PATH,
+    download_workers=2,
+    decode_workers=4,
+    cut_workers=1,
+    queue_size=2,
+    decoded_cache_dir=DECODED_CACHE_DIR,
+    decoded_cache_bytes=20 * 1024**3,
+    metrics_path=None,
+    report_interval=60.0,
+    wcs_cache_size=256,
+    wcs_cache_path=None,
+    manifest_path=None,
+    max_conn=100,
+    upload_staging_dir=UPLOAD_STAGING_DIR,
+    upload_batch_files=2000,
+    upload_interval=60.0,
+    schedule_by="frame",
+    nside=64,
+    n_parts=1,
+    part=0,
+    encoding="float32",
+    codec="none",
+):
+    """Process the DataFrame in batches, download files, and upload them to Google Drive.
+
+    Every batch and band moves through download -> decode -> cut -> upload
+    stages connected by bounded queues, so batch k+1 downloads while batch k
+    is cut and batch k-1 uploads. Decoded frames are kept in a size-capped
+    cache, reference-counted by the pending rows that need them, so a frame
+    shared by several batches is downloaded and decompressed only once and
+    deleted as soon as its last object is cut.
+
+    Progress of every frame and object is recorded in a sqlite ledger, and
+    objects whose grids were already uploaded are skipped, so an interrupted
+    run resumes with only the remaining rows. Objects that could not be cut
+    in every band stay pending and are retried by the next run.
+
+    Stage timings and counters are summarised every ``report_interval``
+    seconds and written to ``metrics_path`` as JSON or Prometheus text.
+    With ``manifest_path``, the frame of every objID is written there first.
+
+    Downloads share one ``AdaptiveDownloader`` that tunes its connection
+    count up to ``max_conn`` from throughput and throttling. Uploads go
+    through a background ``BatchUploader`` that flushes every
+    ``upload_batch_files`` files or ``upload_interval`` seconds, and a
+    batch is only marked done once its grids are on Google Drive.
+
+    Rows are sorted by ``schedule_by`` (see ``hermes.scheduler``) and
+    batches never split a frame or tile, so each batch owns whole frames
+    and consecutive batches share neighbouring ones. Batches hold at most
+    ``BATCH_SIZE`` rows unless a single frame or tile has more. With
+    ``n_parts`` only partition ``part`` is processed, and no two partitions
+    share a frame when scheduling by frame. Grids are written with ``encoding`` and
+    ``codec`` to shrink what is uploaded.
+    """
+    configure_wcs_cache(wcs_cache_size, wcs_cache_path)
+    ledger = Ledger(ledger_path)
+    df = schedule(df, schedule_by, nside, n_parts, part)[0]
+    n_rows = len(df)
+    df = filter_pending(df, ledger, UPLOADED)
+    count("skipped_done", n_rows - len(df))
+    if manifest_path is not None:
+        write_manifest(df, manifest_path)
+    reporter = MetricsReporter(metrics_path, report_interval)
+    lock = threading.Lock()
+    bands_done = {}
+
+    def jobs():
+        # Split the DataFrame into chunks of whole frames or tiles
+        for rows in key_chunks(tile_keys(df, schedule_by, nside), BATCH_SIZE):
+            start = rows[0]
+            temp_df = df.iloc[rows].copy().reset_index(drop=True)
+            # Use a timestamp as the filename
+            processed_name = f"{int(time.time())}_{start}.npz"
+            for x in BANDS:
+                yield {
+                    "start": start,
+                    "band": x,
+                    "df": temp_df,
+                    "urls": temp_df["fits_url"].str.replace("frame-x-", f"frame-{x}-"),
+                    "processed_name": processed_name,
+                }
+
+    def mark_done(job):
+        # Only rows cut in every band are done; the rest are retried on resume
+        reporter.maybe_report()
+        with lock:
+            n, valid = bands_done.get(job["start"], (0, True))
+            n, valid = n + 1, valid & job["valid"]
+            bands_done[job["start"]] = n, valid
+            if n < len(BANDS):
+                return
+            del bands_done[job["start"]]
+        ledger.mark(job["df"]["objID"][valid], CUT | UPLOADED)
+        print(f"Batch {job['start']} complete, {(~valid).sum()} rows left for retry")
+
+    cache = DecodedFrameCache(decoded_cache_dir, max_bytes=decoded_cache_bytes)
+    names = df["fits_url"].str.rsplit("/", n=1).str[-1].str[: -len(BZ2_SUFFIX)]
+    for x in BANDS:
+        cache.retain(names.str.replace("frame-x-", f"frame-{x}-").value_counts())
+    downloader = AdaptiveDownloader(max_conn=max_conn)
+    uploader = BatchUploader(
+        upload_staging_dir,
+        max_batch_files=upload_batch_files,
+        flush_interval=upload_interval,
+    )
+    executor = ProcessPoolExecutor(max_workers=decode_workers)
+    pipeline = Pipeline(
+        [
+            Stage(
+                "download",
+                partial(
+                    download_stage,
+                    ledger=ledger,
+                    cache=cache,
+                    downloader=downloader,
+                ),
+                workers=download_workers,
+                ordered=True,
+            ),
+            Stage(
+                "decode",
+                partial(decode_stage, cache=cache, executor=executor, ledger=ledger),
+            ),
+            Stage(
+                "cut",
+                partial(
+                    cut_stage,
+                    cache=cache,
+                    encoding=encoding,
+                    codec=codec,
+                    refetch=partial(
+                        refetch_frames,
+                        cache=cache,
+                        downloader=downloader,
+                        executor=executor,
+                        ledger=ledger,
+                    ),
+                ),
+                workers=cut_workers,
+            ),
+            Stage(
+                "upload",
+                partial(
+                    upload_stage,
+                    ledger=ledger,
+                    uploader=uploader,
+                    on_uploaded=mark_done,
+                ),
+            ),
+        ],
+        maxsize=queue_size,
+    )
+    with executor:
+        pipeline.run(jobs())
+    uploader.close()
+    ledger.close()
+    print(pipeline.summary())
+    print(f"Decoded frame cache: {cache.hits} hits, {cache.misses} misses")
+    print(downloader.summary())
+    print(uploader.summary())
+    reporter.report()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download Upload fits files")
     parser.add_argument("--data_path", type=str, default="first75k_dataset.csv")
     parser.add_argument("--max_conn", type=int, default=100)
+    parser.add_argument("--ledger_path", type=str, default=LEDGER_PATH)
+    parser.add_argument("--download_workers", type=int, default=2)
+    parser.add_argument(
+        "--decode_workers", type=int, default=4, help="bz2 decompression processes"
+    )
+    parser.add_argument("--cut_workers", type=int, default=1)
+    parser.add_argument(
+        "--upload_batch_files", type=int, default=2000, help="Files per rclone call"
+    )
+    parser.add_argument(
+        "--upload_interval",
+        type=float,
+        default=60.0,
+        help="Max seconds between uploads",
+    )
+    parser.add_argument("--upload_staging_dir", type=str, default=UPLOAD_STAGING_DIR)
+    parser.add_argument(
+        "--queue_size", type=int, default=2, help="Jobs buffered between stages"
+    )
+    parser.add_argument("--decoded_cache_dir", type=str, default=DECODED_CACHE_DIR)
+    parser.add_argument(
+        "--decoded_cache_gb", type=float, default=20, help="Decoded frame cache cap"
+    )
+    parser.add_argument(
+        "--metrics_path",
+        type=str,
+        default=None,
+        help="Write stage timings and counters as JSON, or Prometheus text (.prom)",
+    )
+    parser.add_argument(
+        "--report_interval", type=float, default=60.0, help="Seconds between summaries"
+    )
+    parser.add_argument(
+        "--wcs_cache_size", type=int, default=256, help="WCS objects kept per process"
+    )
+    parser.add_argument(
+        "--wcs_cache_path",
+        type=str,
+        default=None,
+        help="sqlite store of compact WCS headers shared across runs and workers",
+    )
+    parser.add_argument(
+        "--manifest_path", type=str, default=None, help="CSV mapping objID to frame"
+    )
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        choices=SCHEDULES,
+        default="frame",
+        help="Batch order: catalog rows, frames, or HEALPix tiles",
+    )
+    parser.add_argument("--nside", type=int, default=64, help="HEALPix nside")
+    parser.add_argument(
+        "--n_parts", type=int, default=1, help="Split the catalog across machines"
+    )
+    parser.add_argument("--part", type=int, default=0, help="Partition to process")
+    parser.add_argument(
+        "--encoding", type=str, choices=list(ENCODINGS), default="float32"
+    )
+    parser.add_argument(
+        "--codec", type=str, choices=CODECS, default="none", help="Grid compression"
+    )
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
     df = pd.read_csv(args.data_path)
-    df = df[
-        df["file_downloaded"] == 0
-    ]  # Only process files that haven't been downloaded yet
-    run_hail_mary(df, data_path=args.data_path)
+    if "file_downloaded" in df:
+        # Skip rows marked as done by runs that predate the ledger
+        df = df[df["file_downloaded"] == 0]
+    run_hail_mary(
+        df,
+        ledger_path=args.ledger_path,
+        download_workers=args.download_workers,
+        decode_workers=args.decode_workers,
+        cut_workers=args.cut_workers,
+        queue_size=args.queue_size,
+        decoded_cache_dir=args.decoded_cache_dir,
+        decoded_cache_bytes=int(args.decoded_cache_gb * 1024**3),
+        metrics_path=args.metrics_path,
+        report_interval=args.report_interval,
+        wcs_cache_size=args.wcs_cache_size,
+        wcs_cache_path=args.wcs_cache_path,
+        manifest_path=args.manifest_path,
+        max_conn=args.max_conn,
+        upload_staging_dir=args.upload_staging_dir,
+        upload_batch_files=args.upload_batch_files,
+        upload_interval=args.upload_interval,
+        schedule_by=args.schedule,
+        nside=args.nside,
+        n_parts=args.n_parts,
+        part=args.part,
+        encoding=args.encoding,
+        codec=args.codec,
+    )
@@ -0,0 +1,145 @@
+import logging
+import queue
+import threading
+
+from hermes.instrumentation import count, timer
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    """A pipeline step run by ``workers`` threads.
+
+    ``func`` takes one item and returns the item handed to the next stage, or
+    ``None`` to drop it. Exceptions are logged and the item is dropped. Time
+    spent in ``func`` is recorded under the stage name.
+
+    With ``ordered=True`` the workers still run ``func`` concurrently but
+    hand items on in the order they arrived.
+    """
+
+    def __init__(self, name, func, workers=1, ordered=False):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.ordered = ordered
+        self.processed = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._remaining = workers
+        self._take_lock = threading.Lock()
+        self._turn = threading.Condition()
+        self._taken = 0
+        self._handed = 0
+
+    def _take(self, inbox):
+        if not self.ordered:
+            return inbox.get(), None
+        with self._take_lock:
+            item = inbox.get()
+            ticket = self._taken
+            self._taken += 1
+        return item, ticket
+
+    def _hand_on(self, outbox, result, ticket):
+        if ticket is None:
+            if result is not None:
+                outbox.put(result)
+            return
+        with self._turn:
+            self._turn.wait_for(lambda: self._handed == ticket)
+            if result is not None:
+                outbox.put(result)
+            self._handed += 1
+            self._turn.notify_all()
+
+    def _run(self, inbox, outbox, next_workers):
+        while True:
+            item, ticket = self._take(inbox)
+            if item is _DONE:
+                break
+            result = None
+            try:
+                with timer(self.name):
+                    result = self.func(item)
+            except Exception as e:
+                count(f"{self.name}_errors")
+                logger.exception(f"Stage {self.name} failed: {e}")
+                with self._lock:
+                    self.errors += 1
+            else:
+                with self._lock:
+                    self.processed += 1
+            self._hand_on(outbox, result, ticket)
+
+        # The last worker to finish tells every worker of the next stage to stop
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            for _ in range(next_workers):
+                outbox.put(_DONE)
+
+
+class Pipeline:
+    """Chain stages with bounded queues so they all run at the same time.
+
+    With ``maxsize`` items buffered between stages, item k+1 can be in the
+    first stage while item k is in the second and item k-1 in the third, so
+    wall time approaches that of the slowest stage rather than the sum.
+    """
+
+    def __init__(self, stages, maxsize=2):
+        self.stages = stages
+        self.maxsize = maxsize
+
+    def run(self, items):
+        """Feed ``items`` through every stage and return the final outputs."""
+        queues = [queue.Queue(self.maxsize) for _ in self.stages]
+        queues.append(queue.Queue())
+
+        threads = []
+        for k, stage in enumerate(self.stages):
+            next_workers = self.stages[k + 1].workers if k + 1 < len(self.stages) else 1
+            for w in range(stage.workers):
+                thread = threading.Thread(
+                    target=stage._run,
+                    args=(queues[k], queues[k + 1], next_workers),
+                    name=f"{stage.name}-{w}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        def feed():
+            try:
+                for item in items:
+                    queues[0].put(item)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+        feeder.start()
+
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            results.append(item)
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def summary(self):
+        return {
+            stage.name: {"processed": stage.processed, "errors": stage.errors}
+            for stage in self.stages
+        }
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+from hermes.instrumentation import count
+
+
+def normalise_sql(sql):
+    """Collapse all whitespace so formatting changes do not change the key."""
+    return " ".join(sql.split())
+
+
+class QueryCache:
+    """On-disk cache of query results stored as parquet files.
+
+    Entries expire ``ttl`` seconds after they were written and the least
+    recently read entries are evicted once the cache exceeds ``max_bytes``.
+    Write time is kept in the file mtime and last read in its atime, which
+    is set explicitly so it works on ``noatime`` mounts too.
+    """
+
+    def __init__(self, cache_dir, ttl=7 * 24 * 3600, max_bytes=5 * 1024**3):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, *parts):
+        return hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def get(self, key):
+        """Return the path of a fresh entry, or ``None`` on a miss."""
+        path = self.path(key)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                count("query_cache_miss")
+                return None
+            if time.time() - stat.st_mtime > self.ttl:
+                os.remove(path)
+                count("query_cache_miss")
+                return None
+            os.utime(path, (time.time(), stat.st_mtime))
+        count("query_cache_hit")
+        return path
+
+    def put_frame(self, key, df):
+        self._put(key, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+    def put_file(self, key, path):
+        self._put(key, lambda tmp_path: shutil.copyfile(path, tmp_path))
+
+    def _put(self, key, write):
+        tmp_path = f"{self.path(key)}.tmp"
+        write(tmp_path)
+        with self._lock:
+            os.replace(tmp_path, self.path(key))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".parquet"):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".parquet"):
+                    os.remove(entry.path)
+
+
+def read_cached(path, output_path=None):
+    """Load a cached result, or copy it to ``output_path`` and return that path."""
+    if output_path is None:
+        return pd.read_parquet(path)
+    shutil.copyfile(path, output_path)
+    return output_path
@@ -0,0 +1,174 @@
+import argparse
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from hermes.decompress import BZ2_SUFFIX
+from hermes.instrumentation import count, timer
+from hermes.ledger import CORRUPT, DOWNLOADED, Ledger
+from hermes.url_generator import BANDS, unique_frames
+
+logger = logging.getLogger(__name__)
+
+RSYNC_SOURCE = "rsync://dtn.sdss.org/dr17/"
+FRAMES_PREFIX = "eboss/photoObj/frames"
+RSYNC_ARGS = ["-aL", "--partial", "--no-motd"]
+
+
+def frame_paths(df, bands=BANDS, prefix=FRAMES_PREFIX, ledger=None):
+    """Sorted relative paths of the unique frames of a catalog, for --files-from.
+
+    Frames the ledger records as corrupt are left out.
+    """
+    frames = unique_frames(df, bands, base_url=None)
+    directory = (
+        frames["rerun"].astype(str)
+        + "/"
+        + frames["run"].astype(str)
+        + "/"
+        + frames["camcol"].astype(str)
+    )
+    names = frames["file_name"] + BZ2_SUFFIX
+    if ledger is not None:
+        names = names.loc[~names.isin(ledger.done(CORRUPT))]
+    return sorted(prefix + "/" + directory.loc[names.index] + "/" + names)
+
+
+def split_manifest(paths, n_shards):
+    """Split sorted paths into ``n_shards`` contiguous shards of equal length.
+
+    Contiguous shards keep each run/camcol directory in as few rsync
+    processes as possible, so each one walks few remote directories.
+    """
+    n_shards = max(1, min(n_shards, len(paths)))
+    return [list(shard) for shard in np.array_split(np.asarray(paths), n_shards)]
+
+
+def write_manifests(shards, manifest_dir):
+    """Write one --files-from list per shard and return their paths."""
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifests = []
+    for k, shard in enumerate(shards):
+        path = os.path.join(manifest_dir, f"shard_{k:04d}.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(shard) + "\n")
+        manifests.append(path)
+    return manifests
+
+
+def run_rsync(manifest, source, dest, rsync_bin="rsync", args=RSYNC_ARGS):
+    """Run one rsync over a --files-from manifest and return its exit code.
+
+    An rsync that cannot be started fails the shard with exit code 127.
+    """
+    command = [rsync_bin, *args, f"--files-from={manifest}", source, dest]
+    try:
+        with timer("rsync"):
+            result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        logger.error(f"rsync {manifest} could not run: {e}")
+        return 127
+    if result.returncode != 0:
+        logger.error(
+            f"rsync {manifest} exited {result.returncode}: {result.stderr.strip()}"
+        )
+    return result.returncode
+
+
+def transfer(
+    paths,
+    source=RSYNC_SOURCE,
+    dest="dr17",
+    n_shards=8,
+    max_procs=4,
+    manifest_dir="rsync_manifests",
+    ledger=None,
+    retries=2,
+    backoff=30.0,
+    rsync_bin="rsync",
+):
+    """Fetch ``paths`` with ``max_procs`` parallel rsync processes.
+
+    Frames ``ledger`` already records as ``DOWNLOADED`` are dropped and the
+    rest are split into ``n_shards`` --files-from manifests, so a rerun only
+    transfers what is missing. The frames of a shard that exits cleanly are
+    marked ``DOWNLOADED``; failed shards are retried ``retries`` times after
+    ``backoff`` seconds. ``source`` can be an rsync daemon URL or a local
+    directory. Returns the manifests of shards that still failed.
+    """
+    if ledger is not None:
+        done = ledger.done(DOWNLOADED)
+        n_paths = len(paths)
+        paths = [path for path in paths if os.path.basename(path) not in done]
+        count("rsync_files_skipped", n_paths - len(paths))
+    if not paths:
+        return []
+    shards = split_manifest(paths, n_shards)
+    pending = dict(zip(write_manifests(shards, manifest_dir), shards))
+    os.makedirs(dest, exist_ok=True)
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max_procs) as executor:
+            futures = {
+                executor.submit(run_rsync, manifest, source, dest, rsync_bin): manifest
+                for manifest in pending
+            }
+            for future in as_completed(futures):
+                manifest = futures[future]
+                shard = pending[manifest]
+                if future.result() != 0:
+                    failed[manifest] = shard
+                    count("rsync_shards_failed")
+                    continue
+                count("rsync_shards_done")
+                count("rsync_files", len(shard))
+                if ledger is not None:
+                    ledger.mark(map(os.path.basename, shard), DOWNLOADED)
+        pending = failed
+    return list(pending)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bulk-download catalog frames with parallel rsync processes"
+    )
+    parser.add_argument("--data_path", type=str, required=True)
+    parser.add_argument("--source", type=str, default=RSYNC_SOURCE)
+    parser.add_argument("--dest", type=str, default="dr17")
+    parser.add_argument("--bands", nargs="+", default=BANDS)
+    parser.add_argument("--n_shards", type=int, default=8)
+    parser.add_argument("--max_procs", type=int, default=4)
+    parser.add_argument("--manifest_dir", type=str, default="rsync_manifests")
+    parser.add_argument("--ledger_path", type=str, default="rsync_progress.sqlite")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--rsync_bin", type=str, default="rsync")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    df = pd.read_csv(args.data_path)
+    with Ledger(args.ledger_path) as ledger:
+        paths = frame_paths(df, args.bands, ledger=ledger)
+        logger.info(f"{len(df)} objects on {len(paths)} unique frames")
+        failed = transfer(
+            paths,
+            args.source,
+            args.dest,
+            n_shards=args.n_shards,
+            max_procs=args.max_procs,
+            manifest_dir=args.manifest_dir,
+            ledger=ledger,
+            retries=args.retries,
+            rsync_bin=args.rsync_bin,
+        )
+    if failed:
+        logger.error(f"{len(failed)} shards failed: {', '.join(failed)}")
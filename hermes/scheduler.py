@@ -0,0 +1,103 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from hermes.url_generator import frame_codes
+
+SCHEDULES = ["catalog", "frame", "healpix"]
+
+
+def healpix_index(ra, dec, nside=64):
+    """Nested HEALPix pixel of every position, so nearby pixels have nearby ids."""
+    try:
+        import astropy.units as u
+        from astropy_healpix import HEALPix
+    except ImportError as e:
+        raise ImportError(
+            "HEALPix scheduling needs astropy_healpix: pip install astropy-healpix"
+        ) from e
+    hp = HEALPix(nside=nside, order="nested")
+    return hp.lonlat_to_healpix(np.asarray(ra) * u.deg, np.asarray(dec) * u.deg)
+
+
+def tile_keys(df, by="frame", nside=64):
+    """Integer work key of every row; rows sharing a key are cut together.
+
+    ``frame`` keys follow (rerun, run, camcol, field), so consecutive keys
+    are neighbouring fields of one scan. ``healpix`` keys are nested
+    HEALPix pixels, and ``catalog`` keeps every row on its own.
+    """
+    if by == "catalog":
+        return np.arange(len(df))
+    if by == "frame":
+        return frame_codes(df)[1]
+    if by == "healpix":
+        return healpix_index(df["ra"].to_numpy(), df["dec"].to_numpy(), nside)
+    raise ValueError(f"Invalid schedule {by}. Supported schedules are {SCHEDULES}")
+
+
+def schedule(df, by="frame", nside=64, n_parts=1, part=0):
+    """Sort ``df`` by work key and keep partition ``part`` of ``n_parts``.
+
+    Partitions are contiguous runs of whole keys with about the same number
+    of rows, so with ``frame`` keys no two partitions share a frame and
+    several machines can split a catalog without overlapping downloads.
+    Returns the rows and their sorted keys.
+    """
+    keys = tile_keys(df, by, nside)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    if n_parts > 1:
+        starts = group_starts(keys)
+        group_part = starts * n_parts // len(keys)
+        sizes = np.diff(np.append(starts, len(keys)))
+        rows = np.repeat(group_part, sizes) == part
+        order, keys = order[rows], keys[rows]
+    return df.iloc[order], keys
+
+
+def group_starts(keys):
+    """Row positions where a new key begins in sorted ``keys``."""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def key_chunks(keys, chunk_size):
+    """Split sorted ``keys`` into row-position arrays of at most ``chunk_size``.
+
+    Chunks only break where the key changes, so each chunk owns its frames
+    or tiles whole. A new chunk starts whenever the next key would overflow
+    the current one, and a key with more than ``chunk_size`` rows gets a
+    chunk of its own.
+    """
+    starts = group_starts(keys)
+    if len(starts) == 0:
+        return []
+    bounds = [0]
+    for start, stop in zip(starts[1:], np.append(starts[2:], len(keys))):
+        if stop - bounds[-1] > chunk_size:
+            bounds.append(start)
+    return [
+        np.arange(start, stop) for start, stop in zip(bounds, bounds[1:] + [len(keys)])
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reorder a catalog by frame or sky tile and split it into parts"
+    )
+    parser.add_argument("--data_path", type=str, required=True)
+    parser.add_argument("--schedule", type=str, choices=SCHEDULES, default="frame")
+    parser.add_argument("--nside", type=int, default=64)
+    parser.add_argument("--n_parts", type=int, default=1)
+    parser.add_argument("--output_prefix", type=str, default=None)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data_path)
+    prefix = args.output_prefix or args.data_path[:-4]
+    for part in range(args.n_parts):
+        part_df, keys = schedule(df, args.schedule, args.nside, args.n_parts, part)
+        part_df.to_csv(f"{prefix}_part{part:03d}.csv", index=False)
+        print(f"part {part}: {len(part_df)} rows on {len(group_starts(keys))} keys")
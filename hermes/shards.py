@@ -0,0 +1,235 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from hermes.encodings import ENCODINGS, decode_stamps, encode_stamps
+from hermes.instrumentation import timer
+
+INDEX_FILE = "index.csv"
+META_FILE = "meta.json"
+
+
+def shard_paths(save_path, shard):
+    return (
+        f"{save_path}/X_{shard:05d}.npy",
+        f"{save_path}/y_{shard:05d}.npy",
+    )
+
+
+def scale_path(save_path, shard):
+    """Per-stamp step and offset of an int16-encoded shard."""
+    return f"{save_path}/s_{shard:05d}.npy"
+
+
+def shard_files(save_path, shard, encoding="float32"):
+    """Every file of a shard, for copying or linking whole shards."""
+    files = shard_paths(save_path, shard)
+    if encoding == "int16":
+        files += (scale_path(save_path, shard),)
+    return files
+
+
+class ShardWriter:
+    """Append cutouts into fixed-size memory-mapped shards.
+
+    Each shard is a preallocated ``X_{shard}.npy`` of shape
+    ``(shard_size, *shape)`` with a parallel ``y_{shard}.npy`` of labels.
+    ``index.csv`` maps every objID to its ``(shard, offset)``. Opening an
+    existing store resumes appending after the last indexed object.
+
+    Stamps are stored with ``encoding`` (see ``hermes.encodings``, float32
+    by default); ``int16`` shards keep each stamp's step and offset in
+    ``s_{shard}.npy``. An existing store keeps its encoding, and asking for
+    a different one raises ``ValueError``.
+    """
+
+    def __init__(
+        self,
+        save_path,
+        shard_size=10000,
+        shape=(40, 40, 5),
+        n_labels=4,
+        dtype=np.float32,
+        encoding=None,
+    ):
+        self.save_path = save_path
+        os.makedirs(save_path, exist_ok=True)
+
+        meta_path = f"{save_path}/{META_FILE}"
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            stored = meta.get("encoding", "float32")
+            if encoding is not None and encoding != stored:
+                raise ValueError(
+                    f"{save_path} stores {stored} stamps, cannot append {encoding}"
+                )
+        else:
+            encoding = encoding or "float32"
+            if encoding not in ENCODINGS:
+                raise ValueError(
+                    f"Invalid encoding {encoding}. Supported are {list(ENCODINGS)}"
+                )
+            if encoding != "float32":
+                dtype = ENCODINGS[encoding]
+            meta = {
+                "shard_size": shard_size,
+                "shape": list(shape),
+                "n_labels": n_labels,
+                "dtype": np.dtype(dtype).str,
+                "encoding": encoding,
+            }
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        self.shard_size = meta["shard_size"]
+        self.shape = tuple(meta["shape"])
+        self.n_labels = meta["n_labels"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.encoding = meta.get("encoding", "float32")
+
+        # Resume after the last object recorded in the index
+        index_path = f"{save_path}/{INDEX_FILE}"
+        self.shard, self.offset = 0, 0
+        if os.path.exists(index_path):
+            index = pd.read_csv(index_path)
+            if len(index):
+                last = index.iloc[-1]
+                self.shard, self.offset = int(last["shard"]), int(last["offset"]) + 1
+        else:
+            with open(index_path, "w") as f:
+                f.write("objID,shard,offset\n")
+        self._index = open(index_path, "a")
+        self.X, self.y, self.scale = None, None, None
+
+    def _open_shard(self):
+        X_path, y_path = shard_paths(self.save_path, self.shard)
+        if self.encoding == "int16":
+            s_path = scale_path(self.save_path, self.shard)
+            mode = "r+" if os.path.exists(s_path) else "w+"
+            self.scale = np.lib.format.open_memmap(
+                s_path,
+                mode=mode,
+                dtype=np.float32,
+                shape=(self.shard_size, 2, *self.shape[2:]),
+            )
+        if os.path.exists(X_path):
+            self.X = np.lib.format.open_memmap(X_path, mode="r+")
+            self.y = np.lib.format.open_memmap(y_path, mode="r+")
+        else:
+            self.X = np.lib.format.open_memmap(
+                X_path,
+                mode="w+",
+                dtype=self.dtype,
+                shape=(self.shard_size, *self.shape),
+            )
+            self.y = np.lib.format.open_memmap(
+                y_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(self.shard_size, self.n_labels),
+            )
+
+    def _close_shard(self):
+        if self.X is not None:
+            self.X.flush()
+            self.y.flush()
+        if self.scale is not None:
+            self.scale.flush()
+        self.X, self.y, self.scale = None, None, None
+
+    def append(self, obj_ids, grids, labels):
+        """Write a batch of cutouts, rolling over to a new shard when full."""
+        with timer("encode"):
+            grids, scale = encode_stamps(grids, self.encoding)
+        start = 0
+        while start < len(obj_ids):
+            if self.offset == self.shard_size:
+                self._close_shard()
+                self.shard, self.offset = self.shard + 1, 0
+            if self.X is None:
+                self._open_shard()
+
+            stop = min(len(obj_ids), start + self.shard_size - self.offset)
+            end = self.offset + stop - start
+            self.X[self.offset : end] = grids[start:stop]
+            self.y[self.offset : end] = labels[start:stop]
+            if scale is not None:
+                self.scale[self.offset : end] = scale[start:stop]
+            self._index.writelines(
+                f"{obj_id},{self.shard},{offset}\n"
+                for obj_id, offset in zip(obj_ids[start:stop], range(self.offset, end))
+            )
+            self.offset, start = end, stop
+        self._index.flush()
+
+    def close(self):
+        self._close_shard()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardReader:
+    """Memory-map shards written by ``ShardWriter`` for zero-copy reads.
+
+    ``shard`` returns the stored arrays as they are on disk; ``stamps`` and
+    item lookups decode them to float32.
+    """
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        with open(f"{save_path}/{META_FILE}") as f:
+            self.encoding = json.load(f).get("encoding", "float32")
+        self.index = pd.read_csv(
+            f"{save_path}/{INDEX_FILE}", dtype={"shard": np.int32, "offset": np.int32}
+        ).set_index("objID")
+        # An object re-cut after a crash is appended again; the last copy wins
+        self.index = self.index[~self.index.index.duplicated(keep="last")]
+        self.counts = (self.index.groupby("shard")["offset"].max() + 1).to_dict()
+        self._shards = {}
+        self._scales = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def n_shards(self):
+        return len(self.counts)
+
+    def shard(self, shard):
+        """Return the ``(X, y)`` memmaps of a shard, trimmed to its filled rows."""
+        if shard not in self._shards:
+            X_path, y_path = shard_paths(self.save_path, shard)
+            count = self.counts[shard]
+            self._shards[shard] = (
+                np.load(X_path, mmap_mode="r")[:count],
+                np.load(y_path, mmap_mode="r")[:count],
+            )
+        return self._shards[shard]
+
+    def scale(self, shard):
+        """Per-stamp step and offset of an int16 shard, else ``None``."""
+        if self.encoding != "int16":
+            return None
+        if shard not in self._scales:
+            path = scale_path(self.save_path, shard)
+            self._scales[shard] = np.load(path, mmap_mode="r")[: self.counts[shard]]
+        return self._scales[shard]
+
+    def stamps(self, shard, rows=slice(None)):
+        """Decoded float32 stamps of ``rows`` of a shard."""
+        X, _ = self.shard(shard)
+        scale = self.scale(shard)
+        return decode_stamps(X[rows], scale[rows] if scale is not None else None)
+
+    def __getitem__(self, obj_id):
+        shard, offset = self.index.loc[obj_id, ["shard", "offset"]]
+        shard, offset = int(shard), int(offset)
+        _, y = self.shard(shard)
+        return self.stamps(shard, slice(offset, offset + 1))[0], y[offset]
@@ -5,33 +5,211 @@ Modified by Raahul Singh to work with Python 3
 """
 
 import argparse
-import io
 import logging
+import math
 import os
+import re
+import shutil
 import sys
-from urllib.parse import urlencode
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hermes.query_cache import QueryCache, normalise_sql, read_cached
 
 SUPPORTED_OUTPUT_FORMATS = ["html", "csv", "json"]
+# Using DR17. Breaks on DR18 due to changes in the ASP interface. See if fix needed.
+DEFAULT_URL = "https://skyserver.sdss.org/dr17/en/tools/search/x_sql.aspx"
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Explicit dtypes for the catalog columns, other columns are inferred
+SCHEMA = {
+    "objID": "uint64",
+    "run": "uint16",
+    "rerun": "uint16",
+    "camcol": "uint8",
+    "field": "uint16",
+    "ra": "float64",
+    "dec": "float64",
+}
+
+WHERE_PATTERN = re.compile(r"\bWHERE\b", re.IGNORECASE)
+CLAUSE_PATTERN = re.compile(r"\b(?:GROUP|ORDER)\s+BY\b", re.IGNORECASE)
+SELECT_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?:TOP\s+\d+\s+)?.*?\bFROM\b", re.IGNORECASE | re.DOTALL
+)
+
+
+def split_query(sql):
+    """Split a comment-free query into the parts before, inside and after WHERE.
+
+    Only a WHERE outside parentheses counts, so subqueries are left alone.
+    The condition is ``None`` when the query has no top-level WHERE.
+    """
+    clause = CLAUSE_PATTERN.search(sql)
+    body, tail = (sql[: clause.start()], sql[clause.start() :]) if clause else (sql, "")
+    for where in WHERE_PATTERN.finditer(body):
+        prefix = body[: where.start()]
+        if prefix.count("(") == prefix.count(")"):
+            return prefix, body[where.end() :], tail
+    return body, None, tail
+
+
+def page_query(sql, column, lo, hi):
+    """Restrict ``sql`` to rows with ``lo <= column < hi``."""
+    head, condition, tail = split_query(sql)
+    predicate = f"{column} >= {lo} AND {column} < {hi}"
+    if condition is None:
+        return f"{head.rstrip()} WHERE {predicate} {tail}"
+    return f"{head.rstrip()} WHERE ({condition.strip()}) AND {predicate} {tail}"
+
+
+def bounds_query(sql, column):
+    """Rewrite ``sql`` to return the minimum and maximum of ``column``."""
+    head, condition, _ = split_query(sql)
+    head = SELECT_PATTERN.sub(
+        f"SELECT MIN({column}) AS lo, MAX({column}) AS hi FROM", head, count=1
+    )
+    if condition is None:
+        return head
+    return f"{head.rstrip()} WHERE {condition.strip()}"
+
+
+def midpoint(lo, hi):
+    if isinstance(lo, int) and isinstance(hi, int):
+        return (lo + hi) // 2
+    return (lo + hi) / 2
+
+
+def split_range(lo, hi, n_pages):
+    """Split ``[lo, hi)`` into ``n_pages`` contiguous half-open ranges.
+
+    Integer bounds such as objIDs are split with exact integer arithmetic,
+    since 64-bit IDs do not survive a round trip through float64.
+    """
+    if isinstance(lo, int) and isinstance(hi, int):
+        n_pages = max(1, min(n_pages, hi - lo))
+        edges = [lo + (hi - lo) * k // n_pages for k in range(n_pages + 1)]
+    else:
+        edges = [lo + (hi - lo) * k / n_pages for k in range(n_pages + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def iter_csv(stream, schema=SCHEMA, chunk_rows=100000):
+    """Parse a SkyServer CSV stream into typed chunks, skipping its ``#Table1`` line.
+
+    The stream is consumed ``chunk_rows`` rows at a time, so the response is
+    never held in memory as a whole.
+    """
+    try:
+        reader = pd.read_csv(stream, skiprows=1, dtype=schema, chunksize=chunk_rows)
+    except pd.errors.EmptyDataError:
+        return
+    with reader:
+        yield from reader
+
+
+def concat_chunks(chunks):
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_parquet(chunks, output_path):
+    """Append DataFrame or Arrow table chunks to one parquet file as they arrive.
+
+    Every chunk is cast to the schema of the first, and the number of rows
+    written is returned. No file is created when there are no chunks.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    n_rows = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                chunk = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, chunk.schema)
+            elif not chunk.schema.equals(writer.schema, check_metadata=False):
+                chunk = chunk.cast(writer.schema)
+            writer.write_table(chunk)
+            n_rows += chunk.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def iter_parquet(paths):
+    """Yield the row groups of parquet files one at a time."""
+    import pyarrow.parquet as pq
+
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i)
 
 
 class SQLCL:
-    # TODO: Add support for running multiple queries in a single request
+    """SkyServer SQL client over a pooled HTTP session.
+
+    Requests share one ``requests.Session`` whose adapter keeps up to
+    ``pool_size`` connections alive and retries 429/5xx responses with
+    exponential backoff. ``query_paged`` splits a large query into range
+    pages and runs them concurrently.
+
+    With ``cache_dir`` set, CSV results are cached on disk as parquet, keyed
+    by the comment-stripped, whitespace-normalised SQL, the URL and the
+    format, so repeated queries never reach SkyServer.
+    """
 
     def __init__(
         self,
-        url="https://skyserver.sdss.org/dr17/en/tools/search/x_sql.aspx",  # Using DR16. Breaks on DR18 due to changes in the ASP interface. See if fix needed.
+        url=DEFAULT_URL,
         output_format="csv",
         log_to_stdout=True,
+        timeout=300,
+        max_retries=5,
+        backoff_factor=1.0,
+        pool_size=8,
+        schema=SCHEMA,
+        chunk_rows=100000,
+        cache_dir=None,
+        cache_ttl=7 * 24 * 3600,
+        cache_bytes=5 * 1024**3,
     ):
         self.url = url
         if output_format not in SUPPORTED_OUTPUT_FORMATS:
             raise ValueError(
-                f"Invalid output format {output_format}. Supported formats are {SUPPORTED_OUTPUT_FORMAT}"
+                f"Invalid output format {output_format}. Supported formats are {SUPPORTED_OUTPUT_FORMATS}"
             )
         self.output_format = output_format
+        self.timeout = timeout
+        self.schema = schema
+        self.chunk_rows = chunk_rows
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = QueryCache(cache_dir, ttl=cache_ttl, max_bytes=cache_bytes)
+
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
@@ -45,26 +223,82 @@ class SQLCL:
             fsql += line.split("--")[0] + " " + os.linesep
         return fsql
 
-    def query_database(self, query):
-        # URL-encode the query
+    def _get(self, query, output_format, stream=False):
+        return self.session.get(
+            self.url,
+            params={"cmd": query, "format": output_format},
+            timeout=self.timeout,
+            stream=stream,
+        )
+
+    def _iter_response(self, response):
+        # Let urllib3 undo any gzip transfer encoding while streaming
+        response.raw.decode_content = True
+        return iter_csv(response.raw, self.schema, self.chunk_rows)
+
+    def _stream(self, query):
+        """Yield typed chunks of an already filtered query, raising on HTTP errors."""
+        with self._get(query, "csv", stream=True) as response:
+            response.raise_for_status()
+            yield from self._iter_response(response)
+
+    def _fetch(self, query):
+        return concat_chunks(self._stream(query))
+
+    def _fetch_to_file(self, query, output_path):
+        return write_parquet(self._stream(query), output_path)
+
+    def _cache_key(self, query, output_format, *extra):
+        if self.cache is None or output_format != "csv":
+            return None
+        return self.cache.key(normalise_sql(query), self.url, output_format, *extra)
+
+    def _cache_get(self, key, use_cache):
+        if key is None or not use_cache:
+            return None
+        return self.cache.get(key)
+
+    def _cache_put(self, key, result):
+        if key is None:
+            return
+        if isinstance(result, pd.DataFrame):
+            self.cache.put_frame(key, result)
+        elif isinstance(result, str) and os.path.exists(result):
+            self.cache.put_file(key, result)
+
+    def query_database(self, query, output_path=None, use_cache=True):
+        """Run ``query`` and return a DataFrame, or write it to parquet.
+
+        The response body is parsed as it streams in. With ``output_path``
+        the chunks go straight to a parquet file and the path is returned.
+        ``use_cache=False`` skips the cache lookup and refreshes the entry.
+        """
         query = self.filtercomment(query)
+        key = self._cache_key(query, self.output_format)
+        cached = self._cache_get(key, use_cache)
+        if cached is not None:
+            self.logger.info(f"Query served from cache {cached}")
+            return read_cached(cached, output_path)
         self.logger.info(f"Querying the database with the following query: {query}")
-        encoded_query = urlencode({"cmd": query, "format": self.output_format})
 
-        # Construct the full URL with the encoded query
-        full_url = f"{self.url}?{encoded_query}"
-
-        # Send a GET request to the provided URL
-        response = requests.get(full_url)
+        # Send a GET request over the pooled session
+        with self._get(query, self.output_format, stream=True) as response:
+            result = self._parse_response(response, output_path)
+        self._cache_put(key, result)
+        return result
 
+    def _parse_response(self, response, output_path):
         # Check if the request was successful
         if response.status_code == 200:
             self.logger.info("Query successful")
             # TODO: Attempt to parse the response as JSON
             # Attempt to parse the response as CSV
             if self.output_format == "csv":
-                urlData = response.content
-                return pd.read_csv(io.StringIO(urlData.decode("utf-8")), skiprows=1)
+                chunks = self._iter_response(response)
+                if output_path is not None:
+                    write_parquet(chunks, output_path)
+                    return output_path
+                return concat_chunks(chunks)
             else:
                 return {
                     "error": "Failed to parse the response. Unsupported output format: {}".format(
@@ -78,21 +312,187 @@ class SQLCL:
                 )
             }
 
+    def fetch_bounds(self, query, column):
+        """Return the ``[lo, hi)`` range of ``column`` over the rows of ``query``."""
+        bounds = self._fetch(bounds_query(query, column))
+        lo, hi = bounds["lo"].iloc[0], bounds["hi"].iloc[0]
+        if pd.api.types.is_integer_dtype(bounds["lo"]):
+            return int(lo), int(hi) + 1
+        return float(lo), math.nextafter(float(hi), math.inf)
+
+    def query_paged(
+        self,
+        query,
+        column="p.objID",
+        n_pages=16,
+        bounds=None,
+        max_workers=4,
+        row_limit=None,
+        output_path=None,
+        use_cache=True,
+    ):
+        """Run ``query`` as ``n_pages`` range pages over ``column`` concurrently.
+
+        ``bounds`` defaults to the ``[min, max]`` of ``column`` fetched with one
+        extra query. At most ``max_workers`` pages are in flight. A page that
+        returns ``row_limit`` rows or more was likely truncated by SkyServer, so
+        it is split in half and fetched again. Pages are returned as one
+        DataFrame in ``column`` order. With ``output_path`` every page streams
+        into its own temporary parquet file instead, and the pages are then
+        merged into ``output_path`` one row group at a time, so memory stays
+        bounded whatever the size of the result; the path is returned.
+        Results are cached like those of ``query_database``.
+        """
+        query = self.filtercomment(query)
+        key = self._cache_key(query, "csv", column, bounds)
+        cached = self._cache_get(key, use_cache)
+        if cached is not None:
+            self.logger.info(f"Query served from cache {cached}")
+            return read_cached(cached, output_path)
+
+        result = self._query_pages(
+            query, column, n_pages, bounds, max_workers, row_limit, output_path
+        )
+        self._cache_put(key, result)
+        return result
+
+    def _query_pages(
+        self, query, column, n_pages, bounds, max_workers, row_limit, output_path
+    ):
+        if bounds is None:
+            bounds = self.fetch_bounds(query, column)
+        pages = split_range(*bounds, n_pages)
+        self.logger.info(f"Querying {len(pages)} pages of {column} in {bounds}")
+
+        page_dir = None
+        if output_path is not None:
+            page_dir = tempfile.mkdtemp(
+                prefix=".pages_", dir=os.path.dirname(os.path.abspath(output_path))
+            )
+
+        def page_path(lo):
+            return os.path.join(page_dir, f"{lo}.parquet")
+
+        results = {}
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            def submit(lo, hi):
+                sql = page_query(query, column, lo, hi)
+                if page_dir is None:
+                    future = executor.submit(self._fetch, sql)
+                else:
+                    future = executor.submit(self._fetch_to_file, sql, page_path(lo))
+                futures[future] = (lo, hi)
+
+            for lo, hi in pages:
+                submit(lo, hi)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lo, hi = futures.pop(future)
+                    result = future.result()
+                    n_rows = len(result) if page_dir is None else result
+                    mid = midpoint(lo, hi)
+                    if row_limit is not None and n_rows >= row_limit and lo < mid:
+                        self.logger.warning(
+                            f"Page [{lo}, {hi}) hit the {row_limit} row limit, splitting"
+                        )
+                        if page_dir is not None:
+                            os.remove(page_path(lo))
+                        submit(lo, mid)
+                        submit(mid, hi)
+                    elif n_rows:
+                        results[lo] = result
+
+        if page_dir is None:
+            return concat_chunks(results[lo] for lo in sorted(results))
+        try:
+            write_parquet(
+                iter_parquet(page_path(lo) for lo in sorted(results)), output_path
+            )
+        finally:
+            shutil.rmtree(page_dir, ignore_errors=True)
+        return output_path
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="SQLCL command line query tool")
     parser.add_argument(
-        "--url", type=str, help=f"URL with the ASP interface (default: {self.url})"
+        "--url",
+        type=str,
+        default=DEFAULT_URL,
+        help=f"URL with the ASP interface (default: {DEFAULT_URL})",
     )
     parser.add_argument(
         "--format",
         type=str,
         choices=SUPPORTED_OUTPUT_FORMATS,
-        help=f"set output format such as {SUPPORTED_OUTPUT_FORMATS} (default: {self.output_format})",
+        default="csv",
+        help=f"set output format such as {SUPPORTED_OUTPUT_FORMATS} (default: csv)",
     )
     parser.add_argument(
         "--query", type=str, action="append", help="specify query on the command line"
     )
+    parser.add_argument(
+        "--page_column",
+        type=str,
+        default=None,
+        help="Split each query into range pages over this column, e.g. p.objID",
+    )
+    parser.add_argument("--n_pages", type=int, default=16)
+    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument(
+        "--row_limit",
+        type=int,
+        default=None,
+        help="Split pages returning this many rows",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write results to a .csv or .parquet"
+    )
+    parser.add_argument(
+        "--cache_dir", type=str, default=None, help="Cache results as parquet here"
+    )
+    parser.add_argument(
+        "--cache_ttl", type=float, default=7 * 24 * 3600, help="Cache TTL in seconds"
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="Bypass the cache and refresh it"
+    )
 
     args = parser.parse_args()
-    sqlcl = SQLCL(url=args.url, output_format=args.format)
+    sqlcl = SQLCL(
+        url=args.url,
+        output_format=args.format,
+        cache_dir=args.cache_dir,
+        cache_ttl=args.cache_ttl,
+    )
+    for k, query in enumerate(args.query or []):
+        output = args.output
+        if output is not None and len(args.query) > 1:
+            stem, ext = os.path.splitext(output)
+            output = f"{stem}_{k}{ext}"
+
+        parquet_output = output if output and output.endswith(".parquet") else None
+        if args.page_column is None:
+            result = sqlcl.query_database(
+                query, output_path=parquet_output, use_cache=not args.no_cache
+            )
+        else:
+            result = sqlcl.query_paged(
+                query,
+                column=args.page_column,
+                n_pages=args.n_pages,
+                max_workers=args.max_workers,
+                row_limit=args.row_limit,
+                output_path=parquet_output,
+                use_cache=not args.no_cache,
+            )
+        if isinstance(result, pd.DataFrame):
+            if output is None:
+                print(result.to_csv(index=False), end="")
+            else:
+                result.to_csv(output, index=False)
+        elif isinstance(result, dict):
+            sqlcl.logger.error(result["error"])
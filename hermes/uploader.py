@@ -0,0 +1,263 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from rclone_python import rclone
+
+from hermes.instrumentation import count, timer
+
+logger = logging.getLogger(__name__)
+
+# Staging subdirectory of files bound for plain local paths
+LOCAL_STAGING = "_local"
+
+
+def split_dest(dest):
+    """Split ``"remote:dir"`` into its parts; a local path has remote ``""``."""
+    remote, sep, remote_dir = dest.partition(":")
+    if sep and remote and "/" not in remote and not os.path.isabs(dest):
+        return remote, remote_dir
+    return "", os.path.abspath(dest)
+
+
+class BatchUploader:
+    """Upload files to rclone remotes in large batches from a background thread.
+
+    ``put`` hard-links files into a staging tree laid out like the remotes
+    (``staging_dir/<remote>/<path>/<name>``) and returns immediately. The
+    thread flushes once ``max_batch_files`` or ``max_batch_bytes`` are
+    queued or ``flush_interval`` seconds have passed, with one ``rclone
+    copy --files-from --no-traverse`` per remote, so the destination is
+    never listed and startup costs are paid per batch instead of per file.
+
+    Destinations are ``"remote:dir"`` or plain local paths. Each ``put`` may
+    carry an ``on_done`` callback, called from the upload thread once all of
+    its files are on the remote. Batches that fail are retried on the next
+    flush, up to ``retries`` times; files still failing are then unstaged
+    and counted in ``stats``, and their ``put`` calls ``on_failed`` instead.
+    """
+
+    def __init__(
+        self,
+        staging_dir="upload_staging",
+        max_batch_files=2000,
+        max_batch_bytes=10 * 1024**3,
+        flush_interval=60.0,
+        transfers=32,
+        checkers=16,
+        retries=3,
+        args=None,
+    ):
+        self.staging_dir = staging_dir
+        self.max_batch_files = max_batch_files
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.transfers = transfers
+        self.checkers = checkers
+        self.retries = retries
+        self.args = args or []
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self.failed_files = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+        self._closed = False
+        self._cond = threading.Condition()
+        os.makedirs(staging_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, items, on_done=None, on_failed=None):
+        """Queue ``(path, "remote:dir")`` pairs for upload."""
+        group = {
+            "remaining": 0,
+            "failed": 0,
+            "on_done": on_done,
+            "on_failed": on_failed,
+        }
+        entries = []
+        for path, dest in items:
+            remote, remote_dir = split_dest(dest)
+            relative = os.path.join(remote_dir, os.path.basename(path)).lstrip("/")
+            staged = os.path.join(self._staging(remote), relative)
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            if os.path.exists(staged):
+                os.remove(staged)
+            try:
+                os.link(path, staged)
+            except OSError:
+                shutil.copy2(path, staged)
+            size = os.path.getsize(staged)
+            entries.append(
+                {
+                    "remote": remote,
+                    "relative": relative,
+                    "staged": staged,
+                    "size": size,
+                    "group": group,
+                    "attempts": 0,
+                }
+            )
+        group["remaining"] = len(entries)
+        if not entries:
+            self._notify(on_done)
+            return
+        with self._cond:
+            self._pending.extend(entries)
+            self._pending_bytes += sum(entry["size"] for entry in entries)
+            self._cond.notify()
+
+    @property
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _staging(self, remote):
+        return os.path.join(self.staging_dir, remote or LOCAL_STAGING)
+
+    def _ready(self):
+        return self._pending and (
+            self._closed
+            or len(self._pending) >= self.max_batch_files
+            or self._pending_bytes >= self.max_batch_bytes
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready():
+                    if self._closed:
+                        return
+                    self._cond.wait(timeout=1.0)
+                batch = self._pending[: self.max_batch_files]
+                del self._pending[: len(batch)]
+                self._pending_bytes -= sum(entry["size"] for entry in batch)
+                self._last_flush = time.monotonic()
+            try:
+                self._flush(batch)
+            except Exception:
+                logger.exception(f"Flushing {len(batch)} files failed")
+                self._retry(batch)
+
+    def _flush(self, batch):
+        by_remote = {}
+        for entry in batch:
+            by_remote.setdefault(entry["remote"], []).append(entry)
+        for remote, entries in by_remote.items():
+            if self._copy(remote, entries):
+                self._done(entries)
+            else:
+                self._retry(entries)
+
+    def _copy(self, remote, entries):
+        target = f"{remote}:" if remote else os.path.abspath(os.sep)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.staging_dir, suffix=".txt", delete=False
+        ) as f:
+            f.write("\n".join(entry["relative"] for entry in entries) + "\n")
+        n_bytes = sum(entry["size"] for entry in entries)
+        start = time.monotonic()
+        try:
+            with timer("rclone"):
+                rclone.copy(
+                    self._staging(remote),
+                    target,
+                    ignore_existing=True,
+                    show_progress=False,
+                    args=[
+                        f"--files-from={f.name}",
+                        "--no-traverse",
+                        f"--transfers={self.transfers}",
+                        f"--checkers={self.checkers}",
+                        *self.args,
+                    ],
+                )
+        except Exception as e:
+            logger.error(f"Upload of {len(entries)} files to {target} failed: {e}")
+            return False
+        finally:
+            os.remove(f.name)
+        elapsed = time.monotonic() - start
+        self.uploaded_files += len(entries)
+        self.uploaded_bytes += n_bytes
+        self.upload_seconds += elapsed
+        count("upload_files", len(entries))
+        count("upload_bytes", n_bytes)
+        logger.info(
+            f"Uploaded {len(entries)} files ({n_bytes / 1e6:.1f} MB) to {target} "
+            f"in {elapsed:.1f}s, {self.queue_depth} queued"
+        )
+        return True
+
+    def _notify(self, callback):
+        # A raising callback must not take the upload thread down with it
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception:
+            logger.exception("Upload callback failed")
+
+    def _done(self, entries, failed=False):
+        for entry in entries:
+            if os.path.exists(entry["staged"]):
+                os.remove(entry["staged"])
+            group = entry["group"]
+            group["remaining"] -= 1
+            group["failed"] += failed
+            if group["remaining"] == 0:
+                self._notify(group["on_failed" if group["failed"] else "on_done"])
+
+    def _retry(self, entries):
+        retry, failed = [], []
+        for entry in entries:
+            entry["attempts"] += 1
+            if entry["attempts"] > self.retries:
+                failed.append(entry)
+                logger.error(f"Giving up on uploading {entry['staged']}")
+            else:
+                retry.append(entry)
+        if failed:
+            self.failed_files += len(failed)
+            count("upload_failed", len(failed))
+            self._done(failed, failed=True)
+        with self._cond:
+            self._pending.extend(retry)
+            self._pending_bytes += sum(entry["size"] for entry in retry)
+
+    def stats(self):
+        """Queue depth, uploaded and failed files, bytes, and MB/s while uploading."""
+        return {
+            "queued": self.queue_depth,
+            "failed_files": self.failed_files,
+            "uploaded_files": self.uploaded_files,
+            "uploaded_bytes": self.uploaded_bytes,
+            "mb_per_s": self.uploaded_bytes / max(self.upload_seconds, 1e-6) / 1e6,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"Uploaded {stats['uploaded_files']} files "
+            f"({stats['uploaded_bytes'] / 1e6:.1f} MB) at {stats['mb_per_s']:.2f} MB/s, "
+            f"{stats['queued']} queued, {stats['failed_files']} failed"
+        )
+
+    def close(self):
+        """Flush everything still queued and stop the upload thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
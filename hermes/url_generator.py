@@ -1,28 +1,111 @@
 import argparse
 
+import numpy as np
 import pandas as pd
 from sdss_access import Path
 
 sdss_path = Path(release="dr17")
 
+BANDS = ["u", "g", "r", "i", "z"]
+FRAME_COLUMNS = ["rerun", "run", "camcol", "field"]
+FITS_BASE_URL = (
+    "https://data.sdss.org/sas/dr18/prior-surveys/sdss4-dr17-eboss/photoObj/frames"
+)
+
 
 def get_fits_url(run, rerun, camcol, field, filter_val="r"):
     file_name = sdss_path.url(
         "frame", run=run, rerun=rerun, camcol=camcol, field=field, filter=filter_val
     ).split("/")[-1]
-    base_url = (
-        "https://data.sdss.org/sas/dr18/prior-surveys/sdss4-dr17-eboss/photoObj/frames"
+    return f"{FITS_BASE_URL}/{rerun}/{run}/{camcol}/{file_name}.bz2"
+
+
+def frame_codes(df):
+    """Return the unique (rerun, run, camcol, field) rows and each row's index.
+
+    The four columns are packed into one int64 per row (run < 10**6,
+    camcol < 10, field < 10**4) so deduplication is a 1D ``np.unique``.
+    """
+    keys = df["rerun"].to_numpy(dtype=np.int64) * 10**6
+    keys = (keys + df["run"].to_numpy(dtype=np.int64)) * 10
+    keys = (keys + df["camcol"].to_numpy(dtype=np.int64)) * 10**4
+    keys = keys + df["field"].to_numpy(dtype=np.int64)
+    codes, inverse = np.unique(keys, return_inverse=True)
+    frames = pd.DataFrame(
+        {
+            "rerun": codes // 10**11,
+            "run": codes // 10**5 % 10**6,
+            "camcol": codes // 10**4 % 10,
+            "field": codes % 10**4,
+        }
     )
-    return f"{base_url}/{rerun}/{run}/{camcol}/{file_name}.bz2"
+    return frames, inverse.reshape(-1)
+
+
+def frame_parts(frames):
+    """Band-independent name suffixes and rerun/run/camcol directories."""
+    run = frames["run"].astype(str)
+    camcol = frames["camcol"].astype(str)
+    field = frames["field"].astype(str).str.zfill(4)
+    suffix = "-" + run.str.zfill(6) + "-" + camcol + "-" + field + ".fits"
+    directory = frames["rerun"].astype(str) + "/" + run + "/" + camcol + "/"
+    return suffix, directory
+
+
+def format_frames(frames, band="x", base_url=None, parts=None):
+    """Format frame file names, or ``.bz2`` URLs with ``base_url``, with string ops."""
+    suffix, directory = parts if parts is not None else frame_parts(frames)
+    names = "frame-" + band + suffix
+    if base_url is None:
+        return names
+    return base_url + "/" + directory + names + ".bz2"
+
+
+def frame_file_names(df, band="x"):
+    """Frame file name of every row, formatted once per unique frame."""
+    frames, inverse = frame_codes(df)
+    names = format_frames(frames, band).to_numpy()
+    return pd.Series(names[inverse], index=df.index)
+
+
+def frame_urls(df, band="r", base_url=FITS_BASE_URL):
+    """Download URL of every row, formatted once per unique frame."""
+    frames, inverse = frame_codes(df)
+    urls = format_frames(frames, band, base_url).to_numpy()
+    return pd.Series(urls[inverse], index=df.index)
+
+
+def unique_frames(df, bands=BANDS, base_url=FITS_BASE_URL):
+    """One row per unique frame and band, with its file name and URL."""
+    frames, _ = frame_codes(df)
+    parts = frame_parts(frames)
+    per_band = []
+    for band in bands:
+        band_frames = frames.assign(band=band)
+        band_frames["file_name"] = format_frames(frames, band, parts=parts)
+        band_frames["url"] = format_frames(frames, band, base_url, parts)
+        per_band.append(band_frames)
+    return pd.concat(per_band, ignore_index=True)
+
+
+def check_against_sdss_access(df, n=100, seed=0):
+    """Compare the vectorized URLs with ``sdss_access`` on a sample of rows."""
+    sample = df.sample(min(n, len(df)), random_state=seed)
+    for band in BANDS:
+        expected = [
+            get_fits_url(row.run, row.rerun, row.camcol, row.field, band)
+            for row in sample[FRAME_COLUMNS].itertuples()
+        ]
+        mismatched = frame_urls(sample, band).to_numpy() != np.array(expected)
+        if mismatched.any():
+            raise ValueError(
+                f"{mismatched.sum()} URLs for band {band} differ from sdss_access, "
+                f"e.g. {expected[np.argmax(mismatched)]}"
+            )
 
 
 def apply_fits_url_to_df(df, filter_val="r"):
-    df[f"fits_url_{filter_val}"] = df.apply(
-        lambda row: get_fits_url(
-            row["run"], row["rerun"], row["camcol"], row["field"], filter_val
-        ),
-        axis=1,
-    )
+    df[f"fits_url_{filter_val}"] = frame_urls(df, filter_val)
     return df
 
 
@@ -42,9 +125,8 @@ def apply_jpeg_url_to_df(df, scale=0.396, height=40, width=40):
 
 
 def add_filename(df):
-    df["filename"] = df["fits_url_u"].apply(
-        lambda x: x.split("/")[-1][:-4]
-    )  # remove .bz2
+    # remove the directory and .bz2
+    df["filename"] = df["fits_url_u"].str.rsplit("/", n=1).str[-1].str[:-4]
     return df
 
 
@@ -56,6 +138,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     df = pd.read_csv(args.data_path, index_col=0)
+    check_against_sdss_access(df)
     for i in ["u"]:  # , "g", "r", "i", "z"]:
         df = apply_fits_url_to_df(df, filter_val=i)
     # df = apply_jpeg_url_to_df(df)
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from hermes.instrumentation import count, timer
+
+
+def frame_key(path):
+    """Cache key of a frame: its band-specific file name without ``.bz2``."""
+    name = os.path.basename(path)
+    return name[: -len(".bz2")] if name.endswith(".bz2") else name
+
+
+class WCSCache:
+    """Process-local LRU cache of WCS objects keyed by frame and band.
+
+    With ``path`` set, the compact WCS header of every frame (a few dozen
+    cards, SIP terms included) is persisted to a sqlite table, so later runs
+    and other workers rebuild the WCS from those cards instead of the full
+    frame header. Callers that pass a header factory skip reading the header
+    altogether; callers that read the pixels anyway only save building the WCS.
+    """
+
+    def __init__(self, maxsize=256, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._wcs = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # A sqlite connection must not be shared across a fork, so every
+        # worker process opens its own
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS wcs "
+                "(key TEXT PRIMARY KEY, header TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _load(self, key):
+        if self.path is None:
+            return None
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT header FROM wcs WHERE key = ?", (key,))
+                .fetchone()
+            )
+        if row is None:
+            return None
+        return WCS(fits.Header.fromstring(row[0]))
+
+    def _store(self, key, wcs):
+        if self.path is None:
+            return
+        header = wcs.to_header(relax=True).tostring()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR IGNORE INTO wcs VALUES (?, ?)", (key, header))
+            conn.commit()
+
+    def get(self, key, header):
+        """Return the WCS of ``key``, building it from ``header`` on a miss.
+
+        ``header`` is a FITS header or a callable returning one, so callers
+        can defer reading the file until the cache actually needs it.
+        """
+        with self._lock:
+            wcs = self._wcs.get(key)
+            if wcs is not None:
+                self._wcs.move_to_end(key)
+                self.hits += 1
+        if wcs is not None:
+            count("wcs_hit")
+            return wcs
+
+        count("wcs_miss")
+        with timer("wcs"):
+            wcs = self._load(key)
+            if wcs is None:
+                wcs = WCS(header() if callable(header) else header)
+                self._store(key, wcs)
+
+        with self._lock:
+            self.misses += 1
+            self._wcs[key] = wcs
+            while len(self._wcs) > self.maxsize:
+                self._wcs.popitem(last=False)
+        return wcs
+
+    def clear(self):
+        with self._lock:
+            self._wcs.clear()
+
+
+WCS_CACHE = WCSCache()
+
+
+def configure_wcs_cache(maxsize=256, path=None):
+    """Replace the process-wide cache.
+
+    Worker pools should run it as their ``initializer`` so every worker gets
+    the same settings under fork and spawn alike.
+    """
+    global WCS_CACHE
+    WCS_CACHE = WCSCache(maxsize, path)
+    return WCS_CACHE
+
+
+def get_wcs(path, header):
+    """Look up the WCS of the frame at ``path`` in the process-wide cache."""
+    return WCS_CACHE.get(frame_key(path), header)
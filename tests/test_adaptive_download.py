@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from hermes.adaptive_download import AdaptiveDownloader, throttling_server
+
+
+@pytest.fixture
+def serve(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "frame.fits").write_bytes(b"x" * 2880)
+    servers = []
+
+    def start(**kwargs):
+        server = throttling_server(str(served), latency=0, **kwargs)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_downloads_files(serve, tmp_path):
+    base_url = serve()
+    downloader = AdaptiveDownloader()
+    results = downloader.download([f"{base_url}/frame.fits"], str(tmp_path / "out"))
+    assert len(results) == 1 and not results.errors
+    assert downloader.conn == 10
+
+
+def test_not_found_is_not_retried(serve, tmp_path):
+    base_url = serve()
+    downloader = AdaptiveDownloader(backoff_factor=10)
+    start = time.monotonic()
+    results = downloader.download([f"{base_url}/missing.fits"], str(tmp_path / "out"))
+    assert time.monotonic() - start < 5
+    assert len(results.errors) == 1
+    assert downloader.conn == 8
+    assert downloader.host_stats()[base_url[7:]]["errors"] == 1
+
+
+def test_too_many_requests_honours_retry_after(serve, tmp_path):
+    base_url = serve(max_inflight=0, retry_after=1)
+    downloader = AdaptiveDownloader(max_retries=1, backoff_factor=0.01)
+    start = time.monotonic()
+    results = downloader.download([f"{base_url}/frame.fits"], str(tmp_path / "out"))
+    assert time.monotonic() - start >= 1
+    assert len(results.errors) == 1
+    assert downloader.conn == 2
+    assert downloader.host_stats()[base_url[7:]]["throttled"] == 2
+
+
+def test_service_unavailable_halves_connections(serve, tmp_path):
+    base_url = serve(max_inflight=0, retry_after=0, status=503)
+    downloader = AdaptiveDownloader(max_retries=0, start_conn=16)
+    results = downloader.download([f"{base_url}/frame.fits"], str(tmp_path / "out"))
+    assert len(results.errors) == 1
+    assert downloader.conn == 8
+
+
+def test_concurrent_downloads_take_turns(serve, tmp_path, monkeypatch):
+    base_url = serve()
+    downloader = AdaptiveDownloader(start_conn=2, files_per_conn=1)
+    active, overlaps = [0], []
+    run_round = downloader._round
+
+    def tracked(urls, path):
+        active[0] += 1
+        overlaps.append(active[0])
+        try:
+            return run_round(urls, path)
+        finally:
+            active[0] -= 1
+
+    monkeypatch.setattr(downloader, "_round", tracked)
+    results = {}
+
+    def fetch(k):
+        urls = [f"{base_url}/frame.fits?{k}-{n}" for n in range(6)]
+        results[k] = downloader.download(urls, str(tmp_path / str(k)))
+
+    threads = [threading.Thread(target=fetch, args=(k,)) for k in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(overlaps) == 1
+    assert all(not result.errors for result in results.values())
+    assert downloader.conn <= downloader.max_conn
@@ -0,0 +1,39 @@
+import time
+
+import numpy as np
+import pytest
+
+from hermes.benchmark import measure_peak_rss
+
+pytest.importorskip("psutil")
+
+
+def idle():
+    time.sleep(0.2)
+    return 0.0
+
+
+def allocate(n_mb):
+    data = np.ones(n_mb * 2**20 // 8)
+    time.sleep(0.2)
+    return float(data.sum() > 0)
+
+
+def failing():
+    raise ValueError("mode failed")
+
+
+def test_light_mode_reports_less_than_heavy_mode():
+    # A large parent must not leak its high-water mark into either figure
+    ballast = np.ones(400 * 2**20 // 8)
+    _, light_mb = measure_peak_rss(idle)
+    result, heavy_mb = measure_peak_rss(allocate, 300)
+    assert result == 1.0
+    assert light_mb < 300 < heavy_mb
+    assert heavy_mb - light_mb > 250
+    del ballast
+
+
+def test_errors_are_raised_in_the_parent():
+    with pytest.raises(ValueError, match="mode failed"):
+        measure_peak_rss(failing)
@@ -0,0 +1,23 @@
+import numpy as np
+from astropy.io import fits
+
+from hermes.cutouts import extract_cutouts
+from hermes.frame_reader import frame_scale
+
+
+def test_blank_pixels_become_nan():
+    data = np.arange(100, dtype=np.int16).reshape(10, 10)
+    data[5, 5] = -32768
+    header = fits.Header({"BITPIX": 16, "BSCALE": 0.5, "BZERO": 10.0})
+    header["BLANK"] = -32768
+    bscale, bzero, blank = frame_scale(header)
+    stamps = extract_cutouts(
+        data, [5], [5], (4, 4), bscale=bscale, bzero=bzero, blank=blank
+    )
+    assert np.isnan(stamps[0, 2, 2])
+    assert np.isnan(stamps).sum() == 1
+    assert stamps[0, 0, 0] == data[3, 3] * 0.5 + 10
+
+
+def test_float_frames_have_no_blank():
+    assert frame_scale(fits.Header({"BITPIX": -32, "BLANK": 0})) == (1.0, 0.0, None)
@@ -0,0 +1,86 @@
+import importlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from hermes.benchmark import make_catalog
+from hermes.shards import META_FILE, ShardReader
+
+
+@pytest.fixture
+def distributed(tmp_path, monkeypatch):
+    # The dataset creator opens its log files in the working directory
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("hermes.distributed")
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return make_catalog(str(tmp_path / "frames"), n_objects=48, objects_per_frame=8)
+
+
+def test_every_frame_belongs_to_one_node(distributed, catalog):
+    nodes = distributed.node_of(catalog, 3)
+    assert catalog.assign(node=nodes).groupby("file_name")["node"].nunique().max() == 1
+    # The owner of a row depends only on its frame, not on the rest of the catalog
+    subset = catalog.iloc[::-5]
+    assert np.array_equal(distributed.node_of(subset, 3), nodes[::-5])
+    with pytest.raises(ValueError, match="partition"):
+        distributed.node_of(catalog, 3, by="tract")
+
+
+def build_nodes(distributed, catalog, tmp_path, n_nodes=2, shard_size=5):
+    for node in range(n_nodes):
+        distributed.run_node(
+            catalog,
+            node,
+            n_nodes,
+            str(tmp_path / "nodes"),
+            download=False,
+            fits_dir=str(tmp_path / "frames"),
+            max_workers=1,
+            shard_size=shard_size,
+        )
+    return str(tmp_path / "nodes")
+
+
+def test_merge_keeps_every_cutout_of_every_node(distributed, catalog, tmp_path):
+    work_dir = build_nodes(distributed, catalog, tmp_path)
+    report = distributed.merge(work_dir, str(tmp_path / "merged"))
+    merged = ShardReader(str(tmp_path / "merged"))
+    readers = [
+        ShardReader(root + "/dataset") for root in distributed.node_dirs(work_dir)
+    ]
+    assert report["nodes"] == 2 and all(map(len, readers))
+    assert report["objects"] == len(merged) == sum(map(len, readers))
+    assert report["shards"] == merged.n_shards == sum(r.n_shards for r in readers)
+    assert report["objects"] + report["missing"] == len(catalog)
+    for reader in readers:
+        for obj_id in reader.index.index:
+            stamp, label = reader[obj_id]
+            assert np.array_equal(stamp, merged[obj_id][0], equal_nan=True)
+            assert np.array_equal(label, merged[obj_id][1])
+    with pytest.raises(ValueError, match="already holds"):
+        distributed.merge(work_dir, str(tmp_path / "merged"))
+
+
+def test_merge_refuses_overlapping_or_mismatched_nodes(distributed, catalog, tmp_path):
+    work_dir = build_nodes(distributed, catalog, tmp_path)
+    nodes = distributed.node_dirs(work_dir)
+    copy = os.path.join(work_dir, "node_009")
+    shutil.copytree(nodes[0], copy)
+    with pytest.raises(ValueError, match="overlap"):
+        distributed.merge(work_dir, str(tmp_path / "merged"))
+    shutil.rmtree(copy)
+
+    meta_path = os.path.join(nodes[1], "dataset", META_FILE)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(meta_path, "w") as f:
+        json.dump({**meta, "shard_size": meta["shard_size"] + 1}, f)
+    with pytest.raises(ValueError, match="shard layout"):
+        distributed.merge(work_dir, str(tmp_path / "merged"))
+    assert not os.path.exists(tmp_path / "merged")
@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+from hermes.benchmark import frame_header
+from hermes.download_planner import object_manifest, plan_downloads
+from hermes.ledger import CORRUPT, Ledger
+from hermes.url_generator import BANDS
+
+FIELDS = {11: 3, 12: 1, 13: 2}
+
+
+def catalog():
+    rows = [
+        {"objID": field * 100 + k, "rerun": 301, "run": 94, "camcol": 6, "field": field}
+        for field, n in FIELDS.items()
+        for k in range(n)
+    ]
+    return pd.DataFrame(rows)
+
+
+def write_frame(outdir, band, field):
+    data = np.zeros((8, 8), dtype=np.float32)
+    buffer = io.BytesIO()
+    fits.PrimaryHDU(data, frame_header(10.0, 0.0, 94, 6, field, band)).writeto(buffer)
+    (outdir / f"frame-{band}-000094-6-{field:04d}.fits").write_bytes(buffer.getvalue())
+
+
+def test_plan_orders_fields_by_missing_bands_then_objects(tmp_path):
+    # Field 12 only lacks z, so it comes first despite having fewest objects
+    for band in BANDS[:-1]:
+        write_frame(tmp_path, band, 12)
+    (tmp_path / "frame-u-000094-6-0013.fits").write_bytes(b"truncated")
+    plan = plan_downloads(catalog(), str(tmp_path))
+    assert plan["field"].tolist() == [12] + [11] * 5 + [13] * 5
+    assert plan["band"].tolist() == ["z"] + BANDS * 2
+    assert plan["n_missing"].tolist() == [1] + [5] * 10
+    assert plan["n_objects"].tolist() == [1] + [3] * 5 + [2] * 5
+    assert (
+        plan["url"].str.rsplit("/", n=1).str[-1] == plan["file_name"] + ".bz2"
+    ).all()
+    assert not plan["url"].duplicated().any()
+
+
+def test_plan_skips_frames_marked_corrupt(tmp_path):
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        ledger.mark(["frame-r-000094-6-0011.fits.bz2"], CORRUPT)
+        plan = plan_downloads(catalog(), str(tmp_path / "fits"), ledger=ledger)
+    assert len(plan) == len(FIELDS) * len(BANDS) - 1
+    assert "frame-r-000094-6-0011.fits" not in set(plan["file_name"])
+    assert plan["field"].tolist()[:4] == [11] * 4
+
+
+def test_manifest_maps_every_object_to_its_frame():
+    manifest = object_manifest(catalog())
+    assert manifest["objID"].tolist() == catalog()["objID"].tolist()
+    names = dict(zip(manifest["objID"], manifest["file_name"]))
+    assert names[1100] == "frame-x-000094-6-0011.fits"
+    assert names[1300] == names[1301] == "frame-x-000094-6-0013.fits"
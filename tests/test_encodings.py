@@ -0,0 +1,75 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from hermes.encodings import (
+    CODECS,
+    ENCODINGS,
+    decode_stamps,
+    encode_stamps,
+    load_stamps,
+    roundtrip_error,
+    save_stamps,
+)
+from hermes.shards import ShardReader, ShardWriter
+
+
+@pytest.fixture
+def stamps():
+    stamps = np.random.default_rng(0).normal(size=(4, 8, 8, 2)).astype(np.float32)
+    stamps[1] = np.nan
+    stamps[2, 0, 0, 0] = np.nan
+    return stamps
+
+
+def test_int16_roundtrip_is_silent_on_all_nan_stamps(stamps):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        data, scale = encode_stamps(stamps, "int16")
+        decoded = decode_stamps(data, scale)
+        error = roundtrip_error(stamps, decoded)
+    assert np.array_equal(np.isnan(decoded), np.isnan(stamps))
+    assert error["max_rel_error"] < 1e-4
+
+
+def test_shard_writer_keeps_stored_encoding(tmp_path, stamps):
+    path = str(tmp_path / "shards")
+    labels = np.zeros((len(stamps), 4), dtype=np.float32)
+    with ShardWriter(path, shard_size=3, shape=(8, 8, 2), encoding="int16") as writer:
+        writer.append(np.arange(2), stamps[:2], labels[:2])
+    with ShardWriter(path) as writer:
+        assert writer.encoding == "int16"
+        writer.append(np.arange(2, 4), stamps[2:], labels[2:])
+    with pytest.raises(ValueError, match="int16"):
+        ShardWriter(path, encoding="float32")
+
+    reader = ShardReader(path)
+    assert reader.n_shards == 2
+    decoded = np.concatenate([reader.stamps(shard) for shard in range(2)])
+    assert np.allclose(decoded, stamps, atol=1e-3, equal_nan=True)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_save_and_load_round_trip(tmp_path, stamps, encoding, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    if codec == "blosc":
+        pytest.importorskip("blosc2")
+    path = str(tmp_path / "grids.npz")
+    labels = np.arange(4)
+    save_stamps(path, stamps, encoding=encoding, codec=codec, labels=labels)
+    decoded, archive = load_stamps(path)
+    assert decoded.dtype == np.float32
+    assert np.array_equal(np.isnan(decoded), np.isnan(stamps))
+    atol = 0 if encoding == "float32" else 1e-2
+    assert np.allclose(decoded, stamps, atol=atol, equal_nan=True)
+    assert np.array_equal(archive["labels"], labels)
+
+
+def test_unknown_codec_is_refused(tmp_path, stamps):
+    with pytest.raises(ValueError, match="codec"):
+        save_stamps(str(tmp_path / "grids.npz"), stamps, codec="lzma")
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,38 @@
+import os
+
+from hermes.frame_index import load_frame_index
+
+FIELD = "frame-x-000094-6-0001.fits"
+
+
+def touch(directory, bands):
+    for band in bands:
+        (directory / FIELD.replace("-x-", f"-{band}-")).write_bytes(b"")
+
+
+def test_manifest_is_rebuilt_when_frames_change(tmp_path):
+    frames = tmp_path / "frames"
+    frames.mkdir()
+    manifest = str(tmp_path / "frames.sqlite")
+    touch(frames, "ugr")
+    assert not load_frame_index(str(frames), manifest).has_all_bands([FIELD])[0]
+
+    touch(frames, "iz")
+    # Make the new listing unambiguously newer than the manifest
+    stamp = os.path.getmtime(manifest) + 10
+    os.utime(frames, (stamp, stamp))
+    assert load_frame_index(str(frames), manifest).has_all_bands([FIELD])[0]
+    # The rebuilt manifest is reused while the directory is unchanged
+    os.utime(manifest, (stamp + 10, stamp + 10))
+    assert len(load_frame_index(str(frames), manifest)) == 1
+
+
+def test_refresh_drops_removed_frames(tmp_path):
+    frames = tmp_path / "frames"
+    frames.mkdir()
+    manifest = str(tmp_path / "frames.sqlite")
+    touch(frames, "ugriz")
+    assert load_frame_index(str(frames), manifest).has_all_bands([FIELD])[0]
+    os.remove(frames / FIELD.replace("-x-", "-z-"))
+    index = load_frame_index(str(frames), manifest, refresh=True)
+    assert not index.has_all_bands([FIELD])[0]
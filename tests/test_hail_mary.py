@@ -0,0 +1,153 @@
+import bz2
+import functools
+import importlib
+import io
+import os
+import shutil
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from hermes.decompress import DecodedFrameCache
+from hermes.ledger import CUT, UPLOADED, Ledger
+
+N_FIELDS, PER_FIELD, SHAPE = 3, 6, (200, 200)
+
+
+def make_frames(served):
+    """Write bz2 frames of three fields and a catalog of objects inside them."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for field in range(N_FIELDS):
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        wcs.wcs.crpix = [100.5, 100.5]
+        wcs.wcs.crval = [10 + field * 0.1, 0.0]
+        wcs.wcs.cd = np.array([[0, -1.1e-4], [1.1e-4, 0]])
+        name = f"frame-x-000094-6-{field:04d}.fits"
+        for band in "ugriz":
+            buffer = io.BytesIO()
+            data = rng.normal(size=SHAPE).astype(np.float32)
+            fits.PrimaryHDU(data, wcs.to_header()).writeto(buffer)
+            path = served / f"{name.replace('frame-x-', f'frame-{band}-')}.bz2"
+            path.write_bytes(bz2.compress(buffer.getvalue()))
+        ra, dec = wcs.pixel_to_world_values(*rng.uniform(30, 170, (2, PER_FIELD)))
+        for k in range(PER_FIELD):
+            rows.append(
+                {
+                    "objID": 10**15 + field * 1000 + k,
+                    "run": 94,
+                    "rerun": 301,
+                    "camcol": 6,
+                    "field": field,
+                    "ra": ra[k],
+                    "dec": dec[k],
+                    "file_name": name,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+class RecordingHandler(SimpleHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        type(self).requested.append(os.path.basename(self.path))
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def hail_mary(tmp_path, monkeypatch):
+    served = tmp_path / "served"
+    served.mkdir()
+    df = make_frames(served)
+    RecordingHandler.requested = []
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(RecordingHandler, directory=str(served))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    df["fits_url"] = base_url + "/" + df["file_name"] + ".bz2"
+
+    # The module creates its working directories on import
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    module = importlib.import_module("hermes.parfive_rclone_drive_extravaganza")
+    monkeypatch.setattr(module, "BATCH_SIZE", PER_FIELD)
+
+    def copy(src, dst, ignore_existing=False, show_progress=True, args=None):
+        files_from = next(a for a in args if a.startswith("--files-from="))
+        with open(files_from.split("=", 1)[1]) as f:
+            for relative in f.read().split():
+                target = work / "remote" / dst.rstrip(":") / relative
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy(os.path.join(src, relative), target)
+
+    monkeypatch.setattr("hermes.uploader.rclone.copy", copy)
+    yield module, df, work
+    server.shutdown()
+    server.server_close()
+
+
+def run(module, df):
+    module.run_hail_mary(
+        df, decode_workers=1, upload_interval=0.1, upload_batch_files=5
+    )
+
+
+def test_overlapped_stages_cut_everything_and_resume(hail_mary):
+    module, df, work = hail_mary
+    first = df[df["field"] < 2]
+    run(module, first)
+    with Ledger("progress.sqlite") as ledger:
+        done = ledger.reached(df["objID"], CUT | UPLOADED)
+    assert done == set(first["objID"].astype(str))
+    assert len(RecordingHandler.requested) == 2 * 5
+
+    # A rerun over the whole catalog only fetches the field that is left;
+    # grid files are named by the second and batch start, so let one pass
+    RecordingHandler.requested = []
+    time.sleep(1)
+    run(module, df)
+    assert sorted(RecordingHandler.requested) == sorted(
+        f"frame-{band}-000094-6-0002.fits.bz2" for band in "ugriz"
+    )
+    with Ledger("progress.sqlite") as ledger:
+        assert ledger.reached(df["objID"], CUT | UPLOADED) == set(
+            df["objID"].astype(str)
+        )
+    grids = sorted(
+        os.listdir(work / "remote" / "gdrive" / "hermes" / "processed_grids" / "r")
+    )
+    assert len(grids) == N_FIELDS
+    assert not os.listdir("decoded_frames")
+
+
+def test_cut_errors_are_logged_with_their_reason(hail_mary):
+    module, df, work = hail_mary
+    first = df[df["field"] == 0].reset_index(drop=True)
+    name = first["file_name"].iloc[0].replace("frame-x-", "frame-r-")
+    (work / name).write_bytes(b"not a FITS file")
+    job = {
+        "df": first,
+        "band": "r",
+        "deferred": {},
+        "decoded": {name + ".bz2": str(work / name)},
+        "urls": first["fits_url"].str.replace("frame-x-", "frame-r-"),
+        "processed_name": "grids.npz",
+    }
+    job = module.cut_stage(job, DecodedFrameCache(str(work / "cache")))
+    assert not job["valid"].any()
+    with open("errors_r.txt") as f:
+        line = f.read()
+    assert f"{PER_FIELD} of {PER_FIELD} objects not cut (OSError:" in line
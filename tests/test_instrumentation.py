@@ -0,0 +1,74 @@
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from hermes.instrumentation import METRICS, Metrics, call_with_metrics, count, timer
+
+
+def work(n):
+    with timer("work"):
+        count("items", n)
+    return n * 2
+
+
+def test_drain_resets_after_its_snapshot():
+    metrics = Metrics()
+    metrics.count("items", 3)
+    with metrics.timer("cut"):
+        pass
+    snapshot = metrics.drain()
+    assert snapshot["counters"] == {"items": 3}
+    assert snapshot["stages"]["cut"]["calls"] == 1
+    assert metrics.drain() == {"stages": {}, "counters": {}}
+
+
+def test_counts_racing_drains_are_merged_exactly_once():
+    metrics, total = Metrics(), Metrics()
+    stop = threading.Event()
+
+    def drain():
+        while not stop.is_set():
+            total.merge(metrics.drain())
+
+    drainer = threading.Thread(target=drain)
+    drainer.start()
+    counters = [
+        threading.Thread(target=lambda: [metrics.count("items") for _ in range(5000)])
+        for _ in range(4)
+    ]
+    for thread in counters:
+        thread.start()
+    for thread in counters:
+        thread.join()
+    stop.set()
+    drainer.join()
+    total.merge(metrics.drain())
+    assert total.snapshot()["counters"] == {"items": 20000}
+
+
+def test_workers_send_back_only_their_own_metrics():
+    METRICS.drain()
+    count("items", 100)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(call_with_metrics, [work] * 3, [1, 2, 3]))
+    assert [result for result, _ in results] == [2, 4, 6]
+    for _, snapshot in results:
+        METRICS.merge(snapshot)
+    snapshot = METRICS.drain()
+    assert snapshot["counters"] == {"items": 106}
+    assert snapshot["stages"]["work"]["calls"] == 3
+
+
+def test_write_picks_the_format_from_the_suffix(tmp_path):
+    metrics = Metrics()
+    metrics.count("download_files", 2)
+    metrics.write(str(tmp_path / "metrics.json"))
+    metrics.write(str(tmp_path / "metrics.prom"))
+    with open(tmp_path / "metrics.json") as f:
+        assert json.load(f)["counters"] == {"download_files": 2}
+    prom = (tmp_path / "metrics.prom").read_text()
+    assert 'hermes_events_total{event="download_files"} 2' in prom
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "metrics.json",
+        "metrics.prom",
+    ]
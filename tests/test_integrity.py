@@ -0,0 +1,102 @@
+import bz2
+import io
+import os
+
+import numpy as np
+import parfive
+import pytest
+from astropy.io import fits
+
+from hermes.benchmark import frame_header
+from hermes.download_planner import frames_on_disk
+from hermes.integrity import download_verified, verify_frame
+from hermes.ledger import CORRUPT, VERIFIED, Ledger
+
+NAME = "frame-r-000094-6-0001.fits"
+
+
+def frame_bytes():
+    data = np.random.default_rng(0).normal(size=(64, 64)).astype(np.float32)
+    buffer = io.BytesIO()
+    fits.PrimaryHDU(data, frame_header(10.0, 0.0, 94, 6, 1, "r")).writeto(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def good():
+    return frame_bytes()
+
+
+class ScriptedDownloader:
+    """Serve the given bytes for each attempt instead of fetching URLs."""
+
+    def __init__(self, attempts):
+        self.attempts = list(attempts)
+        self.calls = 0
+
+    def download(self, urls, outdir):
+        content = self.attempts[min(self.calls, len(self.attempts) - 1)]
+        self.calls += 1
+        os.makedirs(outdir, exist_ok=True)
+        paths = []
+        for url in urls:
+            path = os.path.join(outdir, url.rsplit("/", 1)[-1])
+            with open(path, "wb") as f:
+                f.write(content)
+            paths.append(path)
+        return parfive.Results(paths)
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_valid_frames_pass(tmp_path, good):
+    assert verify_frame(write(tmp_path, NAME, good)) is None
+    assert verify_frame(write(tmp_path, NAME + ".bz2", bz2.compress(good))) is None
+
+
+def test_truncated_bz2_fails(tmp_path, good):
+    path = write(tmp_path, NAME + ".bz2", bz2.compress(good)[:-100])
+    assert verify_frame(path) == "truncated bz2 stream"
+
+
+def test_short_data_unit_fails(tmp_path, good):
+    path = write(tmp_path, NAME, good[: -2 * 2880])
+    assert verify_frame(path).startswith("size")
+
+
+def test_bad_frame_is_refetched(tmp_path, good):
+    downloader = ScriptedDownloader([good[:-2880], good])
+    url = f"http://example.org/{NAME}"
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        files, bad = download_verified(downloader, [url], str(tmp_path / "out"), ledger)
+        assert downloader.calls == 2
+        assert list(map(str, files)) == [str(tmp_path / "out" / NAME)] and not bad
+        assert ledger.state(NAME) == VERIFIED
+
+
+def test_bad_frame_is_quarantined_and_marked_corrupt(tmp_path, good):
+    downloader = ScriptedDownloader([bz2.compress(good)[:-100]])
+    url = f"http://example.org/{NAME}.bz2"
+    quarantine_dir = str(tmp_path / "quarantine")
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        files, bad = download_verified(
+            downloader, [url], str(tmp_path / "out"), ledger, 2, quarantine_dir
+        )
+        assert downloader.calls == 2
+        assert len(files) == 0 and bad == {url: "truncated bz2 stream"}
+        assert ledger.state(NAME + ".bz2") == CORRUPT
+    assert os.listdir(quarantine_dir) == [NAME + ".bz2"]
+    assert not os.path.exists(tmp_path / "out" / (NAME + ".bz2"))
+
+
+def test_truncated_frame_on_disk_is_not_present(tmp_path, good):
+    write(tmp_path, NAME + ".bz2", bz2.compress(good)[:-100])
+    names = [NAME, NAME.replace("-r-", "-g-")]
+    write(tmp_path, names[1], good)
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        assert frames_on_disk(names, str(tmp_path), ledger).tolist() == [False, True]
+        assert ledger.reached([*names, NAME + ".bz2"], VERIFIED) == {names[1]}
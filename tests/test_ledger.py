@@ -0,0 +1,65 @@
+import importlib
+import os
+
+import pandas as pd
+
+from hermes.benchmark import make_catalog
+from hermes.instrumentation import METRICS
+from hermes.ledger import CORRUPT, CUT, UPLOADED, Ledger, filter_pending
+
+
+def test_marks_accumulate_and_survive_reopening(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    with Ledger(path) as ledger:
+        ledger.mark([1, 2], CUT)
+        ledger.mark([2], UPLOADED)
+        ledger.mark([2], CUT)
+    with Ledger(path) as ledger:
+        assert ledger.state(2) == CUT | UPLOADED
+        assert ledger.done(CUT | UPLOADED) == {"2"}
+        assert ledger.reached([1, 2, 3], CUT) == {"1", "2"}
+        assert ledger.pending([1, 2, 3], CUT).tolist() == [False, False, True]
+        assert not ledger.done(CORRUPT)
+        df = pd.DataFrame({"objID": [1, 2, 3]})
+        assert filter_pending(df, ledger, UPLOADED)["objID"].tolist() == [1, 3]
+
+
+def test_rows_are_done_only_once_every_band_is_cut(tmp_path, monkeypatch):
+    # The dataset creator opens its log files in the working directory
+    monkeypatch.chdir(tmp_path)
+    creator = importlib.import_module("hermes.dataset_creator_parallel")
+    frames = str(tmp_path / "frames")
+    catalog = make_catalog(frames, n_objects=16, objects_per_frame=8)
+    missing = f"{frames}/frame-z-000094-6-0001.fits"
+    os.remove(missing)
+    ledger_path = str(tmp_path / "ledger.sqlite")
+
+    def build():
+        METRICS.drain()
+        creator.save_data(
+            catalog,
+            str(tmp_path / "dataset"),
+            frames,
+            output_format="shards",
+            shard_size=8,
+            ledger_path=ledger_path,
+            max_workers=1,
+        )
+        return METRICS.drain()["counters"]
+
+    build()
+    with Ledger(ledger_path) as ledger:
+        first = ledger.done(CUT)
+    assert first and first <= set(
+        catalog.loc[catalog["field"] == 0, "objID"].astype(str)
+    )
+
+    # Restoring the band lets a restart cut field 1 while skipping field 0
+    make_catalog(frames, n_objects=16, objects_per_frame=8)
+    counters = build()
+    assert counters["skipped_done"] == len(first)
+    with Ledger(ledger_path) as ledger:
+        done = ledger.done(CUT)
+    index = pd.read_csv(tmp_path / "dataset" / "index.csv")
+    assert set(index["objID"].astype(str)) == done > first
+    assert not index["objID"].duplicated().any()
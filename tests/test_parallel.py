@@ -0,0 +1,19 @@
+from hermes import wcs_cache
+from hermes.parallel import bounded_map
+
+
+def cache_settings(task):
+    return wcs_cache.WCS_CACHE.maxsize, wcs_cache.WCS_CACHE.path
+
+
+def test_initializer_configures_every_worker(tmp_path):
+    path = str(tmp_path / "wcs.sqlite")
+    results = bounded_map(
+        cache_settings,
+        [(task,) for task in range(8)],
+        max_workers=2,
+        initializer=wcs_cache.configure_wcs_cache,
+        initargs=(7, path),
+    )
+    assert set(results) == {(7, path)}
+    assert wcs_cache.WCS_CACHE.path is None
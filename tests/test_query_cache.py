@@ -0,0 +1,55 @@
+import os
+import time
+
+import pandas as pd
+
+from hermes.instrumentation import METRICS
+from hermes.query_cache import QueryCache, normalise_sql, read_cached
+
+DF = pd.DataFrame({"objID": range(1000), "ra": 0.5})
+
+
+def test_whitespace_does_not_change_the_key(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    sql = "SELECT objID\n  FROM PhotoObj\tWHERE ra > 0"
+    assert normalise_sql(sql) == "SELECT objID FROM PhotoObj WHERE ra > 0"
+    assert cache.key(normalise_sql(sql), 4) == cache.key(normalise_sql(" " + sql), 4)
+    assert cache.key(normalise_sql(sql), 4) != cache.key(normalise_sql(sql), 8)
+
+
+def test_entries_round_trip_and_expire(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl=60)
+    METRICS.drain()
+    assert cache.get("a") is None
+    cache.put_frame("a", DF)
+    assert os.listdir(tmp_path) == ["a.parquet"]
+    pd.testing.assert_frame_equal(read_cached(cache.get("a")), DF)
+    copy = read_cached(cache.get("a"), str(tmp_path / "copy.parquet"))
+    pd.testing.assert_frame_equal(pd.read_parquet(copy), DF)
+
+    # Written longer ago than the TTL
+    old = time.time() - 120
+    os.utime(cache.path("a"), (old, old))
+    assert cache.get("a") is None
+    assert not os.path.exists(cache.path("a"))
+    assert METRICS.drain()["counters"] == {"query_cache_miss": 2, "query_cache_hit": 2}
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path):
+    source = tmp_path / "source.parquet"
+    DF.to_parquet(source, index=False)
+    cache = QueryCache(str(tmp_path / "cache"), max_bytes=3.5 * source.stat().st_size)
+    now = time.time()
+    for age, key in enumerate(["a", "b", "c"]):
+        cache.put_file(key, str(source))
+        os.utime(cache.path(key), (now - 100 + age, now))
+    # Reading the oldest entry makes it the most recently used one
+    assert cache.get("a") is not None
+    cache.put_file("d", str(source))
+    assert sorted(os.listdir(cache.cache_dir)) == [
+        "a.parquet",
+        "c.parquet",
+        "d.parquet",
+    ]
+    cache.clear()
+    assert not os.listdir(cache.cache_dir)
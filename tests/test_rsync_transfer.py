@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import pytest
+
+from hermes.ledger import DOWNLOADED, Ledger
+from hermes.rsync_transfer import transfer
+
+needs_rsync = pytest.mark.skipif(
+    shutil.which("rsync") is None, reason="rsync is not installed"
+)
+
+PATHS = [
+    f"eboss/photoObj/frames/301/94/6/frame-{band}-000094-6-0001.fits.bz2"
+    for band in "gr"
+]
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "source"
+    for path in PATHS:
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_bytes(path.encode())
+    return str(root) + "/"
+
+
+def run(tmp_path, source, ledger, **kwargs):
+    return transfer(
+        PATHS,
+        source,
+        str(tmp_path / "dest"),
+        n_shards=2,
+        max_procs=2,
+        manifest_dir=str(tmp_path / "manifests"),
+        ledger=ledger,
+        backoff=0,
+        **kwargs,
+    )
+
+
+@needs_rsync
+def test_transfers_from_local_path(tmp_path, source):
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        assert run(tmp_path, source, ledger) == []
+        assert ledger.done(DOWNLOADED) == set(map(os.path.basename, PATHS))
+    for path in PATHS:
+        assert (tmp_path / "dest" / path).read_bytes() == path.encode()
+
+
+def test_missing_rsync_fails_the_shards(tmp_path, source):
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        failed = run(tmp_path, source, ledger, retries=1, rsync_bin="no-such-rsync")
+        assert len(failed) == 2
+        assert not ledger.done(DOWNLOADED)
+
+
+def test_rerun_skips_downloaded_frames(tmp_path, source):
+    with Ledger(str(tmp_path / "ledger.sqlite")) as ledger:
+        ledger.mark([os.path.basename(PATHS[0])], DOWNLOADED)
+        failed = run(tmp_path, source, ledger, retries=0, rsync_bin="no-such-rsync")
+        assert len(failed) == 1
+        with open(failed[0]) as f:
+            assert f.read().split() == PATHS[1:]
+        ledger.mark([os.path.basename(PATHS[1])], DOWNLOADED)
+        assert run(tmp_path, source, ledger, rsync_bin="no-such-rsync") == []
@@ -0,0 +1,25 @@
+import numpy as np
+
+from hermes.scheduler import key_chunks
+
+
+def chunk_lengths(keys, chunk_size):
+    return [len(chunk) for chunk in key_chunks(np.asarray(keys), chunk_size)]
+
+
+def test_large_key_gets_its_own_chunk():
+    assert chunk_lengths([0] * 50 + [1] * 300 + [2] * 30, 100) == [50, 300, 30]
+
+
+def test_chunks_never_split_a_key_or_overflow():
+    keys = np.repeat(np.arange(20), np.arange(1, 21) % 7 + 1)
+    chunks = key_chunks(keys, 10)
+    assert np.array_equal(np.concatenate(chunks), np.arange(len(keys)))
+    for chunk in chunks:
+        assert len(chunk) <= 10
+        if chunk[-1] + 1 < len(keys):
+            assert keys[chunk[-1]] != keys[chunk[-1] + 1]
+
+
+def test_empty_keys():
+    assert key_chunks(np.array([]), 10) == []
@@ -0,0 +1,104 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hermes.sqlcl import SQLCL
+
+PAGE_PATTERN = re.compile(r"p\.objID >= (\d+) AND p\.objID < (\d+)")
+OBJ_IDS = np.arange(1237645876861272064, 1237645876861272064 + 100)
+
+
+class SkyServerStub(BaseHTTPRequestHandler):
+    """Answer x_sql.aspx queries from a 100-row table, failing on request."""
+
+    queries = []
+    failures = 0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["cmd"][0]
+        type(self).queries.append(query)
+        if type(self).failures > 0:
+            type(self).failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if "MIN(p.objID)" in query:
+            body = f"lo,hi\n{OBJ_IDS[0]},{OBJ_IDS[-1]}\n"
+        else:
+            ids = OBJ_IDS
+            match = PAGE_PATTERN.search(query)
+            if match:
+                lo, hi = map(int, match.groups())
+                ids = ids[(ids >= lo) & (ids < hi)]
+            body = "objID,run,ra\n" + "".join(
+                f"{obj_id},94,{k * 0.5}\n" for k, obj_id in enumerate(ids)
+            )
+        body = ("#Table1\n" + body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    SkyServerStub.queries, SkyServerStub.failures = [], 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SkyServerStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/x_sql.aspx"
+    server.shutdown()
+    server.server_close()
+
+
+QUERY = "SELECT p.objID, p.run, p.ra FROM PhotoObj AS p WHERE p.ra > 0"
+
+
+def client(url, **kwargs):
+    return SQLCL(url=url, log_to_stdout=False, backoff_factor=0, **kwargs)
+
+
+def test_query_paged_splits_and_reassembles(url):
+    df = client(url).query_paged(QUERY, n_pages=2, row_limit=30, max_workers=2)
+    assert df["objID"].tolist() == OBJ_IDS.tolist()
+    # One bounds query, two pages, and further pages for every split
+    assert len(SkyServerStub.queries) > 3
+    assert all("(p.ra > 0) AND" in query for query in SkyServerStub.queries[1:])
+
+
+def test_columns_are_typed(url, tmp_path):
+    df = client(url).query_database(QUERY)
+    assert df.dtypes.to_dict() == {
+        "objID": np.uint64,
+        "run": np.uint16,
+        "ra": np.float64,
+    }
+    path = client(url).query_database(QUERY, output_path=str(tmp_path / "out.parquet"))
+    assert pd.read_parquet(path).dtypes.equals(df.dtypes)
+
+
+def test_server_errors_are_retried(url):
+    SkyServerStub.failures = 2
+    df = client(url).query_database(QUERY)
+    assert len(df) == len(OBJ_IDS)
+    assert len(SkyServerStub.queries) == 3
+
+
+def test_cache_hit_skips_http(url, tmp_path):
+    sqlcl = client(url, cache_dir=str(tmp_path / "cache"))
+    first = sqlcl.query_paged(QUERY, n_pages=4)
+    n_queries = len(SkyServerStub.queries)
+    # Whitespace and comments do not change the cache key
+    second = sqlcl.query_paged(QUERY.replace(" ", "\n  ") + " -- again", n_pages=4)
+    assert len(SkyServerStub.queries) == n_queries
+    pd.testing.assert_frame_equal(first, second)
+    sqlcl.query_paged(QUERY, n_pages=4, use_cache=False)
+    assert len(SkyServerStub.queries) > n_queries
@@ -0,0 +1,85 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from hermes.uploader import BatchUploader, split_dest
+
+needs_rclone = pytest.mark.skipif(
+    shutil.which("rclone") is None, reason="rclone is not installed"
+)
+
+
+@pytest.fixture
+def frames(tmp_path):
+    paths = []
+    for name in ["a.fits", "b.fits"]:
+        path = tmp_path / "frames" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(name.encode() * 100)
+        paths.append(str(path))
+    return paths
+
+
+def upload(tmp_path, items, **kwargs):
+    done, failed = threading.Event(), threading.Event()
+    uploader = BatchUploader(
+        staging_dir=str(tmp_path / "staging"), flush_interval=0.1, **kwargs
+    )
+    with uploader:
+        uploader.put(items, on_done=done.set, on_failed=failed.set)
+    return uploader, done.is_set(), failed.is_set()
+
+
+def test_split_dest():
+    assert split_dest("gdrive:hermes/r") == ("gdrive", "hermes/r")
+    assert split_dest("/data/out") == ("", "/data/out")
+    assert split_dest("out") == ("", os.path.abspath("out"))
+
+
+@needs_rclone
+def test_uploads_to_local_path(tmp_path, frames):
+    dest = tmp_path / "dest"
+    uploader, done, failed = upload(tmp_path, [(path, str(dest)) for path in frames])
+    assert done and not failed
+    assert sorted(os.listdir(dest)) == ["a.fits", "b.fits"]
+    assert uploader.stats()["uploaded_files"] == 2
+    assert not any(files for _, _, files in os.walk(tmp_path / "staging"))
+
+
+@needs_rclone
+def test_uploads_to_alias_remote(tmp_path, frames, monkeypatch):
+    monkeypatch.setenv("RCLONE_CONFIG_HERMESTEST_TYPE", "alias")
+    monkeypatch.setenv("RCLONE_CONFIG_HERMESTEST_REMOTE", str(tmp_path / "remote"))
+    items = [(path, "hermestest:grids/r") for path in frames]
+    uploader, done, failed = upload(tmp_path, items)
+    assert done and not failed
+    assert sorted(os.listdir(tmp_path / "remote" / "grids" / "r")) == [
+        "a.fits",
+        "b.fits",
+    ]
+
+
+def test_gives_up_and_cleans_staging(tmp_path, frames):
+    items = [(path, "hermesmissingremote:grids") for path in frames]
+    uploader, done, failed = upload(tmp_path, items, retries=1)
+    assert failed and not done
+    assert uploader.stats()["failed_files"] == 2
+    assert uploader.stats()["uploaded_files"] == 0
+    assert not any(files for _, _, files in os.walk(tmp_path / "staging"))
+
+
+def test_raising_callback_keeps_thread_alive(tmp_path, frames):
+    def explode():
+        raise RuntimeError("callback failed")
+
+    failed = threading.Event()
+    uploader = BatchUploader(
+        staging_dir=str(tmp_path / "staging"), flush_interval=0.1, retries=0
+    )
+    with uploader:
+        uploader.put([(frames[0], "hermesmissingremote:a")], on_failed=explode)
+        uploader.put([(frames[1], "hermesmissingremote:b")], on_failed=failed.set)
+    assert failed.is_set()
+    assert uploader.stats()["failed_files"] == 2
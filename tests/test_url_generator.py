@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from hermes.url_generator import (
+    BANDS,
+    FITS_BASE_URL,
+    check_against_sdss_access,
+    frame_codes,
+    frame_file_names,
+    frame_urls,
+    get_fits_url,
+    unique_frames,
+)
+
+
+def catalog(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "rerun": rng.choice([301, 40], n),
+            "run": rng.choice([94, 125, 999999], n),
+            "camcol": rng.integers(1, 7, n),
+            "field": rng.choice([11, 12, 9999], n),
+        },
+        index=rng.permutation(np.arange(1000, 1000 + n)),
+    )
+
+
+def test_frame_codes_unpack_to_the_unique_frames():
+    df = catalog()
+    frames, inverse = frame_codes(df)
+    assert not frames.duplicated().any()
+    pd.testing.assert_frame_equal(
+        frames.iloc[inverse].reset_index(drop=True),
+        df.reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_names_and_urls_match_per_row_formatting():
+    df = catalog()
+    names = frame_file_names(df, "g")
+    urls = frame_urls(df, "i")
+    assert names.index.equals(df.index) and urls.index.equals(df.index)
+    for row in df.itertuples():
+        name = f"frame-g-{row.run:06d}-{row.camcol}-{row.field:04d}.fits"
+        assert names[row.Index] == name
+        assert urls[row.Index] == get_fits_url(
+            row.run, row.rerun, row.camcol, row.field, "i"
+        )
+    check_against_sdss_access(df, n=20)
+
+
+def test_unique_frames_lists_every_band_once():
+    df = catalog()
+    frames = unique_frames(df)
+    n_frames = len(df.drop_duplicates())
+    assert len(frames) == n_frames * len(BANDS)
+    assert not frames["url"].duplicated().any()
+    assert frames["url"].str.startswith(FITS_BASE_URL).all()
+    assert (
+        frames["url"].str.rsplit("/", n=1).str[-1] == frames["file_name"] + ".bz2"
+    ).all()